@@ -0,0 +1,403 @@
+import argparse
+import asyncio
+import csv
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from datetime import date, datetime
+from typing import Any, Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+from sqlalchemy import text
+
+from database import engine
+from user.hashing import BCRYPT_ROUNDS, hash_many
+
+# массовый импорт из CSV/NDJSON: строки потоком идут через COPY во временную staging-таблицу,
+# затем проверяются и переносятся в основные таблицы одним INSERT ... SELECT в одной транзакции
+# пользователи в файлах идентифицируются по email, справочники - по названию
+CHUNK_SIZE = int(os.getenv('IMPORT_CHUNK_SIZE', '10000'))
+HASH_BATCH_SIZE = 200  # паролей в одной задаче пула процессов
+INT4_RANGE = (-2 ** 31, 2 ** 31 - 1)  # значения integer-колонок вне диапазона сорвали бы весь COPY
+
+
+@dataclass
+class ImportColumn:
+    name: str
+    pg_type: str
+    parse: Callable[[str], Any]
+    required: bool = True
+
+
+def parse_date(value) -> date:
+    return value if isinstance(value, date) else date.fromisoformat(str(value)[:10])
+
+
+def parse_datetime(value) -> datetime:
+    return value if isinstance(value, datetime) else datetime.fromisoformat(str(value))
+
+
+@dataclass
+class ImportSpec:
+    columns: List[ImportColumn]
+    # (причина отказа, условие над staging-таблицей с псевдонимом s); проверки идут по порядку,
+    # строка получает первую сработавшую причину
+    checks: List[Tuple[str, str]]
+    merge: str  # INSERT ... SELECT из staging по строкам без отказа; должен возвращать строки через RETURNING
+    after_merge: Optional[str] = None  # пересчет производных данных по вставленным строкам (CTE merged)
+
+    def column_index(self, name: str) -> int:
+        return [column.name for column in self.columns].index(name)
+
+
+def duplicate_in_file(*columns: str) -> str:
+    key = ', '.join(columns)
+    return (f's.line_no IN (SELECT line_no FROM (SELECT line_no, row_number() OVER '
+            f'(PARTITION BY {key} ORDER BY line_no) AS position FROM staging) AS d WHERE d.position > 1)')
+
+
+def user_by_email(column: str, role_filter: str = '') -> str:
+    return f'NOT EXISTS (SELECT 1 FROM user_profile u WHERE u.email = s.{column} AND u.is_deleted = false{role_filter})'
+
+
+# хеш bcrypt: префикс $2a$/$2b$/$2y$, двузначный cost, 22 символа соли и 31 символ хеша
+BCRYPT_HASH_PATTERN = r'^\$2[aby]\$[0-9]{2}\$[./A-Za-z0-9]{53}$'
+TAROT_ROLE_FILTER = ' AND u.role_id = (SELECT role_id FROM role WHERE role_name = :tarot_role)'
+
+IMPORT_SPECS: Dict[str, ImportSpec] = {
+    'users': ImportSpec(
+        columns=[
+            ImportColumn('username', 'text', str),
+            ImportColumn('email', 'text', str),
+            ImportColumn('phone_number', 'text', str),
+            ImportColumn('password', 'text', str, required=False),
+            ImportColumn('password_hashed', 'text', str, required=False),
+            ImportColumn('date_birth', 'date', parse_date),
+            ImportColumn('role', 'text', str),
+            ImportColumn('first_name', 'text', str, required=False),
+            ImportColumn('second_name', 'text', str, required=False),
+            ImportColumn('user_description', 'text', str, required=False),
+            ImportColumn('tarot_experience', 'double precision', float, required=False),
+        ],
+        checks=[
+            # готовый хеш переносится как есть, поэтому должен быть bcrypt, иначе пользователь не сможет войти
+            ('invalid password_hashed', f"s.password_hashed !~ '{BCRYPT_HASH_PATTERN}'"),
+            ('unknown role', 'NOT EXISTS (SELECT 1 FROM role r WHERE r.role_name = s.role)'),
+            ('duplicate username in file', duplicate_in_file('username')),
+            ('duplicate email in file', duplicate_in_file('email')),
+            ('duplicate phone_number in file', duplicate_in_file('phone_number')),
+            ('username already exists', 'EXISTS (SELECT 1 FROM user_profile u WHERE u.username = s.username)'),
+            ('email already exists', 'EXISTS (SELECT 1 FROM user_profile u WHERE u.email = s.email)'),
+            ('phone_number already exists',
+             'EXISTS (SELECT 1 FROM user_profile u WHERE u.phone_number = s.phone_number)'),
+        ],
+        merge='''
+            INSERT INTO user_profile (role_id, username, email, phone_number, password_hashed, first_name,
+                                      second_name, date_birth, date_registration, is_deleted, user_description,
+                                      tarot_experience, tarot_rating, review_count, rating_sum)
+            SELECT r.role_id, s.username, s.email, s.phone_number, s.password_hashed, s.first_name, s.second_name,
+                   s.date_birth, now(), false, s.user_description, s.tarot_experience, 0, 0, 0
+            FROM staging s JOIN role r ON r.role_name = s.role
+            WHERE s.reject_reason IS NULL
+            ON CONFLICT DO NOTHING
+            RETURNING user_id
+        ''',
+        # состояние уведомлений как при регистрации: прежние рассылки новым пользователям не адресовались
+        after_merge='''
+            INSERT INTO user_notification_state (user_id, read_watermark, unread_count)
+            SELECT m.user_id, (SELECT coalesce(max(notification_id), 0) FROM system_notification), 0
+            FROM merged m
+        '''
+    ),
+    'tarot_specializations': ImportSpec(
+        columns=[
+            ImportColumn('tarot_email', 'text', str),
+            ImportColumn('specialization', 'text', str),
+        ],
+        checks=[
+            ('unknown tarot', user_by_email('tarot_email', TAROT_ROLE_FILTER)),
+            ('unknown specialization',
+             'NOT EXISTS (SELECT 1 FROM specialization p WHERE p.specialization_name = s.specialization)'),
+            ('duplicate bond in file', duplicate_in_file('tarot_email', 'specialization')),
+            ('bond already exists', 'EXISTS (SELECT 1 FROM tarot_specialization t JOIN user_profile u '
+                                    'ON u.user_id = t.tarot_id JOIN specialization p '
+                                    'ON p.specialization_id = t.specialization_id '
+                                    'WHERE u.email = s.tarot_email AND p.specialization_name = s.specialization)'),
+        ],
+        merge='''
+            INSERT INTO tarot_specialization (specialization_id, tarot_id)
+            SELECT p.specialization_id, u.user_id
+            FROM staging s
+            JOIN user_profile u ON u.email = s.tarot_email
+            JOIN specialization p ON p.specialization_name = s.specialization
+            WHERE s.reject_reason IS NULL
+            ON CONFLICT DO NOTHING
+            RETURNING tarot_specialization_id
+        '''
+    ),
+    'services': ImportSpec(
+        columns=[
+            ImportColumn('tarot_email', 'text', str),
+            ImportColumn('service_name', 'text', str),
+            ImportColumn('service_description', 'text', str, required=False),
+            ImportColumn('specialization', 'text', str),
+            ImportColumn('service_price', 'integer', int),
+        ],
+        checks=[
+            ('negative price', 's.service_price < 0'),
+            ('unknown tarot', user_by_email('tarot_email', TAROT_ROLE_FILTER)),
+            ('unknown specialization',
+             'NOT EXISTS (SELECT 1 FROM specialization p WHERE p.specialization_name = s.specialization)'),
+            ('duplicate service_name in file', duplicate_in_file('service_name')),
+            ('service_name already exists', 'EXISTS (SELECT 1 FROM service v WHERE v.service_name = s.service_name)'),
+        ],
+        merge='''
+            INSERT INTO service (tarot_id, service_name, service_description, specialization_id, service_price)
+            SELECT u.user_id, s.service_name, s.service_description, p.specialization_id, s.service_price
+            FROM staging s
+            JOIN user_profile u ON u.email = s.tarot_email
+            JOIN specialization p ON p.specialization_name = s.specialization
+            WHERE s.reject_reason IS NULL
+            ON CONFLICT DO NOTHING
+            RETURNING service_id
+        '''
+    ),
+    'favorites': ImportSpec(
+        columns=[
+            ImportColumn('user_email', 'text', str),
+            ImportColumn('tarot_email', 'text', str),
+        ],
+        checks=[
+            ('unknown user', user_by_email('user_email')),
+            ('unknown tarot', user_by_email('tarot_email', TAROT_ROLE_FILTER)),
+            ('duplicate favorite in file', duplicate_in_file('user_email', 'tarot_email')),
+        ],
+        merge='''
+            INSERT INTO user_favorite_tarots (user_id, tarot_id)
+            SELECT u.user_id, t.user_id
+            FROM staging s
+            JOIN user_profile u ON u.email = s.user_email
+            JOIN user_profile t ON t.email = s.tarot_email
+            WHERE s.reject_reason IS NULL
+            ON CONFLICT DO NOTHING
+            RETURNING favorite_tarot_id
+        '''
+    ),
+    'history': ImportSpec(
+        columns=[
+            ImportColumn('user_email', 'text', str),
+            ImportColumn('service_name', 'text', str),
+            ImportColumn('status', 'text', str),
+            ImportColumn('review_title', 'text', str, required=False),
+            ImportColumn('review_text', 'text', str, required=False),
+            ImportColumn('review_value', 'integer', int, required=False),
+            ImportColumn('review_date_time', 'timestamp', parse_datetime, required=False),
+        ],
+        checks=[
+            ('review_value out of range', 's.review_value IS NOT NULL AND s.review_value NOT BETWEEN 0 AND 5'),
+            ('unknown user', user_by_email('user_email')),
+            ('unknown service', 'NOT EXISTS (SELECT 1 FROM service v WHERE v.service_name = s.service_name)'),
+            ('unknown status', 'NOT EXISTS (SELECT 1 FROM status t WHERE t.status_name = s.status)'),
+        ],
+        merge='''
+            INSERT INTO user_service_history (user_id, service_id, tarot_id, status_id, review_title, review_text,
+                                              review_value, review_date_time)
+            SELECT u.user_id, v.service_id, v.tarot_id, t.status_id, s.review_title, s.review_text,
+                   coalesce(s.review_value, 0), coalesce(s.review_date_time, now())
+            FROM staging s
+            JOIN user_profile u ON u.email = s.user_email
+            JOIN service v ON v.service_name = s.service_name
+            JOIN status t ON t.status_name = s.status
+            WHERE s.reject_reason IS NULL
+            RETURNING tarot_id, review_value
+        ''',
+        # рейтинг тарологов меняется так же, как при update_review: сумма оценок и количество отзывов
+        after_merge='''
+            UPDATE user_profile p
+            SET rating_sum = p.rating_sum + m.value_sum,
+                review_count = coalesce(p.review_count, 0) + m.reviews,
+                tarot_rating = CAST(p.rating_sum + m.value_sum AS double precision)
+                               / NULLIF(coalesce(p.review_count, 0) + m.reviews, 0)
+            FROM (SELECT tarot_id, sum(review_value) AS value_sum, count(*) FILTER (WHERE review_value > 0) AS reviews
+                  FROM merged GROUP BY tarot_id) AS m
+            WHERE p.user_id = m.tarot_id AND m.reviews > 0
+        '''
+    ),
+}
+
+
+# (номер строки, запись, причина отказа); нечитаемая строка отклоняется, а не прерывает импорт
+def read_records(path: str, file_format: str) -> Iterator[Tuple[int, Optional[Dict[str, Any]], Optional[str]]]:
+    with open(path, encoding='utf-8', newline='') as source:
+        if file_format == 'csv':
+            # номер строки файла с учетом заголовка
+            for line_no, row in enumerate(csv.DictReader(source), start=2):
+                yield line_no, row, None
+        else:
+            for line_no, line in enumerate(source, start=1):
+                if not line.strip():
+                    continue
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    yield line_no, None, 'invalid json'
+                    continue
+                if not isinstance(record, dict):
+                    yield line_no, None, 'json value is not an object'
+                    continue
+                yield line_no, record, None
+
+
+# приведение типов построчно; ошибки типов отклоняются сразу, а связи проверяются уже в базе
+def parse_record(spec: ImportSpec, record: Dict[str, Any]) -> Tuple[Optional[list], Optional[str]]:
+    values = []
+    for column in spec.columns:
+        raw = record.get(column.name)
+        if raw is None or raw == '':
+            if column.required:
+                return None, f'missing {column.name}'
+            values.append(None)
+            continue
+        try:
+            value = column.parse(raw)
+        except (TypeError, ValueError, OverflowError):
+            return None, f'invalid {column.name}'
+        if column.pg_type == 'integer' and not INT4_RANGE[0] <= value <= INT4_RANGE[1]:
+            return None, f'invalid {column.name}'
+        values.append(value)
+    return values, None
+
+
+class BulkImporter:
+    def __init__(self, entity: str, executor: Optional[ProcessPoolExecutor], rounds: int = BCRYPT_ROUNDS):
+        self.entity = entity
+        self.spec = IMPORT_SPECS[entity]
+        self.executor = executor
+        self.rounds = rounds
+        self.rejects: List[Tuple[int, str]] = []
+        self.parse_rejects = 0
+        self.staged = 0
+
+    # пароли хешируются в пуле процессов пачками; уже хешированные пароли (миграция) переносятся как есть
+    async def hash_passwords(self, rows: List[list]):
+        password_index = self.spec.column_index('password')
+        hashed_index = self.spec.column_index('password_hashed')
+        pending = [row for row in rows if row[hashed_index] is None]
+        loop = asyncio.get_running_loop()
+        batches = [pending[start:start + HASH_BATCH_SIZE] for start in range(0, len(pending), HASH_BATCH_SIZE)]
+        results = await asyncio.gather(*(
+            loop.run_in_executor(self.executor, hash_many, [row[password_index] for row in batch], self.rounds)
+            for batch in batches))
+        for batch, hashes in zip(batches, results):
+            for row, hashed_password in zip(batch, hashes):
+                row[hashed_index] = hashed_password
+        for row in rows:
+            row[password_index] = None  # открытый пароль не попадает даже во временную таблицу
+
+    async def copy_chunk(self, driver_connection, chunk: List[list]):
+        if self.entity == 'users':
+            await self.hash_passwords(chunk)
+        await driver_connection.copy_records_to_table(
+            'staging', records=[tuple(row) for row in chunk],
+            columns=['line_no'] + [column.name for column in self.spec.columns])
+        self.staged += len(chunk)
+
+    async def stage(self, connection, path: str, file_format: str):
+        columns = ', '.join(f'{column.name} {column.pg_type}' for column in self.spec.columns)
+        await connection.execute(text(
+            f'CREATE TEMPORARY TABLE staging (line_no bigint PRIMARY KEY, {columns}, reject_reason text) ON COMMIT DROP'))
+        raw_connection = await connection.get_raw_connection()
+        driver_connection = raw_connection.driver_connection
+
+        chunk = []
+        for line_no, record, reason in read_records(path, file_format):
+            values = None
+            if reason is None:
+                values, reason = parse_record(self.spec, record)
+            if self.entity == 'users' and values is not None and \
+                    values[self.spec.column_index('password')] is None and \
+                    values[self.spec.column_index('password_hashed')] is None:
+                values, reason = None, 'missing password'
+            if reason is not None:
+                self.rejects.append((line_no, reason))
+                self.parse_rejects += 1
+                continue
+            chunk.append([line_no] + values)
+            if len(chunk) >= CHUNK_SIZE:
+                await self.copy_chunk(driver_connection, chunk)
+                chunk = []
+        if chunk:
+            await self.copy_chunk(driver_connection, chunk)
+        await connection.execute(text('ANALYZE staging'))
+
+    async def validate(self, connection, tarot_role: str):
+        for reason, condition in self.spec.checks:
+            parameters = {'reason': reason}
+            if ':tarot_role' in condition:
+                parameters['tarot_role'] = tarot_role
+            await connection.execute(text(
+                f'UPDATE staging s SET reject_reason = :reason WHERE s.reject_reason IS NULL AND ({condition})'), parameters)
+        rejected = await connection.execute(text(
+            'SELECT line_no, reject_reason FROM staging WHERE reject_reason IS NOT NULL ORDER BY line_no'))
+        self.rejects.extend(rejected.all())
+
+    async def merge(self, connection) -> int:
+        if self.spec.after_merge is None:
+            merged = await connection.execute(text(self.spec.merge))
+            return len(merged.all())
+        merged = await connection.execute(text(
+            f'WITH merged AS ({self.spec.merge}), updated AS ({self.spec.after_merge}) '
+            f'SELECT count(*) FROM merged'))
+        return merged.scalar_one()
+
+    async def run(self, path: str, file_format: str, tarot_role: str, dry_run: bool) -> Dict[str, Any]:
+        started = time.perf_counter()
+        async with engine.connect() as connection:
+            async with connection.begin() as transaction:
+                # COPY и проверки по всей staging-таблице дольше statement_timeout пула; SET LOCAL действует
+                # только в этой транзакции и не остается на соединении, возвращаемом в пул
+                await connection.execute(text('SET LOCAL statement_timeout = 0'))
+                await self.stage(connection, path, file_format)
+                await self.validate(connection, tarot_role)
+                inserted = await self.merge(connection)
+                if dry_run:
+                    await transaction.rollback()
+        return {
+            'entity': self.entity,
+            'rows': self.staged + self.parse_rejects,
+            'inserted': inserted,
+            'rejected': len(self.rejects),
+            # строки, прошедшие проверки, но уже вставленные параллельно другим процессом (ON CONFLICT)
+            'skipped': self.staged + self.parse_rejects - len(self.rejects) - inserted,
+            'dry_run': dry_run,
+            'seconds': round(time.perf_counter() - started, 2)
+        }
+
+
+def write_rejects(path: str, rejects: Sequence[Tuple[int, str]]):
+    with open(path, 'w', encoding='utf-8', newline='') as report:
+        writer = csv.writer(report)
+        writer.writerow(['line_no', 'reason'])
+        writer.writerows(sorted(rejects))
+
+
+if __name__ == '__main__':
+    from reference import TAROT_ROLE_NAME
+
+    parser = argparse.ArgumentParser(description='Bulk import rows from CSV or NDJSON through COPY')
+    parser.add_argument('entity', choices=sorted(IMPORT_SPECS))
+    parser.add_argument('path')
+    parser.add_argument('--format', choices=('csv', 'ndjson'), help='by default taken from the file extension')
+    parser.add_argument('--rejects', help='write rejected lines with reasons to this CSV file')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help='password hashing processes')
+    parser.add_argument('--dry-run', action='store_true', help='validate and report without committing')
+    args = parser.parse_args()
+
+    source_format = args.format or ('ndjson' if args.path.endswith(('.ndjson', '.jsonl')) else 'csv')
+    with ProcessPoolExecutor(max_workers=args.workers) as pool:
+        importer = BulkImporter(args.entity, pool)
+        summary = asyncio.run(importer.run(args.path, source_format, TAROT_ROLE_NAME, args.dry_run))
+    if args.rejects:
+        write_rejects(args.rejects, importer.rejects)
+    print(json.dumps(summary, indent=2))
@@ -0,0 +1,240 @@
+import asyncio
+import functools
+import inspect
+import json
+import logging
+import math
+import os
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Iterable, List, Optional
+
+from fastapi import BackgroundTasks, Request, Response
+from fastapi.encoders import jsonable_encoder
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from database import async_session_maker, database_settings, is_pinned_to_primary
+
+logger = logging.getLogger(__name__)
+
+CACHE_BACKEND = os.getenv('CACHE_BACKEND', 'memory')  # memory или redis
+CACHE_MAX_ENTRIES = int(os.getenv('CACHE_MAX_ENTRIES', '10000'))  # размер LRU для memory
+REDIS_URL = os.getenv('REDIS_URL', 'redis://localhost')
+CACHE_PREFIX = os.getenv('CACHE_PREFIX', 'taro-cache')
+TAG_VERSION_TTL = 3600  # сколько хранится версия тега в Redis; должна переживать самое долгое вычисление
+
+# аргументы эндпоинтов, которые не входят в ключ кеша
+_NOT_KEY_TYPES = (AsyncSession, Request, Response, BackgroundTasks)
+# запрос, который FastAPI передает обертке кеша для проверки закрепления клиента за основной базой
+_CACHE_REQUEST_ARGUMENT = 'cache_request'
+
+
+# LRU-кеш в памяти процесса
+class InMemoryBackend:
+    def __init__(self, max_entries: int = CACHE_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._entries: 'OrderedDict[str, tuple]' = OrderedDict()
+        self._tags: Dict[str, set] = {}
+        self._versions: Dict[str, float] = {}
+
+    async def get(self, key: str) -> Optional[str]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        value, expires_at = entry
+        if expires_at <= time.time():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    async def set(self, key: str, value: str, ttl: float, tags: Iterable[str] = ()):
+        self._entries[key] = (value, time.time() + ttl)
+        self._entries.move_to_end(key)
+        for tag in tags:
+            self._tags.setdefault(tag, set()).add(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    async def invalidate_tag(self, tag: str) -> int:
+        self._versions[tag] = time.time()
+        keys = self._tags.pop(tag, set())
+        for key in keys:
+            self._entries.pop(key, None)
+        return len(keys)
+
+    async def tag_versions(self, tags: Iterable[str]) -> List[float]:
+        return [self._versions.get(tag, 0.0) for tag in tags]
+
+
+# backend для Redis и совместимых по протоколу серверов; client - redis.asyncio.Redis
+# или любая замена с методами get / set(ex=) / sadd / expire / smembers / delete (например, в тестах);
+# версия тега (время последней инвалидации) общая для всех процессов
+class RedisBackend:
+    def __init__(self, client, prefix: str = CACHE_PREFIX):
+        self.client = client
+        self.prefix = prefix
+
+    def _tag_key(self, tag: str) -> str:
+        return f'{self.prefix}:tag:{tag}'
+
+    def _tag_version_key(self, tag: str) -> str:
+        return f'{self.prefix}:tag-version:{tag}'
+
+    async def get(self, key: str) -> Optional[str]:
+        value = await self.client.get(key)
+        if isinstance(value, bytes):
+            value = value.decode('utf-8')
+        return value
+
+    async def set(self, key: str, value: str, ttl: float, tags: Iterable[str] = ()):
+        expire_seconds = max(int(math.ceil(ttl)), 1)
+        await self.client.set(key, value, ex=expire_seconds)
+        for tag in tags:
+            tag_key = self._tag_key(tag)
+            await self.client.sadd(tag_key, key)
+            await self.client.expire(tag_key, expire_seconds)
+
+    async def invalidate_tag(self, tag: str) -> int:
+        await self.client.set(self._tag_version_key(tag), str(time.time()), ex=TAG_VERSION_TTL)
+        tag_key = self._tag_key(tag)
+        keys = list(await self.client.smembers(tag_key))
+        await self.client.delete(tag_key, *keys)
+        return len(keys)
+
+    async def tag_versions(self, tags: Iterable[str]) -> List[float]:
+        versions = []
+        for tag in tags:
+            value = await self.client.get(self._tag_version_key(tag))
+            versions.append(float(value) if value is not None else 0.0)
+        return versions
+
+
+def create_backend(kind: str = CACHE_BACKEND):
+    if kind == 'memory':
+        return InMemoryBackend()
+    if kind == 'redis':
+        # redis - необязательная зависимость, нужна только для этого backend
+        from redis import asyncio as aioredis
+        return RedisBackend(aioredis.from_url(REDIS_URL))
+    raise ValueError(f'Unknown cache backend: {kind}')
+
+
+# кеш ответов эндпоинтов: TTL на маршрут, инвалидация по тегам, stale-while-revalidate
+# и защита от stampede (холодный ключ вычисляется один раз на процесс)
+class ResponseCache:
+    def __init__(self, backend, prefix: str = CACHE_PREFIX):
+        self.backend = backend
+        self.prefix = prefix
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self._refresh_tasks = set()
+
+    def cached(self, ttl: float, stale_ttl: float = 0, tags: Optional[Callable[..., List[str]]] = None):
+        def decorator(func):
+            signature = inspect.signature(func)
+
+            @functools.wraps(func)
+            async def wrapper(*args, **kwargs):
+                request = kwargs.pop(_CACHE_REQUEST_ARGUMENT, None)
+                # клиент после своей записи читает основную базу мимо кеша: общий кеш мог быть заполнен
+                # до записи, а свежее значение не кладется, чтобы не обходить кеш остальных клиентов
+                if request is not None and is_pinned_to_primary(request):
+                    return await func(*args, **kwargs)
+                arguments = signature.bind_partial(*args, **kwargs).arguments
+                key_arguments = {name: value for name, value in arguments.items()
+                                 if not isinstance(value, _NOT_KEY_TYPES)}
+                key = f'{self.prefix}:{func.__module__}.{func.__qualname__}:' \
+                      f'{json.dumps(jsonable_encoder(key_arguments), sort_keys=True)}'
+                entry_tags = tags(**key_arguments) if tags else []
+
+                raw_entry = await self.backend.get(key)
+                if raw_entry is not None:
+                    entry = json.loads(raw_entry)
+                    if entry['fresh_until'] > time.time():
+                        return entry['value']
+                    # устаревшее значение отдаем сразу, а пересчитываем в фоне
+                    if key not in self._inflight:
+                        self._start_refresh(key, func, arguments, ttl, stale_ttl, entry_tags)
+                    return entry['value']
+
+                if key in self._inflight:
+                    return await asyncio.shield(self._inflight[key])
+                return await self._compute(key, self._begin(key), lambda: func(**arguments), ttl, stale_ttl,
+                                           entry_tags, primary_call=self._primary_call(func, arguments))
+
+            wrapper.__signature__ = signature.replace(parameters=[
+                *signature.parameters.values(),
+                inspect.Parameter(_CACHE_REQUEST_ARGUMENT, inspect.Parameter.KEYWORD_ONLY, annotation=Request)
+            ])
+            return wrapper
+        return decorator
+
+    # вызов эндпоинта со своей сессией основной базы вместо сессии запроса (реплики)
+    @staticmethod
+    def _primary_call(func, arguments: Dict[str, Any]):
+        async def call():
+            async with async_session_maker() as session:
+                primary_arguments = {name: session if isinstance(value, AsyncSession) else value
+                                     for name, value in arguments.items()}
+                return await func(**primary_arguments)
+        return call
+
+    # регистрация вычисления ключа: остальные запросы будут ждать этот future
+    def _begin(self, key: str) -> asyncio.Future:
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        return future
+
+    async def _compute(self, key: str, future: asyncio.Future, call, ttl: float, stale_ttl: float,
+                       entry_tags: List[str], primary_call=None):
+        try:
+            versions = await self.backend.tag_versions(entry_tags)
+            # после недавней инвалидации реплика может еще не догнать запись: значение читается с основной базы
+            if primary_call is not None and \
+                    max(versions, default=0.0) > time.time() - database_settings.read_your_writes_seconds:
+                call = primary_call
+            value = jsonable_encoder(await call())
+            # тег инвалидирован во время вычисления: значение могло быть прочитано до записи и в кеш не кладется
+            if await self.backend.tag_versions(entry_tags) == versions:
+                now = time.time()
+                entry = {'value': value, 'fresh_until': now + ttl}
+                await self.backend.set(key, json.dumps(entry), ttl + stale_ttl, entry_tags)
+            future.set_result(value)
+            return value
+        except Exception as e:
+            future.set_exception(e)
+            # исключение уже передано ожидающим; помечаем его полученным, чтобы не было предупреждения
+            future.exception()
+            raise
+        finally:
+            if not future.done():
+                future.cancel()
+            self._inflight.pop(key, None)
+
+    def _start_refresh(self, key: str, func, arguments: Dict[str, Any], ttl: float, stale_ttl: float,
+                       entry_tags: List[str]):
+        # сессия запроса закроется раньше фонового пересчета, поэтому открываем свою
+        call = self._primary_call(func, arguments)
+        future = self._begin(key)
+
+        async def refresh():
+            try:
+                await self._compute(key, future, call, ttl, stale_ttl, entry_tags)
+            except Exception:
+                logger.exception('Background cache refresh failed for %s', key)
+
+        task = asyncio.create_task(refresh())
+        self._refresh_tasks.add(task)
+        task.add_done_callback(self._refresh_tasks.discard)
+
+    async def invalidate_tags(self, *tags: str):
+        for tag in tags:
+            await self.backend.invalidate_tag(tag)
+
+
+response_cache = ResponseCache(InMemoryBackend())
+
+
+# выбор backend по настройкам (вызывается при старте приложения)
+def configure_response_cache(kind: str = CACHE_BACKEND):
+    response_cache.backend = create_backend(kind)
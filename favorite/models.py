@@ -6,7 +6,7 @@ from database import Base
 class UserFavoriteTarots(Base):
    __tablename__ = 'user_favorite_tarots'
 
-   favorite_tarot_id = Column(Integer, primary_key=True, index=True)
+   favorite_tarot_id = Column(Integer, primary_key=True)
    user_id = Column(Integer, ForeignKey('user_profile.user_id'))
    tarot_id = Column(Integer, ForeignKey('user_profile.user_id'))
 
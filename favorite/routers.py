@@ -1,10 +1,11 @@
-from typing import List
+from typing import Optional
 
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Query
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import select
 
-from database import get_session
+from database import get_session, get_read_session
+from pagination import Page, CountMode, paginate
 from favorite.models import UserFavoriteTarots
 from favorite.schemas import UserFavoriteTarotsCreate, UserFavoriteTarotsOut
 
@@ -36,19 +37,18 @@ async def create_user_favorite_tarot_endpoint(favorite: UserFavoriteTarotsCreate
     return db_favorite
 
 
-# получение всех тарологов в избранных у пользователя
-@router.get('/{user_id}', response_model=List[UserFavoriteTarotsOut])
-async def read_user_favorite_tarots(user_id: int, session: AsyncSession = Depends(get_session)):
+# получение всех тарологов в избранных у пользователя (постранично)
+@router.get('/{user_id}', response_model=Page[UserFavoriteTarotsOut])
+async def read_user_favorite_tarots(user_id: int, limit: int = Query(50, ge=1, le=500), cursor: Optional[str] = None,
+                                    count: CountMode = 'none', session: AsyncSession = Depends(get_read_session)):
     read_favorite_query = (
-        await session.execute(
-            select(UserFavoriteTarots)
-            .filter(UserFavoriteTarots.user_id == user_id)
-        )
+        select(UserFavoriteTarots.favorite_tarot_id, UserFavoriteTarots.user_id, UserFavoriteTarots.tarot_id)
+        .filter(UserFavoriteTarots.user_id == user_id)
     )
-    db_favorite = read_favorite_query.scalars().all()
-    if not db_favorite:
+    page = await paginate(session, read_favorite_query, [UserFavoriteTarots.favorite_tarot_id], limit, cursor, count)
+    if not page.rows and cursor is None:
         raise HTTPException(status_code=404, detail="No favorites found for this user")
-    return db_favorite
+    return page.to_page()
 
 
 # функция для удаления таролога из избранных
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, DateTime, func, ForeignKey, Boolean
+from sqlalchemy import Column, Integer, String, DateTime, func, ForeignKey, Boolean, Index
 
 from database import Base
 
@@ -6,8 +6,17 @@ from database import Base
 class Feedback(Base):
     __tablename__ = 'feedback'
 
-    feedback_id = Column(Integer, primary_key=True, index=True)
+    feedback_id = Column(Integer, primary_key=True)
     user_id = Column(Integer, ForeignKey('user_profile.user_id'))
-    feedback_text = Column(String, index=True)
+    feedback_text = Column(String)
     feedback_datetime = Column(DateTime, nullable=False, default=func.now())
-    is_read = Column(Boolean)
\ No newline at end of file
+    is_read = Column(Boolean)
+    # аренда элемента очереди агентом поддержки: после claim_expires_at его может взять другой агент
+    claimed_by = Column(Integer, ForeignKey('user_profile.user_id'), nullable=True)
+    claim_expires_at = Column(DateTime, nullable=True)
+
+    __table_args__ = (
+        Index('ix_feedback_user_id', 'user_id', 'feedback_id'),
+        # очередь непрочитанной обратной связи от старой к новой (feedback_id - для однозначного порядка)
+        Index('ix_feedback_unread_queue', 'feedback_datetime', 'feedback_id', postgresql_where=(is_read == False)),
+    )
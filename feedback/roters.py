@@ -1,13 +1,15 @@
 from datetime import datetime, timedelta
-from typing import List, Dict
+from typing import List, Optional
 
-from fastapi import APIRouter, Depends, HTTPException
-from sqlalchemy import select, asc, delete
+from fastapi import APIRouter, Depends, HTTPException, Query
+from sqlalchemy import select, delete, update, or_, func
 
 from user.models import UserProfile
 from feedback.models import Feedback
-from feedback.schemas import FeedbackRead, FeedbackCreate, FeedbackOut
-from database import get_session
+from feedback.schemas import (FeedbackRead, FeedbackCreate, FeedbackOut, FeedbackClaimOut, FeedbackAcknowledge,
+                              FeedbackAcknowledgeOut)
+from database import get_session, get_read_session
+from pagination import Page, CountMode, paginate
 from sqlalchemy.ext.asyncio import AsyncSession
 
 router = APIRouter(
@@ -47,22 +49,87 @@ async def create_feedback_endpoint(feedback: FeedbackCreate, session: AsyncSessi
     return db_feedback
 
 
+# следующие limit непрочитанных без активной аренды по индексу ix_feedback_unread_queue;
+# SKIP LOCKED пропускает строки, которые в этот момент забирают другие агенты, вместо ожидания
+def claimable_feedback(limit: int):
+    return (
+        select(Feedback.feedback_id)
+        .filter(
+            Feedback.is_read == False,
+            or_(Feedback.claim_expires_at.is_(None), Feedback.claim_expires_at < func.now())
+        )
+        .order_by(Feedback.feedback_datetime, Feedback.feedback_id)
+        .limit(limit)
+        .with_for_update(skip_locked=True)
+        .cte('claimable')
+    )
+
+
+# взять в работу до limit самых старых непрочитанных отзывов на lease_seconds: одним UPDATE,
+# параллельные агенты получают разные элементы; неподтвержденные вовремя снова попадают в очередь
+@router.post("/claim", response_model=List[FeedbackClaimOut])
+async def claim_feedback(agent_id: int, limit: int = Query(10, ge=1, le=100),
+                         lease_seconds: int = Query(300, ge=10, le=3600),
+                         session: AsyncSession = Depends(get_session)):
+    agent_query = await session.execute(select(UserProfile.user_id).filter(UserProfile.user_id == agent_id))
+    if agent_query.first() is None:
+        raise HTTPException(status_code=404, detail="User ID not found")
+    claimable = claimable_feedback(limit)
+    claim_query = await session.execute(
+        update(Feedback)
+        .where(Feedback.feedback_id.in_(select(claimable.c.feedback_id)))
+        .values(claimed_by=agent_id, claim_expires_at=func.now() + timedelta(seconds=lease_seconds))
+        .returning(Feedback.feedback_id, Feedback.user_id, Feedback.feedback_text, Feedback.feedback_datetime,
+                   Feedback.claimed_by, Feedback.claim_expires_at)
+    )
+    claimed = sorted(claim_query.all(), key=lambda row: (row.feedback_datetime, row.feedback_id))
+    await session.commit()
+    return [FeedbackClaimOut(**row._mapping) for row in claimed]
+
+
+# подтвердить обработку взятых отзывов пачкой: прочитанными отмечаются только элементы, которые все еще
+# арендованы этим агентом (после истечения аренды - если их никто не взял повторно)
+@router.post("/acknowledge", response_model=FeedbackAcknowledgeOut)
+async def acknowledge_feedback(acknowledge: FeedbackAcknowledge, session: AsyncSession = Depends(get_session)):
+    acknowledge_query = await session.execute(
+        update(Feedback)
+        .where(
+            Feedback.feedback_id.in_(acknowledge.feedback_ids),
+            Feedback.claimed_by == acknowledge.agent_id,
+            Feedback.is_read == False
+        )
+        .values(is_read=True, claimed_by=None, claim_expires_at=None)
+        .returning(Feedback.feedback_id)
+    )
+    acknowledged = set(acknowledge_query.scalars().all())
+    await session.commit()
+    return FeedbackAcknowledgeOut(
+        acknowledged=sorted(acknowledged),
+        rejected=sorted(set(acknowledge.feedback_ids) - acknowledged)
+    )
+
+
+# отметить прочитанным самый старый непрочитанный отзыв, не взятый в работу (та же очередь, что и claim)
 @router.post("/mark_oldest_unread_as_read", response_model=FeedbackRead)
 async def mark_oldest_unread_as_read(session: AsyncSession = Depends(get_session)):
-    feedback_read_query = await session.execute(select(Feedback).filter(Feedback.is_read == False).order_by(asc(Feedback.feedback_datetime)))
-    db_feedback_read = feedback_read_query.scalars().first()
+    claimable = claimable_feedback(1)
+    feedback_read_query = await session.execute(
+        update(Feedback)
+        .where(Feedback.feedback_id.in_(select(claimable.c.feedback_id)))
+        .values(is_read=True, claimed_by=None, claim_expires_at=None)
+        .returning(Feedback.feedback_id, Feedback.feedback_text, Feedback.is_read)
+    )
+    db_feedback_read = feedback_read_query.first()
     if not db_feedback_read:
         raise HTTPException(status_code=404, detail="No unread feedback found")
-    # Обновляем поле is_read на True
-    db_feedback_read.is_read = True
     await session.commit()
-    await session.refresh(db_feedback_read)
-    return FeedbackRead(feedback_id=db_feedback_read.feedback_id, feedback_text = db_feedback_read.feedback_text, is_read=db_feedback_read.is_read)
+    return FeedbackRead(feedback_id=db_feedback_read.feedback_id, feedback_text=db_feedback_read.feedback_text,
+                        is_read=db_feedback_read.is_read)
 
 
 # вывод фитбека по feedback_id
 @router.get("/find_feedback/{feedback_id}")
-async def read_feedback(feedback_id: int, session: AsyncSession = Depends(get_session)):
+async def read_feedback(feedback_id: int, session: AsyncSession = Depends(get_read_session)):
     db_feedback = await session.execute(select(Feedback).filter(Feedback.feedback_id == feedback_id))
     db_feedback = db_feedback.scalar()
 
@@ -72,24 +139,25 @@ async def read_feedback(feedback_id: int, session: AsyncSession = Depends(get_se
     return db_feedback
 
 
-# весь feedback пользователя
-@router.get('/{user_id}', response_model=Dict[str, FeedbackOut])
-async def read_user_feedback(user_id: int, session: AsyncSession = Depends(get_session)):
+# весь feedback пользователя (постранично)
+@router.get('/{user_id}', response_model=Page[FeedbackOut])
+async def read_user_feedback(user_id: int, limit: int = Query(50, ge=1, le=500), cursor: Optional[str] = None,
+                             count: CountMode = 'none', session: AsyncSession = Depends(get_read_session)):
     read_feedback_query = (
-        await session.execute(
-            select(Feedback)
-            .filter(Feedback.user_id == user_id)
+        select(
+            Feedback.feedback_id,
+            Feedback.user_id,
+            Feedback.feedback_text,
+            Feedback.feedback_datetime,
+            Feedback.is_read
         )
+        .filter(Feedback.user_id == user_id)
     )
-    db_feedback = read_feedback_query.scalars().all()
-    if not db_feedback:
+    page = await paginate(session, read_feedback_query, [Feedback.feedback_id], limit, cursor, count)
+    if not page.rows and cursor is None:
         raise HTTPException(status_code=404, detail="Feedbacks is not found")
 
-    feedbacks = {}
-    for index, feedback in enumerate(db_feedback, start=1):
-        feedbacks[str(index)] = feedback
-
-    return feedbacks
+    return page.to_page()
 
 
 @router.delete("/delete_old_reads")
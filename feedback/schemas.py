@@ -1,5 +1,7 @@
 from datetime import datetime
-from pydantic import BaseModel
+from typing import List
+
+from pydantic import BaseModel, Field
 
 
 class FeedbackCreate(BaseModel):
@@ -19,4 +21,22 @@ class FeedbackOut(BaseModel):
 class FeedbackRead(BaseModel):
     feedback_id: int
     feedback_text: str
-    is_read: bool
\ No newline at end of file
+    is_read: bool
+
+class FeedbackClaimOut(BaseModel):
+    feedback_id: int
+    user_id: int
+    feedback_text: str
+    feedback_datetime: datetime
+    claimed_by: int
+    claim_expires_at: datetime
+
+
+class FeedbackAcknowledge(BaseModel):
+    agent_id: int
+    feedback_ids: List[int] = Field(..., min_length=1, max_length=500)
+
+
+class FeedbackAcknowledgeOut(BaseModel):
+    acknowledged: List[int]
+    rejected: List[int]  # аренда истекла и элемент взял другой агент, или он уже прочитан
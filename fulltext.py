@@ -0,0 +1,24 @@
+from sqlalchemy import func, literal_column
+
+# выражения полнотекстового и триграммного поиска; одни и те же функции используются в индексах моделей
+# и в запросах, чтобы планировщик сопоставил выражение запроса с выражением индекса
+# константы пишутся в текст запроса (literal_column), а не передаются параметрами - иначе индекс не подойдет
+TEXT_SEARCH_CONFIG = literal_column("'russian'::regconfig")
+_EMPTY = literal_column("''")
+_SPACE = literal_column("' '")
+
+
+# склейка колонок для индекса: || с coalesce неизменяема (immutable), в отличие от concat_ws
+def search_document(*columns):
+    document = func.coalesce(columns[0], _EMPTY)
+    for column in columns[1:]:
+        document = document.op('||')(_SPACE).op('||')(func.coalesce(column, _EMPTY))
+    return document
+
+
+def text_search_vector(*columns):
+    return func.to_tsvector(TEXT_SEARCH_CONFIG, search_document(*columns))
+
+
+def text_search_query(query: str):
+    return func.websearch_to_tsquery(TEXT_SEARCH_CONFIG, query)
@@ -0,0 +1,218 @@
+import argparse
+import asyncio
+import json
+import math
+import platform
+import random
+import time
+from datetime import datetime
+from typing import Callable, Dict, List, Tuple
+
+import httpx
+
+# нагрузочный драйвер: взвешенная смесь реальных эндпоинтов, результат - JSON с процентилями по маршрутам
+# сценарий возвращает (название маршрута, метод, путь, параметры запроса, тело)
+Request = Tuple[str, str, str, Dict, Dict]
+
+
+class Scenarios:
+    def __init__(self, manifest: Dict, rng: random.Random):
+        self.manifest = manifest
+        self.rng = rng
+
+    def get_info(self) -> Request:
+        client = self.rng.choice(self.manifest['clients'])
+        return 'user.get_info', 'GET', f"/user/get_info/{client['email']}/{self.manifest['password']}", {}, None
+
+    def create_message(self) -> Request:
+        client_id, tarot_id = self.rng.choice(self.manifest['chats'])
+        sender_id, recipient_id = (client_id, tarot_id) if self.rng.random() < 0.5 else (tarot_id, client_id)
+        body = {'sender_id': sender_id, 'recipient_id': recipient_id, 'message_text': 'Нагрузочное сообщение'}
+        return 'message.create', 'POST', '/message/create', {}, body
+
+    def show_chat(self) -> Request:
+        client_id, tarot_id = self.rng.choice(self.manifest['chats'])
+        return 'message.show_chat', 'GET', f'/message/show_chat/{client_id}/recipient/{tarot_id}', {}, None
+
+    def chat_page(self) -> Request:
+        client_id, tarot_id = self.rng.choice(self.manifest['chats'])
+        return 'message.chat_page', 'GET', f'/message/chat/{client_id}/companion/{tarot_id}', {'limit': 50}, None
+
+    def contacts_info(self) -> Request:
+        client = self.rng.choice(self.manifest['clients'])
+        return 'message.contacts_info', 'GET', f"/message/contacts_info/{client['user_id']}", {}, None
+
+    def unread(self) -> Request:
+        client = self.rng.choice(self.manifest['clients'])
+        return 'message.unread', 'GET', f"/message/unread/{client['user_id']}", {}, None
+
+    def mark_read(self) -> Request:
+        client_id, tarot_id = self.rng.choice(self.manifest['chats'])
+        user_id, companion_id = (client_id, tarot_id) if self.rng.random() < 0.5 else (tarot_id, client_id)
+        # отметка до последнего сообщения: сервер ограничит ее последним сообщением переписки
+        return ('message.mark_read', 'POST', f'/message/read/{user_id}/companion/{companion_id}',
+                {'message_id': 2 ** 31 - 1}, None)
+
+    def update_review(self) -> Request:
+        history = self.rng.choice(self.manifest['histories'])
+        body = {'history_id': history['history_id'], 'review_title': 'Отзыв', 'review_text': 'Нагрузочный отзыв',
+                'review_value': self.rng.randint(1, 5), 'review_date_time': datetime.utcnow().isoformat()}
+        return 'history.update_review', 'POST', f"/history/update_review/{history['history_id']}", {}, body
+
+    def find_tarot(self) -> Request:
+        return 'user.find_tarot', 'GET', '/user/find_tarot', {}, None
+
+    def marketplace(self) -> Request:
+        params = {'sort': self.rng.choice(['rating', 'price', 'reviews'])}
+        if self.rng.random() < 0.5:
+            params['specialization_ids'] = self.rng.choice(self.manifest['specializations'])
+        return 'marketplace.tarots', 'GET', '/marketplace/tarots', params, None
+
+    def search(self) -> Request:
+        # префиксы и опечатки в именах синтетических пользователей и услуг
+        query = self.rng.choice(['Name1', 'Surnam', 'lt_service', 'Расклад', 'Nmae12'])
+        return 'search', 'GET', '/search', {'q': query}, None
+
+    def tarot_services(self) -> Request:
+        return 'service.by_tarot', 'GET', f"/service/{self.rng.choice(self.manifest['tarots'])}", {}, None
+
+
+# доли сценариев в смеси по умолчанию
+DEFAULT_MIX = {
+    'get_info': 10,
+    'create_message': 20,
+    'show_chat': 5,
+    'chat_page': 10,
+    'contacts_info': 15,
+    'unread': 10,
+    'mark_read': 5,
+    'update_review': 5,
+    'find_tarot': 10,
+    'marketplace': 10,
+    'search': 5,
+    'tarot_services': 5
+}
+
+
+def percentile(sorted_values: List[float], fraction: float) -> float:
+    if not sorted_values:
+        return 0.0
+    rank = max(math.ceil(fraction * len(sorted_values)) - 1, 0)
+    return sorted_values[rank]
+
+
+class Recorder:
+    def __init__(self):
+        self.latencies: Dict[str, List[float]] = {}
+        self.statuses: Dict[str, Dict[str, int]] = {}
+
+    def record(self, route: str, status: str, elapsed: float):
+        self.latencies.setdefault(route, []).append(elapsed)
+        route_statuses = self.statuses.setdefault(route, {})
+        route_statuses[status] = route_statuses.get(status, 0) + 1
+
+    def report(self, duration: float) -> Dict:
+        routes = {}
+        for route, latencies in sorted(self.latencies.items()):
+            latencies = sorted(latencies)
+            errors = sum(count for status, count in self.statuses[route].items() if not status.startswith('2'))
+            routes[route] = {
+                'requests': len(latencies),
+                'throughput_rps': round(len(latencies) / duration, 2),
+                'errors': errors,
+                'statuses': self.statuses[route],
+                'p50_ms': round(percentile(latencies, 0.50) * 1000, 2),
+                'p95_ms': round(percentile(latencies, 0.95) * 1000, 2),
+                'p99_ms': round(percentile(latencies, 0.99) * 1000, 2),
+                'max_ms': round(latencies[-1] * 1000, 2)
+            }
+        total = sum(route['requests'] for route in routes.values())
+        all_latencies = sorted(latency for latencies in self.latencies.values() for latency in latencies)
+        return {
+            'total': {
+                'requests': total,
+                'throughput_rps': round(total / duration, 2),
+                'errors': sum(route['errors'] for route in routes.values()),
+                'p50_ms': round(percentile(all_latencies, 0.50) * 1000, 2),
+                'p95_ms': round(percentile(all_latencies, 0.95) * 1000, 2),
+                'p99_ms': round(percentile(all_latencies, 0.99) * 1000, 2)
+            },
+            'routes': routes
+        }
+
+
+# замкнутый цикл: каждый виртуальный пользователь отправляет следующий запрос после ответа на предыдущий
+async def worker(base_url: str, scenarios: Scenarios, mix: List[Tuple[Callable[[], Request], int]],
+                 deadline: float, warmup_until: float, recorder: Recorder, timeout: float):
+    choices, weights = zip(*mix)
+    # у каждого пользователя свой клиент: cookie read-your-writes не смешиваются
+    async with httpx.AsyncClient(base_url=base_url, timeout=timeout) as client:
+        while time.perf_counter() < deadline:
+            route, method, path, params, body = scenarios.rng.choices(choices, weights)[0]()
+            started = time.perf_counter()
+            try:
+                response = await client.request(method, path, params=params, json=body)
+                status = str(response.status_code)
+            except httpx.HTTPError as e:
+                status = type(e).__name__
+            if started >= warmup_until:
+                recorder.record(route, status, time.perf_counter() - started)
+
+
+async def run(base_url: str, manifest: Dict, mix: Dict[str, int], concurrency: int, duration: float,
+              warmup: float, seed: int, timeout: float) -> Dict:
+    recorder = Recorder()
+    started_at = datetime.utcnow().isoformat()
+    started = time.perf_counter()
+    warmup_until = started + warmup
+    deadline = warmup_until + duration
+    workers = []
+    for number in range(concurrency):
+        scenarios = Scenarios(manifest, random.Random(seed * 100003 + number))
+        weighted = [(getattr(scenarios, name), weight) for name, weight in mix.items() if weight > 0]
+        workers.append(worker(base_url, scenarios, weighted, deadline, warmup_until, recorder, timeout))
+    await asyncio.gather(*workers)
+    measured = max(time.perf_counter() - warmup_until, 1e-9)
+    return {
+        'started_at': started_at,
+        'config': {'base_url': base_url, 'concurrency': concurrency, 'duration_s': duration, 'warmup_s': warmup,
+                   'seed': seed, 'dataset_seed': manifest['seed'], 'dataset': manifest['counts'], 'mix': mix,
+                   'python': platform.python_version()},
+        **recorder.report(measured)
+    }
+
+
+def parse_mix(value: str) -> Dict[str, int]:
+    mix = dict(DEFAULT_MIX)
+    for item in filter(None, value.split(',')):
+        name, weight = item.split('=')
+        if name not in DEFAULT_MIX:
+            raise argparse.ArgumentTypeError(f'Unknown scenario: {name}')
+        mix[name] = int(weight)
+    return mix
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Replay a weighted endpoint mix and report latency percentiles')
+    parser.add_argument('--base-url', default='http://localhost:8000')
+    parser.add_argument('--manifest', default='loadtest/dataset.json')
+    parser.add_argument('--concurrency', type=int, default=50)
+    parser.add_argument('--duration', type=float, default=60, help='measured seconds after warmup')
+    parser.add_argument('--warmup', type=float, default=10)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--timeout', type=float, default=30)
+    parser.add_argument('--mix', type=parse_mix, default=dict(DEFAULT_MIX),
+                        help='override weights, e.g. create_message=0,get_info=30')
+    parser.add_argument('--output', help='write the JSON report to a file instead of stdout')
+    args = parser.parse_args()
+
+    with open(args.manifest, encoding='utf-8') as manifest_file:
+        dataset = json.load(manifest_file)
+    report = asyncio.run(run(args.base_url, dataset, args.mix, args.concurrency, args.duration, args.warmup,
+                             args.seed, args.timeout))
+    output = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as output_file:
+            output_file.write(output)
+    else:
+        print(output)
@@ -0,0 +1,198 @@
+import argparse
+import asyncio
+import json
+import random
+import statistics
+from typing import Dict, List
+
+from sqlalchemy import text
+
+from database import async_session_maker
+from migrations.runner import (ADVISORY_LOCK_KEY, acquire_migration_lock, create_migration_engine, load_migrations,
+                               prepare, read_current_version)
+from reference import TAROT_ROLE_NAME
+
+# сравнение планов и времени горячих запросов до и после изменения индексов на синтетических данных:
+#   python -m loadtest.explain --swap 4 before && python -m loadtest.explain --output before.json
+#   python -m loadtest.explain --swap 4 after && python -m loadtest.explain --output after.json
+#   python -m loadtest.explain --compare before.json after.json
+# --swap меняет только индексы одной миграции; откат через migrations.runner downgrade удалил бы и данные
+# более поздних миграций (отметки прочтения, счетчики непрочитанных, аренду отзывов)
+# запросы повторяют форму запросов роутеров; параметры берутся из манифеста loadtest.seed
+HOT_QUERIES = {
+    'message.chat_page': '''
+        SELECT message_id, sender_id, recipient_id, message_text, message_date_send FROM message
+        WHERE sender_id = :user_id AND recipient_id = :companion_id
+        ORDER BY message_date_send DESC, message_id DESC LIMIT 51
+    ''',
+    'history.by_user': '''
+        SELECT h.history_id, h.tarot_id, h.service_id, h.status_id, u.first_name, u.second_name, s.service_name
+        FROM user_service_history h
+        JOIN user_profile u ON u.user_id = h.tarot_id
+        JOIN service s ON s.service_id = h.service_id
+        WHERE h.user_id = :user_id
+    ''',
+    'history.tarot_rating': '''
+        SELECT tarot_id, sum(review_value), count(*) FROM user_service_history
+        WHERE tarot_id = :tarot_id AND review_value <> 0 GROUP BY tarot_id
+    ''',
+    'notification.targeted': '''
+        SELECT notification_id FROM user_system_notification
+        WHERE user_id = :user_id ORDER BY notification_id DESC LIMIT 21
+    ''',
+    'specialization.tarots': '''
+        SELECT u.user_id, u.username FROM user_profile u
+        JOIN tarot_specialization t ON t.tarot_id = u.user_id
+        WHERE t.specialization_id = :specialization_id
+    ''',
+    'specialization.bond_exists': '''
+        SELECT tarot_specialization_id FROM tarot_specialization
+        WHERE specialization_id = :specialization_id AND tarot_id = :tarot_id
+    ''',
+    'feedback.oldest_unread': '''
+        SELECT feedback_id, feedback_datetime FROM feedback
+        WHERE is_read = false ORDER BY feedback_datetime LIMIT 1
+    ''',
+    'feedback.by_user': '''
+        SELECT feedback_id, feedback_text, feedback_datetime, is_read FROM feedback
+        WHERE user_id = :user_id ORDER BY feedback_id LIMIT 51
+    ''',
+    'user.tarot_catalog': '''
+        SELECT user_id, username, tarot_rating FROM user_profile
+        WHERE role_id = (SELECT role_id FROM role WHERE role_name = :tarot_role) AND is_deleted = false
+        ORDER BY coalesce(tarot_rating, 0) DESC, user_id DESC LIMIT 51
+    ''',
+}
+
+
+def sample_parameters(manifest: Dict, rng: random.Random) -> Dict:
+    client_id, tarot_id = rng.choice(manifest['chats'])
+    return {
+        'user_id': client_id,
+        'companion_id': tarot_id,
+        'tarot_id': tarot_id,
+        'specialization_id': rng.choice(manifest['specializations']),
+        'tarot_role': TAROT_ROLE_NAME
+    }
+
+
+# узлы плана, которыми читаются таблицы (Seq Scan / Index Scan using ...)
+def scan_nodes(plan: Dict) -> List[str]:
+    nodes = []
+    if 'Relation Name' in plan or 'Index Name' in plan:
+        node = plan['Node Type']
+        if 'Index Name' in plan:
+            node += f" using {plan['Index Name']}"
+        if 'Relation Name' in plan:
+            node += f" on {plan['Relation Name']}"
+        nodes.append(node)
+    for child in plan.get('Plans', []):
+        nodes.extend(scan_nodes(child))
+    return nodes
+
+
+async def explain(manifest: Dict, runs: int, seed: int) -> Dict:
+    rng = random.Random(seed)
+    report = {}
+    async with async_session_maker() as session:
+        await session.execute(text('SET LOCAL statement_timeout = 0'))
+        for name, query in HOT_QUERIES.items():
+            timings = []
+            scans = set()
+            buffers = []
+            for _ in range(runs):
+                parameters = sample_parameters(manifest, rng)
+                used = {key: value for key, value in parameters.items() if f':{key}' in query}
+                plan_query = await session.execute(text(f'EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) {query}'), used)
+                plan = plan_query.scalar_one()
+                if isinstance(plan, str):
+                    plan = json.loads(plan)
+                timings.append(plan[0]['Execution Time'])
+                root = plan[0]['Plan']
+                buffers.append(root.get('Shared Hit Blocks', 0) + root.get('Shared Read Blocks', 0))
+                scans.update(scan_nodes(root))
+            timings.sort()
+            report[name] = {
+                'runs': runs,
+                'median_ms': round(statistics.median(timings), 3),
+                'p95_ms': round(timings[max(int(len(timings) * 0.95) - 1, 0)], 3),
+                'median_buffers': statistics.median(buffers),
+                'scans': sorted(scans)
+            }
+    return report
+
+
+# индексы одной миграции с CONCURRENTLY без отката остальных: ее шаг выполняется без записи версии, затем
+# повторяются upgrade более поздних примененных миграций с CONCURRENTLY (они идемпотентны), чтобы индексы,
+# которые они заменили, остались как в текущей схеме
+async def swap_migration_indexes(version: int, state: str):
+    migrations = load_migrations()
+    migration = next((migration for migration in migrations if migration.version == version), None)
+    if migration is None or migration.transactional:
+        raise SystemExit(f'{version:04d} is not an index-only (non-transactional) migration')
+    migration_engine = create_migration_engine()
+    try:
+        async with migration_engine.connect() as connection:
+            connection = await connection.execution_options(isolation_level='AUTOCOMMIT')
+            await acquire_migration_lock(connection)
+            try:
+                current = await read_current_version(connection)
+                if current < version:
+                    raise SystemExit(f'{version:04d} is not applied (schema version {current})')
+                await prepare(connection, transactional=False)
+                step = migration.module.downgrade if state == 'before' else migration.module.upgrade
+                await step(connection)
+                for later in migrations:
+                    if version < later.version <= current and not later.transactional:
+                        await later.module.upgrade(connection)
+            finally:
+                await connection.execute(text('SELECT pg_advisory_unlock(:key)'), {'key': ADVISORY_LOCK_KEY})
+    finally:
+        await migration_engine.dispose()
+
+
+def compare(before: Dict, after: Dict) -> List[str]:
+    lines = [f"{'query':32} {'before ms':>10} {'after ms':>10} {'speedup':>8}"]
+    for name in before:
+        if name not in after:
+            continue
+        old, new = before[name]['median_ms'], after[name]['median_ms']
+        speedup = f'{old / new:.1f}x' if new else '-'
+        lines.append(f'{name:32} {old:>10.3f} {new:>10.3f} {speedup:>8}')
+        if before[name]['scans'] != after[name]['scans']:
+            lines.append(f"    before: {'; '.join(before[name]['scans'])}")
+            lines.append(f"    after:  {'; '.join(after[name]['scans'])}")
+    return lines
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Capture query plans and timings of the hot queries')
+    parser.add_argument('--manifest', default='loadtest/dataset.json')
+    parser.add_argument('--runs', type=int, default=50, help='executions per query with random parameters')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--output', help='write the JSON report to a file instead of stdout')
+    parser.add_argument('--compare', nargs=2, metavar=('BEFORE', 'AFTER'), help='compare two saved reports')
+    parser.add_argument('--swap', nargs=2, metavar=('VERSION', 'STATE'),
+                        help='put the indexes of one CONCURRENTLY migration into the before or after state')
+    args = parser.parse_args()
+
+    if args.swap:
+        swap_version, swap_state = args.swap
+        if not swap_version.isdigit() or swap_state not in ('before', 'after'):
+            parser.error('--swap expects a migration number and before or after')
+        asyncio.run(swap_migration_indexes(int(swap_version), swap_state))
+    elif args.compare:
+        reports = []
+        for path in args.compare:
+            with open(path, encoding='utf-8') as report_file:
+                reports.append(json.load(report_file))
+        print('\n'.join(compare(*reports)))
+    else:
+        with open(args.manifest, encoding='utf-8') as manifest_file:
+            dataset = json.load(manifest_file)
+        result = json.dumps(asyncio.run(explain(dataset, args.runs, args.seed)), indent=2)
+        if args.output:
+            with open(args.output, 'w', encoding='utf-8') as output_file:
+                output_file.write(result)
+        else:
+            print(result)
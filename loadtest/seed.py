@@ -0,0 +1,256 @@
+import argparse
+import asyncio
+import itertools
+import json
+import random
+from bisect import bisect_left
+from datetime import date, datetime, timedelta
+from typing import Dict, List, Sequence
+
+import bcrypt
+from sqlalchemy import insert, select, text
+
+from database import async_session_maker
+from feedback.models import Feedback
+from favorite.models import UserFavoriteTarots
+from message.backfill import backfill_conversation_summaries
+from message.models import Message, Contacts
+from notification.models import NotificationStatus, NotificationType, SystemNotification, UserNotificationState
+from reference import TAROT_ROLE_NAME, CLIENT_ROLE_NAME
+from role.models import Role
+from service.models import Service
+from specialization.models import Specialization, TarotSpecialization
+from status.models import Status
+from user.models import UserProfile
+from user_service_history.models import UserServiceHistory
+from user_service_history.reconcile import reconcile_tarot_ratings
+
+# синтетический набор данных для нагрузочного тестирования; все распределения зависят только от --seed
+BATCH_SIZE = 5000
+PASSWORD = 'loadtest-password'
+DATA_TABLES = ('user_system_notification', 'user_notification_state', 'system_notification', 'feedback',
+               'user_service_history', 'user_favorite_tarots', 'user_message_state', 'conversation_summary', 'contacts',
+               'message',
+               'service', 'tarot_specialization', 'user_profile')
+
+
+# веса по закону Ципфа: несколько популярных объектов и длинный хвост
+class ZipfPicker:
+    def __init__(self, items: Sequence, exponent: float, rng: random.Random):
+        self.items = list(items)
+        self.rng = rng
+        self.cum_weights = list(itertools.accumulate(1 / (rank ** exponent) for rank in range(1, len(self.items) + 1)))
+
+    def pick(self):
+        return self.items[bisect_left(self.cum_weights, self.rng.random() * self.cum_weights[-1])]
+
+    def sample(self, count: int) -> list:
+        chosen = []
+        seen = set()
+        while len(chosen) < min(count, len(self.items)):
+            item = self.pick()
+            if item not in seen:
+                seen.add(item)
+                chosen.append(item)
+        return chosen
+
+
+async def insert_rows(session, model, rows: List[Dict], returning=None) -> list:
+    ids = []
+    for start in range(0, len(rows), BATCH_SIZE):
+        batch = rows[start:start + BATCH_SIZE]
+        if returning is None:
+            await session.execute(insert(model), batch)
+        else:
+            result = await session.execute(insert(model).returning(returning, sort_by_parameter_order=True), batch)
+            ids.extend(result.scalars().all())
+    return ids
+
+
+async def ensure_reference(session, model, id_column, name_column, names: Sequence[str]) -> Dict[str, int]:
+    existing = dict((await session.execute(select(name_column, id_column))).all())
+    missing = [{name_column.key: name} for name in names if name not in existing]
+    if missing:
+        await session.execute(insert(model), missing)
+        existing = dict((await session.execute(select(name_column, id_column))).all())
+    return existing
+
+
+async def seed(users: int, tarots: int, messages: int, specializations: int, seed_value: int, rounds: int,
+               reset: bool, manifest_path: str):
+    rng = random.Random(seed_value)
+    # один хеш на всех пользователей: bcrypt при генерации не нужен, а низкий cost не искажает вход
+    password_hashed = bcrypt.hashpw(PASSWORD.encode('utf-8'), bcrypt.gensalt(rounds)).decode('utf-8')
+    now = datetime.utcnow()
+
+    async with async_session_maker() as session:
+        # массовые вставки дольше statement_timeout пула; SET LOCAL не переживает транзакцию и не попадает в пул
+        await session.execute(text('SET LOCAL statement_timeout = 0'))
+        if reset:
+            await session.execute(text(f'TRUNCATE {", ".join(DATA_TABLES)} RESTART IDENTITY CASCADE'))
+
+        roles = await ensure_reference(session, Role, Role.role_id, Role.role_name,
+                                       [TAROT_ROLE_NAME, CLIENT_ROLE_NAME])
+        statuses = await ensure_reference(session, Status, Status.status_id, Status.status_name,
+                                          ['created', 'in_progress', 'done'])
+        notification_statuses = await ensure_reference(
+            session, NotificationStatus, NotificationStatus.notification_status_id,
+            NotificationStatus.notification_status_name, ['new'])
+        notification_types = await ensure_reference(
+            session, NotificationType, NotificationType.notification_type_id,
+            NotificationType.notification_type_name, ['system'])
+        specialization_ids = list((await ensure_reference(
+            session, Specialization, Specialization.specialization_id, Specialization.specialization_name,
+            [f'loadtest specialization {number}' for number in range(specializations)])).values())
+
+        # пользователи: первые tarots - тарологи, остальные - клиенты
+        profiles = []
+        for number in range(users):
+            is_tarot = number < tarots
+            profiles.append({
+                'role_id': roles[TAROT_ROLE_NAME] if is_tarot else roles[CLIENT_ROLE_NAME],
+                'username': f'lt_user_{seed_value}_{number}',
+                'email': f'lt_user_{seed_value}_{number}@loadtest.local',
+                'phone_number': f'+7{seed_value % 1000:03d}{number:07d}',
+                'password_hashed': password_hashed,
+                'first_name': f'Name{number}',
+                'second_name': f'Surname{number}',
+                'date_birth': date(1970, 1, 1) + timedelta(days=rng.randint(0, 365 * 35)),
+                'date_registration': now - timedelta(days=rng.randint(0, 730)),
+                'is_deleted': rng.random() < 0.01,
+                'user_description': 'Таролог' if is_tarot else None,
+                'tarot_experience': round(rng.uniform(0, 20), 1) if is_tarot else None,
+                'tarot_rating': 0,
+                'review_count': 0,
+                'rating_sum': 0
+            })
+        user_ids = await insert_rows(session, UserProfile, profiles, UserProfile.user_id)
+        # синтетические рассылки создаются позже пользователей и остаются для них непрочитанными
+        await insert_rows(session, UserNotificationState,
+                          [{'user_id': user_id, 'read_watermark': 0, 'unread_count': 0} for user_id in user_ids])
+        tarot_ids, client_ids = user_ids[:tarots], user_ids[tarots:]
+        emails = {user_id: profile['email'] for user_id, profile in zip(user_ids, profiles)}
+
+        # популярность тарологов и активность клиентов - степенные распределения
+        popular_tarots = ZipfPicker(tarot_ids, 1.1, rng)
+        active_clients = ZipfPicker(client_ids, 0.9, rng)
+        popular_specializations = ZipfPicker(specialization_ids, 1.0, rng)
+
+        tarot_specializations = []
+        services = []
+        for tarot_id in tarot_ids:
+            tarot_specs = popular_specializations.sample(rng.randint(1, 3))
+            tarot_specializations.extend({'tarot_id': tarot_id, 'specialization_id': spec} for spec in tarot_specs)
+            for number in range(rng.randint(1, 5)):
+                services.append({
+                    'tarot_id': tarot_id,
+                    'service_name': f'lt_service_{seed_value}_{tarot_id}_{number}',
+                    'service_description': 'Расклад',
+                    'specialization_id': rng.choice(tarot_specs),
+                    'service_price': int(rng.lognormvariate(7.5, 0.6))
+                })
+        await insert_rows(session, TarotSpecialization, tarot_specializations)
+        service_ids = await insert_rows(session, Service, services, Service.service_id)
+        services_by_tarot: Dict[int, List[int]] = {}
+        for service_id, service in zip(service_ids, services):
+            services_by_tarot.setdefault(service['tarot_id'], []).append(service_id)
+
+        # переписки: пара (клиент, таролог) выбирается по популярности, длина чата получается степенной
+        message_rows = []
+        chat_volume: Dict[tuple, int] = {}
+        start = now - timedelta(days=90)
+        for number in range(messages):
+            pair = (active_clients.pick(), popular_tarots.pick())
+            chat_volume[pair] = chat_volume.get(pair, 0) + 1
+            sender_id, recipient_id = pair if rng.random() < 0.5 else pair[::-1]
+            message_rows.append({
+                'sender_id': sender_id,
+                'recipient_id': recipient_id,
+                'message_text': f'Сообщение {number}',
+                'message_date_send': start + timedelta(seconds=90 * 86400 * number / max(messages, 1))
+            })
+        await insert_rows(session, Message, message_rows)
+        contacts = [{'user_id': user_id, 'user_contact_id': contact_id}
+                    for client_id, tarot_id in chat_volume
+                    for user_id, contact_id in ((client_id, tarot_id), (tarot_id, client_id))]
+        await insert_rows(session, Contacts, contacts)
+
+        # избранное смещено к популярным тарологам
+        favorites = [{'user_id': client_id, 'tarot_id': tarot_id}
+                     for client_id in client_ids if rng.random() < 0.6
+                     for tarot_id in popular_tarots.sample(min(int(rng.paretovariate(1.5)), 20))]
+        await insert_rows(session, UserFavoriteTarots, favorites)
+
+        # история услуг: у части заказов уже есть отзыв
+        histories = []
+        for (client_id, tarot_id), volume in chat_volume.items():
+            for _ in range(min(1 + volume // 20, 10)):
+                reviewed = rng.random() < 0.7
+                histories.append({
+                    'user_id': client_id,
+                    'tarot_id': tarot_id,
+                    'service_id': rng.choice(services_by_tarot[tarot_id]),
+                    'status_id': statuses['done'] if reviewed else statuses['in_progress'],
+                    'review_title': 'Отзыв' if reviewed else None,
+                    'review_text': 'Все сбылось' if reviewed else None,
+                    'review_value': rng.choices((1, 2, 3, 4, 5), (1, 1, 2, 5, 10))[0] if reviewed else 0,
+                    'review_date_time': now - timedelta(days=rng.randint(0, 90))
+                })
+        history_ids = await insert_rows(session, UserServiceHistory, histories, UserServiceHistory.history_id)
+
+        feedback = [{'user_id': rng.choice(client_ids), 'feedback_text': f'Обратная связь {number}',
+                     'feedback_datetime': now - timedelta(minutes=rng.randint(0, 90 * 1440)),
+                     'is_read': rng.random() < 0.8}
+                    for number in range(max(users // 50, 1))]
+        await insert_rows(session, Feedback, feedback)
+
+        notifications = [{'notification_status_id': notification_statuses['new'],
+                          'notification_type_id': notification_types['system'],
+                          'notification_title': f'Новости {number}', 'notification_text': 'Обновление сервиса',
+                          'notification_date_time': now - timedelta(days=number), 'audience_type': 'all'}
+                         for number in range(20)]
+        await insert_rows(session, SystemNotification, notifications)
+        await session.commit()
+
+    # производные данные считаем теми же командами, что и в эксплуатации
+    await backfill_conversation_summaries()
+    await reconcile_tarot_ratings(fix=True)
+
+    # манифест для нагрузочного драйвера: кого и что запрашивать
+    busiest_chats = sorted(chat_volume.items(), key=lambda item: item[1], reverse=True)
+    reviewed_histories = [{'history_id': history_id, 'user_id': history['user_id']}
+                          for history_id, history in zip(history_ids, histories)]
+    manifest = {
+        'seed': seed_value,
+        'password': PASSWORD,
+        'bcrypt_rounds': rounds,
+        'clients': [{'user_id': user_id, 'email': emails[user_id]} for user_id in active_clients.sample(1000)],
+        'tarots': popular_tarots.sample(500),
+        'chats': [list(pair) for pair, _ in busiest_chats[:2000]],
+        'histories': rng.sample(reviewed_histories, min(len(reviewed_histories), 5000)),
+        'specializations': specialization_ids,
+        'counts': {'users': users, 'tarots': tarots, 'messages': messages, 'services': len(services),
+                   'favorites': len(favorites), 'histories': len(histories), 'chats': len(chat_volume)}
+    }
+    with open(manifest_path, 'w', encoding='utf-8') as manifest_file:
+        json.dump(manifest, manifest_file, ensure_ascii=False, indent=2)
+    return manifest['counts']
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Generate a synthetic dataset for load testing')
+    parser.add_argument('--users', type=int, default=20000)
+    parser.add_argument('--tarots', type=int, default=1000)
+    parser.add_argument('--messages', type=int, default=500000)
+    parser.add_argument('--specializations', type=int, default=30)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--bcrypt-rounds', type=int, default=4,
+                        help='cost of the shared password hash; start the server with the same BCRYPT_ROUNDS')
+    parser.add_argument('--reset', action='store_true', help='truncate data tables before seeding')
+    parser.add_argument('--manifest', default='loadtest/dataset.json')
+    args = parser.parse_args()
+    if args.tarots >= args.users:
+        parser.error('--tarots must be less than --users')
+    counts = asyncio.run(seed(args.users, args.tarots, args.messages, args.specializations, args.seed,
+                              args.bcrypt_rounds, args.reset, args.manifest))
+    print(json.dumps(counts, indent=2))
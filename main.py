@@ -1,11 +1,17 @@
+import os
+
 import uvicorn
 from fastapi import FastAPI
-# from fastapi_cache import FastAPICache
-# from fastapi_cache.backends.redis import RedisBackend
-# from redis import asyncio as aioredis
 
 
-from database import engine, Base
+from database import engine, all_pool_stats, replica_router, read_your_writes_middleware
+from migrations.runner import current_version, latest_version, migrate
+from metrics import instrument_engines, metrics_middleware, metrics_response
+from user.hashing import password_hasher
+from message.hub import chat_hub
+from notification.stream import notification_stream
+from reference import reference_cache
+from cache import configure_response_cache
 from user.routers import router as users_router
 from role.routers import router as role_router
 from specialization.routers import router as specialization_router
@@ -16,21 +22,63 @@ from feedback.roters import router as feedback_router
 from user_service_history.routers import router as history_router
 from favorite.routers import router as favorite_router
 from status.routers import router as status_router
+from marketplace.routers import router as marketplace_router
+from search.routers import router as search_router
+
 
+MIGRATE_ON_STARTUP = os.getenv('MIGRATE_ON_STARTUP', '0').lower() in ('1', 'true', 'yes', 'on')
 
 app = FastAPI(
     title='TaroloGO'
 )
 
-# Функция для создания всех таблиц
-async def create_all_tables():
-    async with engine.begin() as conn:
-        await conn.run_sync(Base.metadata.create_all)
+# после записи клиент какое-то время читает с основной базы, а не с реплики
+app.middleware('http')(read_your_writes_middleware)
+# задержка, коды ответов и SQL-статистика по маршрутам (добавляется последним, чтобы быть внешним)
+app.middleware('http')(metrics_middleware)
+instrument_engines([engine] + [replica.engine for replica in replica_router.replicas])
+
+# Проверка версии схемы вместо create_all: один запрос на старте воркера
+# (с MIGRATE_ON_STARTUP=1 недостающие миграции применяются под advisory lock)
+async def check_schema():
+    if MIGRATE_ON_STARTUP:
+        await migrate()
+    version, expected = await current_version(), latest_version()
+    if version < expected:
+        raise RuntimeError(f'Database schema version {version} is behind {expected}; '
+                           f'run python -m migrations.runner upgrade')
 
 # Добавление события при запуске
 @app.on_event("startup")
 async def on_startup():
-    await create_all_tables()
+    await check_schema()
+    await reference_cache.load()
+    # backend кеша ответов выбирается переменной CACHE_BACKEND (memory или redis)
+    configure_response_cache()
+
+
+# Остановка пула хеширования паролей при выключении
+@app.on_event("shutdown")
+async def on_shutdown():
+    # WebSocket-клиенты получают оставшиеся события и закрытие 1001 до остановки пула,
+    # SSE-потоки завершаются, и клиенты переподключаются с Last-Event-ID
+    await chat_hub.drain()
+    notification_stream.close()
+    password_hasher.shutdown()
+    await engine.dispose()
+    await replica_router.dispose()
+
+
+# статистика пулов соединений: занятые соединения, ожидающие и время ожидания
+@app.get('/pool_stats')
+async def read_pool_stats():
+    return all_pool_stats()
+
+
+# метрики в формате Prometheus
+@app.get('/metrics', include_in_schema=False)
+async def read_metrics():
+    return metrics_response(password_hasher.metrics.snapshot(), all_pool_stats(), chat_hub.metrics.snapshot())
 
 app.include_router(users_router, tags=["User"])
 app.include_router(role_router, tags=['Role'])
@@ -42,12 +90,8 @@ app.include_router(feedback_router, tags=['Feedback'])
 app.include_router(history_router, tags=['History'])
 app.include_router(favorite_router, tags=['Favorite'])
 app.include_router(status_router, tags=['Status'])
-
-
-# @app.on_event("startup")
-# async def startup_event():
-#     redis = aioredis.from_url("redis://localhost", encoding="utf8", decode_responses=True)
-#     FastAPICache.init(RedisBackend(redis), prefix="fastapi-cache")
+app.include_router(marketplace_router, tags=['Marketplace'])
+app.include_router(search_router, tags=['Search'])
 
 
 # автоматический запуск uvicorn
@@ -0,0 +1,152 @@
+from typing import List, Literal, Optional
+
+from fastapi import APIRouter, Depends, HTTPException, Query
+from sqlalchemy import select, func, exists, distinct
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from database import get_read_session
+from reference import reference_cache
+from marketplace.schemas import TarotCard, FacetCount, MarketplaceFacets, MarketplacePage
+from pagination import paginate
+from service.models import Service
+from specialization.models import TarotSpecialization
+from user.models import UserProfile
+
+router = APIRouter(
+    prefix='/marketplace',
+    tags=['Marketplace']
+)
+
+RATING_FACETS = (4.5, 4, 3, 2, 1)  # пороги для фасета по рейтингу
+# ключ сортировки по цене для тарологов без услуг: NULLS LAST, совместимый со сравнением ключей keyset-курсора
+NO_PRICE_SORT_VALUE = 2 ** 31 - 1
+
+
+# условия поиска тарологов; specialization_ids не учитываются при with_specializations=False (для фасета)
+def tarot_search_filters(tarot_role_id: int, specialization_ids: Optional[List[int]], min_price: Optional[int],
+                         max_price: Optional[int], min_rating: Optional[float],
+                         min_experience: Optional[float], with_specializations: bool = True):
+    filters = [
+        UserProfile.role_id == tarot_role_id,
+        UserProfile.is_deleted == False
+    ]
+    if min_rating is not None:
+        filters.append(func.coalesce(UserProfile.tarot_rating, 0) >= min_rating)
+    if min_experience is not None:
+        filters.append(UserProfile.tarot_experience >= min_experience)
+    if with_specializations and specialization_ids:
+        # таролог подходит, если у него есть хотя бы одна из выбранных специализаций
+        filters.append(exists().where(
+            TarotSpecialization.tarot_id == UserProfile.user_id,
+            TarotSpecialization.specialization_id.in_(specialization_ids)
+        ))
+    if min_price is not None or max_price is not None:
+        filters.append(exists().where(Service.tarot_id == UserProfile.user_id, *price_filters(min_price, max_price)))
+    return filters
+
+
+def price_filters(min_price: Optional[int], max_price: Optional[int]):
+    filters = []
+    if min_price is not None:
+        filters.append(Service.service_price >= min_price)
+    if max_price is not None:
+        filters.append(Service.service_price <= max_price)
+    return filters
+
+
+# фасеты считаются по тем же фильтрам; фасет специализаций - без фильтра по специализациям
+async def read_marketplace_facets(session: AsyncSession, tarot_role_id: int, specialization_ids: Optional[List[int]],
+                                  min_price: Optional[int], max_price: Optional[int], min_rating: Optional[float],
+                                  min_experience: Optional[float]) -> MarketplaceFacets:
+    specialization_facet_query = await session.execute(
+        select(TarotSpecialization.specialization_id, func.count(distinct(TarotSpecialization.tarot_id)))
+        .join(UserProfile, UserProfile.user_id == TarotSpecialization.tarot_id)
+        .filter(*tarot_search_filters(tarot_role_id, specialization_ids, min_price, max_price, min_rating,
+                                      min_experience, with_specializations=False))
+        .group_by(TarotSpecialization.specialization_id)
+        .order_by(TarotSpecialization.specialization_id)
+    )
+    rating = func.coalesce(UserProfile.tarot_rating, 0)
+    rating_facet_query = await session.execute(
+        select(*(func.count().filter(rating >= threshold) for threshold in RATING_FACETS))
+        .select_from(UserProfile)
+        .filter(*tarot_search_filters(tarot_role_id, specialization_ids, min_price, max_price, min_rating,
+                                      min_experience))
+    )
+    rating_counts = rating_facet_query.one()
+    return MarketplaceFacets(
+        specializations=[FacetCount(value=specialization_id, count=tarots)
+                         for specialization_id, tarots in specialization_facet_query.all()],
+        ratings=[FacetCount(value=threshold, count=tarots) for threshold, tarots in zip(RATING_FACETS, rating_counts)]
+    )
+
+
+# поиск тарологов по специализациям, цене, рейтингу и опыту с сортировкой, фасетами и keyset-пагинацией
+@router.get('/tarots', response_model=MarketplacePage)
+async def search_tarots(specialization_ids: Optional[List[int]] = Query(None),
+                        min_price: Optional[int] = Query(None, ge=0),
+                        max_price: Optional[int] = Query(None, ge=0),
+                        min_rating: Optional[float] = Query(None, ge=0, le=5),
+                        min_experience: Optional[float] = Query(None, ge=0),
+                        sort: Literal['rating', 'price', 'reviews'] = 'rating',
+                        limit: int = Query(20, ge=1, le=100),
+                        cursor: Optional[str] = None,
+                        facets: bool = True,
+                        session: AsyncSession = Depends(get_read_session)):
+    if min_price is not None and max_price is not None and min_price > max_price:
+        raise HTTPException(status_code=400, detail="min_price is greater than max_price")
+    tarot_role_id = await reference_cache.tarot_role_id()
+
+    # минимальная цена услуг таролога, по индексу (tarot_id, service_price)
+    min_service_price = (
+        select(func.min(Service.service_price))
+        .where(Service.tarot_id == UserProfile.user_id, *price_filters(min_price, max_price))
+        .scalar_subquery()
+    )
+    if sort == 'price':
+        # тарологи без услуг не самые дешевые, они идут в конце
+        sort_value = func.coalesce(min_service_price, NO_PRICE_SORT_VALUE).label('sort_value')
+        descending = False
+    elif sort == 'reviews':
+        sort_value = func.coalesce(UserProfile.review_count, 0).label('sort_value')
+        descending = True
+    else:
+        sort_value = func.coalesce(UserProfile.tarot_rating, 0).label('sort_value')
+        descending = True
+
+    search_query = (
+        select(
+            UserProfile.user_id,
+            UserProfile.username,
+            UserProfile.first_name,
+            UserProfile.second_name,
+            UserProfile.tarot_rating,
+            UserProfile.review_count,
+            UserProfile.tarot_experience,
+            min_service_price.label('min_price'),
+            sort_value
+        )
+        .filter(*tarot_search_filters(tarot_role_id, specialization_ids, min_price, max_price, min_rating,
+                                      min_experience))
+    )
+    page = await paginate(session, search_query, [sort_value, UserProfile.user_id], limit, cursor,
+                          descending=descending)
+
+    result = MarketplacePage(
+        items=[TarotCard(
+            tarot_id=row.user_id,
+            username=row.username,
+            first_name=row.first_name,
+            second_name=row.second_name,
+            tarot_rating=row.tarot_rating,
+            review_count=row.review_count,
+            tarot_experience=row.tarot_experience,
+            min_price=row.min_price
+        ) for row in page.rows],
+        next_cursor=page.next_cursor
+    )
+    # фасеты нужны только для первой страницы выдачи
+    if facets and cursor is None:
+        result.facets = await read_marketplace_facets(session, tarot_role_id, specialization_ids, min_price,
+                                                      max_price, min_rating, min_experience)
+    return result
@@ -0,0 +1,30 @@
+from typing import List, Optional
+
+from pydantic import BaseModel
+
+from pagination import Page
+
+
+class TarotCard(BaseModel):
+    tarot_id: int
+    username: str
+    first_name: Optional[str]
+    second_name: Optional[str]
+    tarot_rating: Optional[float]
+    review_count: Optional[int]
+    tarot_experience: Optional[float]
+    min_price: Optional[int]  # минимальная цена услуг (в пределах фильтра по цене)
+
+
+class FacetCount(BaseModel):
+    value: float
+    count: int
+
+
+class MarketplaceFacets(BaseModel):
+    specializations: List[FacetCount]  # value - specialization_id
+    ratings: List[FacetCount]  # value - минимальный рейтинг, count - тарологов с рейтингом не ниже
+
+
+class MarketplacePage(Page[TarotCard]):
+    facets: Optional[MarketplaceFacets] = None
@@ -0,0 +1,80 @@
+import asyncio
+
+from sqlalchemy import select, union_all, func, text
+from sqlalchemy.dialects.postgresql import insert
+
+from database import async_session_maker
+from message.models import Message, ConversationSummary
+from message.routers import PREVIEW_LENGTH
+
+
+# заполнение таблицы conversation_summary по уже существующим сообщениям одним запросом;
+# у новых сводок вся прежняя переписка считается прочитанной
+# запуск: python -m message.backfill
+async def backfill_conversation_summaries() -> int:
+    # каждое сообщение попадает в переписку и отправителя, и получателя
+    both_directions = union_all(
+        select(
+            Message.sender_id.label('user_id'),
+            Message.recipient_id.label('companion_id'),
+            Message.message_id,
+            Message.message_text,
+            Message.message_date_send,
+            Message.sender_id
+        ),
+        select(
+            Message.recipient_id.label('user_id'),
+            Message.sender_id.label('companion_id'),
+            Message.message_id,
+            Message.message_text,
+            Message.message_date_send,
+            Message.sender_id
+        )
+    ).subquery()
+
+    # DISTINCT ON оставляет самое новое сообщение каждой пары
+    last_messages = (
+        select(
+            both_directions.c.user_id,
+            both_directions.c.companion_id,
+            both_directions.c.message_id,
+            func.left(both_directions.c.message_text, PREVIEW_LENGTH),
+            both_directions.c.message_date_send,
+            both_directions.c.sender_id,
+            both_directions.c.message_id
+        )
+        .distinct(both_directions.c.user_id, both_directions.c.companion_id)
+        .order_by(
+            both_directions.c.user_id,
+            both_directions.c.companion_id,
+            both_directions.c.message_date_send.desc(),
+            both_directions.c.message_id.desc()
+        )
+    )
+
+    summary_insert = insert(ConversationSummary).from_select(
+        ['user_id', 'companion_id', 'last_message_id', 'last_message_preview', 'last_message_date',
+         'last_sender_id', 'last_read_message_id'],
+        last_messages
+    )
+    summary_upsert = summary_insert.on_conflict_do_update(
+        index_elements=[ConversationSummary.user_id, ConversationSummary.companion_id],
+        set_={
+            'last_message_id': summary_insert.excluded.last_message_id,
+            'last_message_preview': summary_insert.excluded.last_message_preview,
+            'last_message_date': summary_insert.excluded.last_message_date,
+            'last_sender_id': summary_insert.excluded.last_sender_id
+        }
+    )
+
+    async with async_session_maker() as session:
+        # один запрос по всей таблице сообщений: statement_timeout пула снимается только в этой транзакции
+        await session.execute(text('SET LOCAL statement_timeout = 0'))
+        result = await session.execute(summary_upsert)
+        await session.commit()
+    return result.rowcount
+
+
+if __name__ == '__main__':
+    rows = asyncio.run(backfill_conversation_summaries())
+    print(f'conversation_summary rows written: {rows}')
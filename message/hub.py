@@ -0,0 +1,181 @@
+import asyncio
+import logging
+import os
+import time
+from typing import Dict, Iterable, Optional, Set
+
+from fastapi import WebSocket, WebSocketDisconnect
+from starlette.websockets import WebSocketState
+
+logger = logging.getLogger(__name__)
+
+# настройки доставки сообщений по WebSocket (задаются через переменные окружения)
+WS_SEND_QUEUE_SIZE = int(os.getenv('WS_SEND_QUEUE_SIZE', '100'))  # событий в очереди одного соединения
+WS_SEND_TIMEOUT_SECONDS = float(os.getenv('WS_SEND_TIMEOUT_SECONDS', '5'))  # дольше - клиент медленный
+WS_HEARTBEAT_SECONDS = float(os.getenv('WS_HEARTBEAT_SECONDS', '20'))  # ping при отсутствии событий
+WS_DRAIN_SECONDS = float(os.getenv('WS_DRAIN_SECONDS', '5'))  # дослать очереди при остановке
+
+# коды закрытия: 1001 - сервер останавливается, 1008 - клиент не отвечает, 1013 - клиент не успевает читать
+CLOSE_GOING_AWAY = 1001
+CLOSE_POLICY_VIOLATION = 1008
+CLOSE_TRY_AGAIN_LATER = 1013
+_CLOSE = object()  # маркер в очереди: дослать предыдущие события и закрыть соединение
+
+
+# одно WebSocket-соединение пользователя со своей ограниченной очередью отправки
+class ChatConnection:
+    def __init__(self, websocket: WebSocket, user_id: int, queue_size: int):
+        self.websocket = websocket
+        self.user_id = user_id
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+        self.last_seen = time.monotonic()
+        self.close_code: Optional[int] = None
+
+    # не блокирует публикующего: переполненная очередь означает медленного клиента
+    def offer(self, event) -> bool:
+        if self.close_code is not None:
+            return True
+        try:
+            self.queue.put_nowait(event)
+            return True
+        except asyncio.QueueFull:
+            return False
+
+    # закрытие через маркер в очереди: при остановке очередь досылается, при вытеснении непрочитанное отбрасывается
+    def close(self, code: int):
+        if self.close_code is not None:
+            return
+        self.close_code = code
+        if code != CLOSE_GOING_AWAY:
+            while not self.queue.empty():
+                self.queue.get_nowait()
+        try:
+            self.queue.put_nowait(_CLOSE)
+        except asyncio.QueueFull:
+            # при остановке очередь досылается, writer закроет соединение, когда она опустеет
+            pass
+
+
+class ChatHubMetrics:
+    def __init__(self):
+        self.connections = 0
+        self.published = 0
+        self.delivered = 0
+        self.evicted = 0
+        self.timed_out = 0
+
+    def snapshot(self):
+        return {
+            'connections': self.connections,
+            'published': self.published,
+            'delivered': self.delivered,
+            'evicted': self.evicted,
+            'timed_out': self.timed_out
+        }
+
+
+# pub/sub внутри процесса: события доставляются соединениям этого воркера; при нескольких воркерах
+# клиент после переподключения догружает пропущенное через /message/chat/...?after=newest_cursor
+class ChatHub:
+    def __init__(self, queue_size: int = WS_SEND_QUEUE_SIZE, send_timeout: float = WS_SEND_TIMEOUT_SECONDS,
+                 heartbeat: float = WS_HEARTBEAT_SECONDS):
+        self.queue_size = queue_size
+        self.send_timeout = send_timeout
+        self.heartbeat = heartbeat
+        self.metrics = ChatHubMetrics()
+        self.connections: Dict[int, Set[ChatConnection]] = {}
+        self.draining = False
+        self._writers: Set[asyncio.Task] = set()
+
+    def publish(self, user_ids: Iterable[int], event: dict):
+        self.metrics.published += 1
+        for user_id in set(user_ids):
+            for connection in list(self.connections.get(user_id, ())):
+                if not connection.offer(event):
+                    logger.warning('Evicting slow WebSocket consumer of user %s', user_id)
+                    self.metrics.evicted += 1
+                    connection.close(CLOSE_TRY_AGAIN_LATER)
+
+    def _register(self, connection: ChatConnection):
+        self.connections.setdefault(connection.user_id, set()).add(connection)
+        self.metrics.connections += 1
+
+    def _unregister(self, connection: ChatConnection):
+        user_connections = self.connections.get(connection.user_id)
+        if user_connections is not None and connection in user_connections:
+            user_connections.discard(connection)
+            self.metrics.connections -= 1
+            if not user_connections:
+                del self.connections[connection.user_id]
+
+    # отправка из очереди; при простое - ping, клиент отвечает любым сообщением (например, pong)
+    async def _writer(self, connection: ChatConnection):
+        while not (connection.close_code is not None and connection.queue.empty()):
+            try:
+                event = await asyncio.wait_for(connection.queue.get(), timeout=self.heartbeat)
+            except asyncio.TimeoutError:
+                if time.monotonic() - connection.last_seen > 2 * self.heartbeat:
+                    self.metrics.timed_out += 1
+                    connection.close(CLOSE_POLICY_VIOLATION)
+                    continue
+                event = {'type': 'ping'}
+            if event is _CLOSE:
+                break
+            try:
+                await asyncio.wait_for(connection.websocket.send_json(event), timeout=self.send_timeout)
+            except asyncio.TimeoutError:
+                self.metrics.evicted += 1
+                connection.close_code = CLOSE_TRY_AGAIN_LATER
+                break
+            except (WebSocketDisconnect, RuntimeError):
+                # клиент уже отключился, соединение снимет serve
+                return
+            if event.get('type') != 'ping':
+                self.metrics.delivered += 1
+        if connection.websocket.application_state != WebSocketState.DISCONNECTED:
+            try:
+                await connection.websocket.close(code=connection.close_code or CLOSE_GOING_AWAY)
+            except RuntimeError:
+                pass
+
+    # обслуживание соединения: writer отправляет события, текущая задача читает входящие для heartbeat
+    async def serve(self, websocket: WebSocket, user_id: int):
+        if self.draining:
+            await websocket.close(code=CLOSE_GOING_AWAY)
+            return
+        await websocket.accept()
+        connection = ChatConnection(websocket, user_id, self.queue_size)
+        self._register(connection)
+        writer = asyncio.create_task(self._writer(connection))
+        self._writers.add(writer)
+        writer.add_done_callback(self._writers.discard)
+        try:
+            while not writer.done():
+                receive = asyncio.create_task(websocket.receive_text())
+                await asyncio.wait({receive, writer}, return_when=asyncio.FIRST_COMPLETED)
+                if not receive.done():
+                    receive.cancel()
+                    break
+                receive.result()
+                connection.last_seen = time.monotonic()
+        except (WebSocketDisconnect, RuntimeError):
+            pass
+        finally:
+            self._unregister(connection)
+            if not writer.done():
+                connection.close(CLOSE_GOING_AWAY)
+                writer.cancel()
+
+    # остановка: новые соединения не принимаются, очереди досылаются, оставшиеся закрываются с 1001
+    async def drain(self, timeout: float = WS_DRAIN_SECONDS):
+        self.draining = True
+        for user_connections in list(self.connections.values()):
+            for connection in list(user_connections):
+                connection.close(CLOSE_GOING_AWAY)
+        if self._writers:
+            _, pending = await asyncio.wait(set(self._writers), timeout=timeout)
+            for writer in pending:
+                writer.cancel()
+
+
+chat_hub = ChatHub()
@@ -1,26 +1,57 @@
-from sqlalchemy import Column, Integer, ForeignKey, DateTime, String, func, UniqueConstraint
+from sqlalchemy import Column, Integer, ForeignKey, DateTime, String, func, UniqueConstraint, Index
 from sqlalchemy.orm import relationship
 
 from database import Base
+from fulltext import text_search_vector
 
 
 class Message(Base):
     __tablename__ = 'message'
-    message_id = Column(Integer, primary_key=True, index=True)
+    message_id = Column(Integer, primary_key=True)
     sender_id = Column(Integer, ForeignKey('user_profile.user_id'))
     recipient_id = Column(Integer, ForeignKey('user_profile.user_id'))
-    message_text = Column(String, index=True)
+    message_text = Column(String)
     message_date_send = Column(DateTime, nullable=False, default=func.now())
 
     sender = relationship("UserProfile", foreign_keys=[sender_id])
     recipient = relationship("UserProfile", foreign_keys=[recipient_id])
+    __table_args__ = (
+        # индекс под постраничную выборку переписки по ключу (message_date_send, message_id)
+        Index('ix_message_conversation', 'sender_id', 'recipient_id', 'message_date_send', 'message_id'),
+        # полнотекстовый поиск по переписке (/message/search)
+        Index('ix_message_text_search', text_search_vector(message_text), postgresql_using='gin'),
+    )
 
 
 class Contacts(Base):
     __tablename__ = 'contacts'
-    contact_id = Column(Integer, primary_key=True, index=True)
+    contact_id = Column(Integer, primary_key=True)
     user_id = Column(Integer, ForeignKey('user_profile.user_id'))
     user_contact_id = Column(Integer, ForeignKey('user_profile.user_id'))
     __table_args__ = (
         UniqueConstraint('user_id', 'user_contact_id', name='_user_contact_uc'),
-    )
\ No newline at end of file
+    )
+
+
+# материализованная сводка переписки для экрана контактов: одна строка на пару (пользователь, собеседник)
+class ConversationSummary(Base):
+    __tablename__ = 'conversation_summary'
+    user_id = Column(Integer, ForeignKey('user_profile.user_id'), primary_key=True)
+    companion_id = Column(Integer, ForeignKey('user_profile.user_id'), primary_key=True)
+    last_message_id = Column(Integer, ForeignKey('message.message_id', ondelete='SET NULL'), nullable=True)
+    last_message_preview = Column(String, nullable=False)
+    last_message_date = Column(DateTime, nullable=False)
+    last_sender_id = Column(Integer, nullable=False)
+    # отметка прочтения: входящие сообщения собеседника с message_id не больше нее прочитаны
+    last_read_message_id = Column(Integer, nullable=False, default=0, server_default='0')
+    unread_count = Column(Integer, nullable=False, default=0, server_default='0')  # ведется при отправке и прочтении
+    __table_args__ = (
+        Index('ix_conversation_summary_user_date', 'user_id', 'last_message_date'),
+    )
+
+
+# общее количество непрочитанных сообщений пользователя (сумма unread_count его сводок) для значка
+class UserMessageState(Base):
+    __tablename__ = 'user_message_state'
+    user_id = Column(Integer, ForeignKey('user_profile.user_id'), primary_key=True)
+    unread_count = Column(Integer, nullable=False, default=0, server_default='0')
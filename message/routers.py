@@ -1,14 +1,19 @@
 from datetime import datetime
-from typing import List, Dict
+from typing import List, Dict, Optional
 
-from fastapi import APIRouter, Depends, HTTPException
-from sqlalchemy import select, func
+from fastapi import APIRouter, Depends, HTTPException, Query, WebSocket
+from sqlalchemy import select, func, or_, and_, tuple_, union_all, delete, update, case, Float
+from sqlalchemy.dialects.postgresql import insert
 from sqlalchemy.orm import aliased
 
 from user.models import UserProfile
-from message.schemas import MessageOut, MessageCreate, ContactsInfo
-from message.models import Message, Contacts
-from database import get_session
+from message.schemas import (MessageOut, MessageCreate, ContactsInfo, ChatPage, MessageSearchOut, MessageRead,
+                             UnreadCount)
+from message.models import Message, Contacts, ConversationSummary, UserMessageState
+from message.hub import chat_hub
+from database import get_session, get_read_session
+from pagination import Page, encode_cursor, decode_cursor, paginate
+from fulltext import text_search_vector, text_search_query
 from sqlalchemy.ext.asyncio import AsyncSession
 
 router = APIRouter(
@@ -16,37 +21,156 @@ router = APIRouter(
     tags=['Message/Contacts']
 )
 
+PREVIEW_LENGTH = 100  # длина превью последнего сообщения в сводке переписки
+
+
+# функция обновления сводок переписки у обоих собеседников (без commit, в транзакции отправки);
+# у получателя счетчики непрочитанных растут на единицу
+async def upsert_conversation_summaries(message: Message, session: AsyncSession):
+    preview = message.message_text[:PREVIEW_LENGTH]
+    # строки блокируются в одном порядке, чтобы встречные отправки не взаимоблокировались
+    pairs = sorted({(message.sender_id, message.recipient_id), (message.recipient_id, message.sender_id)})
+    summary_insert = insert(ConversationSummary).values([
+        {
+            'user_id': user_id,
+            'companion_id': companion_id,
+            'last_message_id': message.message_id,
+            'last_message_preview': preview,
+            'last_message_date': message.message_date_send,
+            'last_sender_id': message.sender_id,
+            'unread_count': int(user_id != message.sender_id)
+        } for user_id, companion_id in pairs
+    ])
+    # не перезаписываем сводку более старым сообщением (транзакции отправки могут завершиться не по порядку),
+    # но непрочитанное учитываем всегда
+    is_newer = or_(
+        ConversationSummary.last_message_id.is_(None),
+        ConversationSummary.last_message_id < summary_insert.excluded.last_message_id
+    )
+    summary_upsert = summary_insert.on_conflict_do_update(
+        index_elements=[ConversationSummary.user_id, ConversationSummary.companion_id],
+        set_={
+            **{
+                column: case((is_newer, getattr(summary_insert.excluded, column)),
+                             else_=getattr(ConversationSummary, column))
+                for column in ('last_message_id', 'last_message_preview', 'last_message_date', 'last_sender_id')
+            },
+            'unread_count': ConversationSummary.unread_count + summary_insert.excluded.unread_count
+        }
+    )
+    await session.execute(summary_upsert)
+    if message.recipient_id != message.sender_id:
+        await add_unread_total(message.recipient_id, 1, session)
+
+
+# изменение общего счетчика непрочитанных пользователя (без commit)
+async def add_unread_total(user_id: int, delta: int, session: AsyncSession) -> int:
+    total_insert = insert(UserMessageState).values(user_id=user_id, unread_count=max(delta, 0))
+    total_upsert = total_insert.on_conflict_do_update(
+        index_elements=[UserMessageState.user_id],
+        set_={'unread_count': func.greatest(UserMessageState.unread_count + delta, 0)}
+    ).returning(UserMessageState.unread_count)
+    total_result = await session.execute(total_upsert)
+    return total_result.scalar_one()
+
+
+# функция пересчета сводок пары собеседников после удаления сообщения, без commit;
+# отметки прочтения сохраняются, удаленное непрочитанное сообщение вычитается из счетчиков
+async def refresh_conversation_summaries(deleted_message: Message, session: AsyncSession):
+    user_id, companion_id = deleted_message.sender_id, deleted_message.recipient_id
+    pair_summaries = tuple_(ConversationSummary.user_id, ConversationSummary.companion_id).in_(
+        [(user_id, companion_id), (companion_id, user_id)])
+    # сводки пары блокируются в том же порядке, что и при отправке, и до счетчиков пользователя,
+    # чтобы удаление и встречная отправка не взаимоблокировались
+    await session.execute(
+        select(ConversationSummary.user_id)
+        .where(pair_summaries)
+        .order_by(ConversationSummary.user_id, ConversationSummary.companion_id)
+        .with_for_update()
+    )
+    if user_id != companion_id:
+        unread_update = await session.execute(
+            update(ConversationSummary)
+            .where(
+                ConversationSummary.user_id == companion_id,
+                ConversationSummary.companion_id == user_id,
+                ConversationSummary.last_read_message_id < deleted_message.message_id,
+                ConversationSummary.unread_count > 0
+            )
+            .values(unread_count=ConversationSummary.unread_count - 1)
+        )
+        if unread_update.rowcount:
+            await add_unread_total(companion_id, -1, session)
 
-# функция для добавления контакта
-async def add_contact(user_id: int, user_contact_id: int, session: AsyncSession = Depends(get_session)):
-    contact_exists_ = await session.execute(
-        select(Contacts).filter_by(user_id=user_id, user_contact_id=user_contact_id))
-    contact_exists = contact_exists_.scalars().first()
-    if not contact_exists:
-        db_contact = Contacts(
-            user_id=user_id,
-            user_contact_id=user_contact_id
+    last_message_query = await session.execute(
+        select(Message).filter(
+            or_(
+                and_(Message.sender_id == user_id, Message.recipient_id == companion_id),
+                and_(Message.sender_id == companion_id, Message.recipient_id == user_id)
+            )
+        ).order_by(Message.message_date_send.desc(), Message.message_id.desc()).limit(1)
+    )
+    last_message = last_message_query.scalars().first()
+    if last_message is None:
+        await session.execute(delete(ConversationSummary).where(pair_summaries))
+    else:
+        await session.execute(
+            update(ConversationSummary)
+            .where(pair_summaries)
+            .values(
+                last_message_id=last_message.message_id,
+                last_message_preview=last_message.message_text[:PREVIEW_LENGTH],
+                last_message_date=last_message.message_date_send,
+                last_sender_id=last_message.sender_id
+            )
         )
-        session.add(db_contact)
-        await session.commit()
-        await session.refresh(db_contact)
 
 
-# функция для создания нового сообщения
+# функция для добавления контактов обоим собеседникам (идемпотентно, без commit)
+async def add_contacts(user_id: int, user_contact_id: int, session: AsyncSession):
+    pairs = {(user_id, user_contact_id), (user_contact_id, user_id)}
+    await session.execute(
+        insert(Contacts)
+        .values([{'user_id': owner_id, 'user_contact_id': contact_id} for owner_id, contact_id in pairs])
+        .on_conflict_do_nothing(constraint='_user_contact_uc')
+    )
+
+
+# функция для создания нового сообщения: сообщение, контакты и сводки пишутся в одной транзакции
 async def create_message_for_db(message: MessageCreate, session: AsyncSession = Depends(get_session)):
-    db_message = Message(
-        sender_id=message.sender_id,
-        recipient_id=message.recipient_id,
-        message_text=message.message_text
+    message_insert = await session.execute(
+        insert(Message)
+        .values(
+            sender_id=message.sender_id,
+            recipient_id=message.recipient_id,
+            message_text=message.message_text
+        )
+        .returning(Message)
     )
-    session.add(db_message)
+    db_message = message_insert.scalars().one()
+    await add_contacts(message.sender_id, message.recipient_id, session)
+    await upsert_conversation_summaries(db_message, session)
     await session.commit()
-    await session.refresh(db_message)
-    await add_contact(message.sender_id, message.recipient_id, session)
-    await add_contact(message.recipient_id, message.sender_id, session)
+    # после commit: подписчик не должен получить сообщение, которого еще нет в базе
+    publish_message(db_message)
     return db_message
 
 
+# событие о новом сообщении для WebSocket-соединений обоих собеседников (других устройств отправителя)
+def publish_message(message: Message):
+    event = {
+        'type': 'message',
+        'message': MessageOut(
+            message_id=message.message_id,
+            sender_id=message.sender_id,
+            recipient_id=message.recipient_id,
+            message_text=message.message_text,
+            message_date_send=message.message_date_send
+        ).model_dump(mode='json')
+    }
+    chat_hub.publish((message.recipient_id, message.sender_id), event)
+
+
 # запрос для добавления сообщения в базу данных и генерации нового контакта
 @router.post("/create", response_model=MessageOut)
 async def create_message(message: MessageCreate, session: AsyncSession = Depends(get_session)):
@@ -56,29 +180,24 @@ async def create_message(message: MessageCreate, session: AsyncSession = Depends
     return db_message
 
 
-# Функция для получения всей переписки между двумя пользователями
-async def get_messages_from_db(sender_id: int, recipient_id: int, session: AsyncSession = Depends(get_session)):
-    # Асинхронный запрос для отправленных сообщений
-    sent_messages_query = select(Message).filter(
-        Message.sender_id == sender_id,
-        Message.recipient_id == recipient_id
-    )
-    sent_messages_result = await session.execute(sent_messages_query)
-    sent_messages = sent_messages_result.scalars().all()
-
-    # Асинхронный запрос для полученных сообщений
-    received_messages_query = select(Message).filter(
-        Message.sender_id == recipient_id,
-        Message.recipient_id == sender_id
-    )
-    received_messages_result = await session.execute(received_messages_query)
-    received_messages = received_messages_result.scalars().all()
+# подписка на новые сообщения пользователя вместо опроса show_chat и contacts_info;
+# пропущенное за время разрыва догружается через /message/chat/...?after=newest_cursor
+@router.websocket("/ws/{user_id}")
+async def message_stream(websocket: WebSocket, user_id: int):
+    await chat_hub.serve(websocket, user_id)
 
-    # Объединение отправленных и полученных сообщений
-    all_messages = sent_messages + received_messages
 
-    # Сортировка сообщений по дате отправки
-    all_messages.sort(key=lambda msg: msg.message_date_send)
+# Функция для получения всей переписки между двумя пользователями
+async def get_messages_from_db(sender_id: int, recipient_id: int, session: AsyncSession = Depends(get_session)):
+    # один упорядоченный запрос по обоим направлениям переписки
+    all_messages_query = select(Message).filter(
+        or_(
+            and_(Message.sender_id == sender_id, Message.recipient_id == recipient_id),
+            and_(Message.sender_id == recipient_id, Message.recipient_id == sender_id)
+        )
+    ).order_by(Message.message_date_send, Message.message_id)
+    all_messages_result = await session.execute(all_messages_query)
+    all_messages = all_messages_result.scalars().all()
 
     if not all_messages:
         raise HTTPException(status_code=404, detail="No messages found")
@@ -99,71 +218,94 @@ async def get_messages_from_db(sender_id: int, recipient_id: int, session: Async
 
 # Запрос для получения переписки между пользователями
 @router.get("/show_chat/{sender_id}/recipient/{recipient_id}", response_model=Dict[str, MessageOut])
-async def get_messages(sender_id: int, recipient_id: int, session: AsyncSession = Depends(get_session)):
+async def get_messages(sender_id: int, recipient_id: int, session: AsyncSession = Depends(get_read_session)):
     return await get_messages_from_db(sender_id, recipient_id, session)
 
 
-async def get_last_messages_from_db(user_id: int, session: AsyncSession = Depends(get_session)):
-    sent_messages = aliased(Message)
-    received_messages = aliased(Message)
+# Функция для постраничного получения переписки (keyset-пагинация по (message_date_send, message_id))
+async def get_chat_page_from_db(user_id: int, companion_id: int, limit: int, before: Optional[str] = None,
+                                after: Optional[str] = None, session: AsyncSession = Depends(get_session)):
+    if before and after:
+        raise HTTPException(status_code=400, detail="Use either before or after cursor")
+    message_key = tuple_(Message.message_date_send, Message.message_id)
+
+    # выборка одного направления переписки, идущая по индексу ix_message_conversation
+    def direction_query(from_id: int, to_id: int):
+        direction = select(Message).filter(Message.sender_id == from_id, Message.recipient_id == to_id)
+        if after:
+            direction = direction.filter(message_key > tuple_(*decode_cursor(after, [datetime, int])))
+            direction = direction.order_by(Message.message_date_send, Message.message_id)
+        else:
+            if before:
+                direction = direction.filter(message_key < tuple_(*decode_cursor(before, [datetime, int])))
+            direction = direction.order_by(Message.message_date_send.desc(), Message.message_id.desc())
+        return direction.limit(limit + 1).subquery()
+
+    # оба направления ограничены limit + 1, поэтому запрос не читает всю переписку
+    conversation = union_all(
+        select(direction_query(user_id, companion_id)),
+        select(direction_query(companion_id, user_id))
+    ).subquery()
+    page_message = aliased(Message, conversation)
+    if after:
+        page_order = (page_message.message_date_send, page_message.message_id)
+    else:
+        page_order = (page_message.message_date_send.desc(), page_message.message_id.desc())
+    result = await session.execute(select(page_message).order_by(*page_order).limit(limit + 1))
+    page = result.scalars().all()
+
+    has_more = len(page) > limit
+    page = page[:limit]
+    if after:
+        page.reverse()
+
+    messages = [
+        MessageOut(
+            message_id=message.message_id,
+            sender_id=message.sender_id,
+            recipient_id=message.recipient_id,
+            message_text=message.message_text,
+            message_date_send=message.message_date_send
+        ) for message in page
+    ]
+    newest_cursor = encode_cursor(page[0].message_date_send, page[0].message_id) if page else after
+    next_cursor = None
+    if has_more and not after:
+        next_cursor = encode_cursor(page[-1].message_date_send, page[-1].message_id)
 
-    sent_subquery = (
-        select(
-            sent_messages.recipient_id.label('contact_id'),
-            sent_messages.message_date_send.label('message_date_send'),
-            sent_messages.message_id.label('message_id'),
-            sent_messages.sender_id.label('sender_id')
-        )
-        .filter(sent_messages.sender_id == user_id)
-    )
+    return ChatPage(messages=messages, next_cursor=next_cursor, newest_cursor=newest_cursor, has_more=has_more)
 
-    received_subquery = (
-        select(
-            received_messages.sender_id.label('contact_id'),
-            received_messages.message_date_send.label('message_date_send'),
-            received_messages.message_id.label('message_id'),
-            received_messages.sender_id.label('sender_id')
-        )
-        .filter(received_messages.recipient_id == user_id)
-    )
 
-    union_subquery = sent_subquery.union_all(received_subquery).subquery()
+# Запрос для постраничного получения переписки: от новых к старым (before) или только новые сообщения (after)
+@router.get("/chat/{user_id}/companion/{companion_id}", response_model=ChatPage)
+async def get_chat_page(user_id: int, companion_id: int, limit: int = Query(50, ge=1, le=200),
+                        before: Optional[str] = None, after: Optional[str] = None,
+                        session: AsyncSession = Depends(get_read_session)):
+    return await get_chat_page_from_db(user_id, companion_id, limit, before, after, session)
 
-    last_messages_subquery = (
-        select(
-            union_subquery.c.contact_id,
-            func.max(union_subquery.c.message_date_send).label('last_date')
-        )
-        .group_by(union_subquery.c.contact_id)
-    ).subquery()
 
+async def get_last_messages_from_db(user_id: int, session: AsyncSession = Depends(get_session)):
+    # чтение материализованных сводок по индексу (user_id, last_message_date);
+    # отметка прочтения собеседника - из его зеркальной сводки по первичному ключу
+    companion_summary = aliased(ConversationSummary)
     last_messages_query = (
         select(
-            Message.message_id,
-            Message.sender_id,
-            Message.recipient_id,
-            Message.message_text,
-            Message.message_date_send,
-            UserProfile.user_id.label('companion_id'),
+            ConversationSummary.companion_id,
+            ConversationSummary.last_sender_id,
+            ConversationSummary.last_message_preview,
+            ConversationSummary.last_message_date,
+            ConversationSummary.unread_count,
+            ConversationSummary.last_read_message_id,
+            func.coalesce(companion_summary.last_read_message_id, 0).label('companion_read_message_id'),
             UserProfile.username,
             UserProfile.first_name,
             UserProfile.second_name
         )
-        .join(
-            last_messages_subquery,
-            (Message.message_date_send == last_messages_subquery.c.last_date) &
-            ((Message.sender_id == last_messages_subquery.c.contact_id) |
-             (Message.recipient_id == last_messages_subquery.c.contact_id))
-        )
-        .join(
-            UserProfile,
-            (UserProfile.user_id == Message.sender_id) |
-            (UserProfile.user_id == Message.recipient_id)
-        )
-        .filter(
-            (UserProfile.user_id != user_id)
-        )
-        .order_by(Message.message_date_send.desc())
+        .join(UserProfile, UserProfile.user_id == ConversationSummary.companion_id)
+        .outerjoin(companion_summary, and_(companion_summary.user_id == ConversationSummary.companion_id,
+                                           companion_summary.companion_id == ConversationSummary.user_id))
+        .filter(ConversationSummary.user_id == user_id)
+        .order_by(ConversationSummary.last_message_date.desc())
     )
 
     result = await session.execute(last_messages_query)
@@ -179,18 +321,120 @@ async def get_last_messages_from_db(user_id: int, session: AsyncSession = Depend
             username=message.username,
             first_name=message.first_name,
             second_name=message.second_name,
-            sender_id=message.sender_id,
-            message_text=message.message_text,
-            message_date_send=message.message_date_send,
+            sender_id=message.last_sender_id,
+            message_text=message.last_message_preview,
+            message_date_send=message.last_message_date,
+            unread_count=message.unread_count,
+            last_read_message_id=message.last_read_message_id,
+            companion_read_message_id=message.companion_read_message_id
         ) for index, message in enumerate(last_messages)
     }
 
     return messages_dict
 
 
+# функция отметки прочтения переписки до message_id включительно: отметка только растет,
+# счетчики уменьшаются на число впервые прочитанных сообщений
+async def mark_chat_read_in_db(user_id: int, companion_id: int, message_id: int,
+                               session: AsyncSession = Depends(get_session)):
+    # блокировка сводки упорядочивает прочтение с параллельной отправкой в ту же переписку
+    summary_query = await session.execute(
+        select(ConversationSummary)
+        .filter(ConversationSummary.user_id == user_id, ConversationSummary.companion_id == companion_id)
+        .with_for_update()
+    )
+    summary = summary_query.scalars().first()
+    if summary is None:
+        raise HTTPException(status_code=404, detail="Conversation not found")
+
+    read_up_to = min(message_id, summary.last_message_id or 0)
+    newly_read = 0
+    if read_up_to > summary.last_read_message_id and summary.unread_count > 0:
+        if read_up_to == summary.last_message_id:
+            # прочитано до последнего сообщения - обычный случай, без подсчета
+            newly_read = summary.unread_count
+        else:
+            # подсчет только впервые прочитанного диапазона одного направления переписки
+            newly_read_query = await session.execute(
+                select(func.count()).select_from(Message).filter(
+                    Message.sender_id == companion_id,
+                    Message.recipient_id == user_id,
+                    Message.message_id > summary.last_read_message_id,
+                    Message.message_id <= read_up_to
+                )
+            )
+            newly_read = min(newly_read_query.scalar_one(), summary.unread_count)
+    if read_up_to > summary.last_read_message_id:
+        summary.last_read_message_id = read_up_to
+        summary.unread_count -= newly_read
+    total_unread_count = await add_unread_total(user_id, -newly_read, session)
+    read_state = MessageRead(
+        sender_id=companion_id,
+        recipient_id=user_id,
+        last_read_message_id=summary.last_read_message_id,
+        message_date_read=datetime.utcnow(),
+        unread_count=summary.unread_count,
+        total_unread_count=total_unread_count
+    )
+    await session.commit()
+    # квитанция о прочтении собеседнику и другим устройствам пользователя
+    chat_hub.publish((companion_id, user_id), {
+        'type': 'read',
+        'reader_id': user_id,
+        'companion_id': companion_id,
+        'last_read_message_id': read_state.last_read_message_id,
+        'message_date_read': read_state.message_date_read.isoformat()
+    })
+    return read_state
+
+
+# Запрос для отметки сообщений собеседника прочитанными до message_id включительно
+@router.post("/read/{user_id}/companion/{companion_id}", response_model=MessageRead)
+async def mark_chat_read(user_id: int, companion_id: int, message_id: int,
+                         session: AsyncSession = Depends(get_session)):
+    return await mark_chat_read_in_db(user_id, companion_id, message_id, session)
+
+
+# общее количество непрочитанных сообщений пользователя (одна строка по первичному ключу)
+@router.get("/unread/{user_id}", response_model=UnreadCount)
+async def get_unread_count(user_id: int, session: AsyncSession = Depends(get_read_session)):
+    unread_query = await session.execute(
+        select(UserMessageState.unread_count).filter(UserMessageState.user_id == user_id))
+    return UnreadCount(user_id=user_id, unread_count=unread_query.scalar_one_or_none() or 0)
+
+
+# поиск по сообщениям переписок пользователя (полнотекстовый, по GIN-индексу ix_message_text_search),
+# от более релевантных к менее; companion_id ограничивает поиск одной перепиской
+@router.get("/search/{user_id}", response_model=Page[MessageSearchOut])
+async def search_messages(user_id: int, q: str = Query(..., min_length=1, max_length=200),
+                          companion_id: Optional[int] = None, limit: int = Query(20, ge=1, le=100),
+                          cursor: Optional[str] = None, session: AsyncSession = Depends(get_read_session)):
+    search_query = text_search_query(q)
+    search_vector = text_search_vector(Message.message_text)
+    rank = func.ts_rank_cd(search_vector, search_query, type_=Float).label('rank')
+    if companion_id is None:
+        scope = or_(Message.sender_id == user_id, Message.recipient_id == user_id)
+    else:
+        scope = or_(and_(Message.sender_id == user_id, Message.recipient_id == companion_id),
+                    and_(Message.sender_id == companion_id, Message.recipient_id == user_id))
+    found_query = (
+        select(
+            Message.message_id,
+            Message.sender_id,
+            Message.recipient_id,
+            Message.message_text,
+            Message.message_date_send,
+            rank
+        )
+        .filter(search_vector.op('@@')(search_query), scope)
+    )
+    page = await paginate(session, found_query, [rank, Message.message_id], limit, cursor, descending=True)
+    return page.to_page()
+
+
 # запрос для получения никнейма, последнего отправленного сообщения, даты и времени его отправки и статуса просмотра каждого контакта для определенного пользователя
 @router.get("/contacts_info/{user_id}", response_model=Dict[str, ContactsInfo])
-async def get_last_message(user_id: int, session: AsyncSession = Depends(get_session)):
+async def get_last_message(user_id: int, session: AsyncSession = Depends(get_read_session)):
     return await get_last_messages_from_db(user_id, session)
 
 
@@ -210,6 +454,8 @@ async def delete_message_from_db(db: AsyncSession, sender_id: int, recipient_id:
         raise HTTPException(status_code=404, detail="Message not found")
 
     await db.delete(message)
+    await db.flush()
+    await refresh_conversation_summaries(message, db)
     await db.commit()
     return {"message": "Message deleted successfully"}
 
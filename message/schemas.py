@@ -11,9 +11,17 @@ class MessageCreate(BaseModel):
 
 
 class MessageRead(BaseModel):
-    sender_id: int
-    recipient_id: int
+    sender_id: int  # собеседник, чьи сообщения прочитаны
+    recipient_id: int  # прочитавший пользователь
+    last_read_message_id: int
     message_date_read: datetime
+    unread_count: int  # непрочитанные в этой переписке
+    total_unread_count: int  # непрочитанные во всех переписках
+
+
+class UnreadCount(BaseModel):
+    user_id: int
+    unread_count: int
 
 
 class MessageOut(BaseModel):
@@ -44,7 +52,26 @@ class ContactsInfo(BaseModel):
     sender_id: int
     message_text: str
     message_date_send: datetime
+    unread_count: int
+    last_read_message_id: int  # отметка прочтения пользователя
+    companion_read_message_id: int  # отметка прочтения собеседника (статус "прочитано" у своих сообщений)
 
 
 class ContactsResponse(BaseModel):
-    messages: List[ContactsInfo]
\ No newline at end of file
+    messages: List[ContactsInfo]
+
+
+class ChatPage(BaseModel):
+    messages: List[MessageOut]  # от новых к старым
+    next_cursor: Optional[str]  # курсор для загрузки более старых сообщений
+    newest_cursor: Optional[str]  # курсор для получения только новых сообщений (after)
+    has_more: bool
+
+
+class MessageSearchOut(BaseModel):
+    message_id: int
+    sender_id: int
+    recipient_id: int
+    message_text: str
+    message_date_send: datetime
+    rank: float
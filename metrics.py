@@ -0,0 +1,227 @@
+import logging
+import os
+import re
+import threading
+import time
+from collections import Counter
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from fastapi import Request
+from fastapi.responses import PlainTextResponse
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import AsyncEngine
+from starlette.routing import Match
+
+from stats import Histogram
+
+logger = logging.getLogger(__name__)
+
+# сколько одинаковых по форме запросов за один HTTP-запрос считается признаком N+1
+N_PLUS_ONE_THRESHOLD = int(os.getenv('N_PLUS_ONE_THRESHOLD', '10'))
+
+QUERY_COUNT_BUCKETS = (1, 2, 3, 5, 10, 20, 50, 100, 250)
+UNMATCHED_ROUTE = '<unmatched>'
+
+
+# SQL-статистика текущего HTTP-запроса; объект изменяемый, поэтому обновления из событий
+# SQLAlchemy (они выполняются в greenlet с копией контекста) видны middleware
+@dataclass
+class RequestStats:
+    queries: int = 0
+    rows: int = 0
+    db_time: float = 0.0
+    shapes: Counter = field(default_factory=Counter)
+
+
+current_request_stats: ContextVar[Optional[RequestStats]] = ContextVar('current_request_stats', default=None)
+
+
+# форма запроса: текст без литералов и лишних пробелов (параметры SQLAlchemy и так вынесены в bind)
+def statement_shape(statement: str) -> str:
+    shape = re.sub(r"'[^']*'", '?', statement)
+    shape = re.sub(r'\b\d+\b', '?', shape)
+    return ' '.join(shape.split())
+
+
+# метрики одного маршрута
+class RouteMetrics:
+    def __init__(self):
+        self.latency = Histogram()
+        self.db_time = Histogram()
+        self.queries = Histogram(QUERY_COUNT_BUCKETS)
+        self.statuses: Counter = Counter()
+        self.rows = 0
+        self.in_flight = 0
+        self.n_plus_one: Counter = Counter()
+
+
+class MetricsRegistry:
+    def __init__(self, n_plus_one_threshold: int = N_PLUS_ONE_THRESHOLD):
+        self.n_plus_one_threshold = n_plus_one_threshold
+        self.routes: Dict[Tuple[str, str], RouteMetrics] = {}
+        self._lock = threading.Lock()
+
+    def route(self, method: str, path: str) -> RouteMetrics:
+        key = (method, path)
+        metrics = self.routes.get(key)
+        if metrics is None:
+            with self._lock:
+                metrics = self.routes.setdefault(key, RouteMetrics())
+        return metrics
+
+    def record(self, metrics: RouteMetrics, method: str, path: str, status_code: int, elapsed: float,
+               stats: RequestStats):
+        metrics.latency.observe(elapsed)
+        metrics.queries.observe(stats.queries)
+        metrics.db_time.observe(stats.db_time)
+        with self._lock:
+            metrics.statuses[status_code] += 1
+            metrics.rows += stats.rows
+        for shape, repeats in stats.shapes.items():
+            if repeats > self.n_plus_one_threshold:
+                with self._lock:
+                    metrics.n_plus_one[shape] += 1
+                logger.warning('Possible N+1 in %s %s: %d x %s', method, path, repeats, shape[:200])
+
+
+metrics_registry = MetricsRegistry()
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info['query_started'] = time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    stats = current_request_stats.get()
+    started = conn.info.pop('query_started', None)
+    if stats is None or started is None:
+        return
+    stats.queries += 1
+    stats.db_time += time.perf_counter() - started
+    stats.rows += max(getattr(cursor, 'rowcount', 0) or 0, 0)
+    stats.shapes[statement_shape(statement)] += 1
+
+
+# подписка на события выполнения SQL (основная база и реплики)
+def instrument_engines(engines: Iterable[AsyncEngine]):
+    for engine in engines:
+        if not event.contains(engine.sync_engine, 'before_cursor_execute', _before_cursor_execute):
+            event.listen(engine.sync_engine, 'before_cursor_execute', _before_cursor_execute)
+            event.listen(engine.sync_engine, 'after_cursor_execute', _after_cursor_execute)
+
+
+# шаблон пути маршрута (/user/find/{user_id}), чтобы не плодить метрики на каждый id
+def route_path(request: Request) -> str:
+    for route in request.app.router.routes:
+        match, _ = route.matches(request.scope)
+        if match == Match.FULL:
+            return getattr(route, 'path', UNMATCHED_ROUTE)
+    return UNMATCHED_ROUTE
+
+
+async def metrics_middleware(request: Request, call_next):
+    method = request.method
+    path = route_path(request)
+    metrics = metrics_registry.route(method, path)
+    stats = RequestStats()
+    token = current_request_stats.set(stats)
+    metrics.in_flight += 1
+    started = time.perf_counter()
+    status_code = 500
+    try:
+        response = await call_next(request)
+        status_code = response.status_code
+        return response
+    finally:
+        metrics.in_flight -= 1
+        current_request_stats.reset(token)
+        metrics_registry.record(metrics, method, path, status_code, time.perf_counter() - started, stats)
+
+
+# вывод в текстовом формате Prometheus; строки одной метрики должны идти подряд, поэтому копим их по именам
+def _escape(value: object) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(labels: Dict[str, object]) -> str:
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in labels.items()) + '}'
+
+
+class PrometheusWriter:
+    def __init__(self):
+        self.families: Dict[str, List[str]] = {}
+
+    def declare(self, name: str, metric_type: str, help_text: str):
+        if name not in self.families:
+            self.families[name] = [f'# HELP {name} {help_text}', f'# TYPE {name} {metric_type}']
+
+    def sample(self, family: str, value, labels: Dict[str, object] = None, suffix: str = ''):
+        self.families[family].append(f'{family}{suffix}{_labels(labels or {})} {value}')
+
+    def histogram(self, name: str, help_text: str, snapshot: Dict, labels: Dict[str, object] = None):
+        labels = labels or {}
+        self.declare(name, 'histogram', help_text)
+        for bound, count in snapshot['buckets'].items():
+            self.sample(name, count, {**labels, 'le': bound}, '_bucket')
+        self.sample(name, snapshot['sum'], labels, '_sum')
+        self.sample(name, snapshot['count'], labels, '_count')
+
+    def render(self) -> str:
+        return '\n'.join(line for lines in self.families.values() for line in lines) + '\n'
+
+
+def render_metrics(hashing: Dict, pools: Dict, chat: Dict) -> str:
+    writer = PrometheusWriter()
+    for (method, path), metrics in sorted(metrics_registry.routes.items()):
+        labels = {'method': method, 'route': path}
+        writer.histogram('http_request_duration_seconds', 'HTTP request latency', metrics.latency.snapshot(), labels)
+        writer.histogram('http_request_db_seconds', 'Time spent in SQL per request', metrics.db_time.snapshot(),
+                         labels)
+        writer.histogram('http_request_db_queries', 'SQL queries per request', metrics.queries.snapshot(), labels)
+        writer.declare('http_requests_in_flight', 'gauge', 'Requests being processed')
+        writer.sample('http_requests_in_flight', metrics.in_flight, labels)
+        writer.declare('http_requests_total', 'counter', 'Finished requests by status code')
+        for status_code, count in sorted(metrics.statuses.items()):
+            writer.sample('http_requests_total', count, {**labels, 'status': status_code})
+        writer.declare('http_request_db_rows_total', 'counter', 'Rows returned or affected by SQL')
+        writer.sample('http_request_db_rows_total', metrics.rows, labels)
+        writer.declare('http_n_plus_one_total', 'counter', 'Requests that repeated one statement shape too often')
+        for shape, count in metrics.n_plus_one.items():
+            writer.sample('http_n_plus_one_total', count, {**labels, 'statement': shape[:200]})
+
+    writer.declare('password_hash_in_flight', 'gauge', 'Password hashing operations in progress')
+    writer.sample('password_hash_in_flight', hashing['in_flight'])
+    writer.declare('password_hash_rejected_total', 'counter', 'Hashing requests rejected with 503')
+    writer.sample('password_hash_rejected_total', hashing['rejected'])
+    writer.declare('password_hash_rehashed_total', 'counter', 'Passwords rehashed on login')
+    writer.sample('password_hash_rehashed_total', hashing['rehashed'])
+    writer.histogram('password_hash_queue_wait_seconds', 'Wait for a hashing worker', hashing['queue_wait_seconds'])
+    for operation, snapshot in hashing['hash_seconds'].items():
+        writer.histogram('password_hash_seconds', 'bcrypt time', snapshot, {'operation': operation})
+
+    writer.declare('chat_ws_connections', 'gauge', 'Open chat WebSocket connections')
+    writer.sample('chat_ws_connections', chat['connections'])
+    for key, help_text in (('published', 'Chat events published'), ('delivered', 'Chat events sent to clients'),
+                           ('evicted', 'Slow WebSocket consumers disconnected'),
+                           ('timed_out', 'WebSocket clients that stopped answering heartbeats')):
+        writer.declare(f'chat_ws_{key}_total', 'counter', help_text)
+        writer.sample(f'chat_ws_{key}_total', chat[key])
+
+    pool_entries = [('primary', pools['primary'])] + [(replica['url'], replica) for replica in pools['replicas']]
+    for pool_name, pool in pool_entries:
+        labels = {'pool': pool_name}
+        for key, metric_type in (('size', 'gauge'), ('checked_out', 'gauge'), ('overflow', 'gauge'),
+                                 ('waiters', 'gauge'), ('timeouts', 'counter')):
+            name = f'db_pool_{key}_total' if metric_type == 'counter' else f'db_pool_{key}'
+            writer.declare(name, metric_type, f'Connection pool {key.replace("_", " ")}')
+            writer.sample(name, pool[key], labels)
+        writer.histogram('db_pool_wait_seconds', 'Wait for a pooled connection', pool['wait_seconds'], labels)
+    return writer.render()
+
+
+def metrics_response(hashing: Dict, pools: Dict, chat: Dict) -> PlainTextResponse:
+    return PlainTextResponse(render_metrics(hashing, pools, chat), media_type='text/plain; version=0.0.4')
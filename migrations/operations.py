@@ -0,0 +1,19 @@
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncConnection
+
+# операции для нетранзакционных миграций (TRANSACTIONAL = False): индексы строятся без блокировки записи в таблицу
+
+
+async def create_index_concurrently(connection: AsyncConnection, name: str, definition: str, unique: bool = False):
+    # прерванный CREATE INDEX CONCURRENTLY оставляет индекс INVALID, а IF NOT EXISTS его бы пропустил
+    invalid = await connection.execute(text(
+        'SELECT 1 FROM pg_class c JOIN pg_index i ON i.indexrelid = c.oid WHERE c.relname = :name AND NOT i.indisvalid'
+    ), {'name': name})
+    if invalid.first() is not None:
+        await connection.execute(text(f'DROP INDEX CONCURRENTLY IF EXISTS {name}'))
+    unique_clause = 'UNIQUE ' if unique else ''
+    await connection.execute(text(f'CREATE {unique_clause}INDEX CONCURRENTLY IF NOT EXISTS {name} ON {definition}'))
+
+
+async def drop_index_concurrently(connection: AsyncConnection, name: str):
+    await connection.execute(text(f'DROP INDEX CONCURRENTLY IF EXISTS {name}'))
@@ -0,0 +1,209 @@
+import argparse
+import asyncio
+import importlib
+import logging
+import os
+import re
+from dataclasses import dataclass
+from pathlib import Path
+from types import ModuleType
+from typing import List, Optional
+
+from sqlalchemy import text
+from sqlalchemy.exc import ProgrammingError
+from sqlalchemy.ext.asyncio import AsyncConnection, AsyncEngine, create_async_engine
+from sqlalchemy.pool import NullPool
+
+from database import engine, database_settings
+
+logger = logging.getLogger(__name__)
+
+# миграции - файлы versions/NNNN_name.py с функциями upgrade(connection) и downgrade(connection);
+# TRANSACTIONAL = False для миграций с CREATE INDEX CONCURRENTLY (выполняются в autocommit)
+VERSIONS_DIR = Path(__file__).parent / 'versions'
+VERSION_FILE_PATTERN = re.compile(r'^(\d{4})_(\w+)\.py$')
+ADVISORY_LOCK_KEY = 727100418  # общий для всех воркеров и CLI
+# DDL не должен надолго вставать в очередь за долгими транзакциями и блокировать запросы за собой
+MIGRATION_LOCK_TIMEOUT = os.getenv('MIGRATION_LOCK_TIMEOUT', '10s')
+MIGRATION_LOCK_POLL_SECONDS = float(os.getenv('MIGRATION_LOCK_POLL_SECONDS', '0.5'))
+
+
+@dataclass
+class Migration:
+    version: int
+    name: str
+    module: ModuleType
+
+    @property
+    def transactional(self) -> bool:
+        return getattr(self.module, 'TRANSACTIONAL', True)
+
+
+def load_migrations() -> List[Migration]:
+    migrations = []
+    for path in sorted(VERSIONS_DIR.iterdir()):
+        match = VERSION_FILE_PATTERN.match(path.name)
+        if match:
+            module = importlib.import_module(f'migrations.versions.{path.stem}')
+            migrations.append(Migration(int(match.group(1)), match.group(2), module))
+    versions = [migration.version for migration in migrations]
+    if len(versions) != len(set(versions)):
+        raise RuntimeError('Duplicate migration versions')
+    return migrations
+
+
+def latest_version() -> int:
+    return max((migration.version for migration in load_migrations()), default=0)
+
+
+async def ensure_version_table(connection: AsyncConnection):
+    await connection.execute(text('''
+        CREATE TABLE IF NOT EXISTS schema_version (
+            version integer PRIMARY KEY,
+            name varchar NOT NULL,
+            applied_at timestamp NOT NULL DEFAULT now()
+        )
+    '''))
+
+
+async def read_current_version(connection: AsyncConnection) -> int:
+    version = await connection.execute(text('SELECT coalesce(max(version), 0) FROM schema_version'))
+    return version.scalar_one()
+
+
+# версия схемы без создания таблицы: 0, если миграции еще не применялись
+async def current_version(target_engine: AsyncEngine = engine) -> int:
+    async with target_engine.connect() as connection:
+        try:
+            return await read_current_version(connection)
+        except ProgrammingError:
+            return 0
+
+
+# отдельный движок без пула: соединения миграций (без statement_timeout, с lock_timeout и advisory lock)
+# закрываются после использования и не попадают в пул приложения
+def create_migration_engine() -> AsyncEngine:
+    return create_async_engine(
+        database_settings.url,
+        echo=database_settings.echo,
+        poolclass=NullPool,
+        connect_args={
+            'statement_cache_size': database_settings.statement_cache_size,
+            # statement_timeout приложения не подходит для построения индексов на больших таблицах
+            'server_settings': {'statement_timeout': '0'}
+        }
+    )
+
+
+async def prepare(connection: AsyncConnection, transactional: bool):
+    # в транзакции - SET LOCAL, чтобы настройка не пережила миграцию даже на общем соединении
+    scope = 'LOCAL ' if transactional else ''
+    await connection.execute(text(f'SET {scope}statement_timeout = 0'))
+    await connection.execute(text(f"SET {scope}lock_timeout = '{MIGRATION_LOCK_TIMEOUT}'"))
+
+
+async def apply(target_engine: AsyncEngine, migration: Migration, direction: str):
+    step = getattr(migration.module, direction)
+    if direction == 'upgrade':
+        record = text('INSERT INTO schema_version (version, name) VALUES (:version, :name)')
+    else:
+        record = text('DELETE FROM schema_version WHERE version = :version')
+    parameters = {'version': migration.version, 'name': migration.name}
+
+    logger.info('%s %04d_%s', direction, migration.version, migration.name)
+    if migration.transactional:
+        # изменение схемы и запись о версии фиксируются вместе
+        async with target_engine.begin() as connection:
+            await prepare(connection, transactional=True)
+            await step(connection)
+            await connection.execute(record, parameters)
+    else:
+        # CONCURRENTLY нельзя выполнять в транзакции; такие миграции должны быть идемпотентными,
+        # так как при сбое версия не записывается и миграция выполнится заново
+        async with target_engine.connect() as connection:
+            connection = await connection.execution_options(isolation_level='AUTOCOMMIT')
+            await prepare(connection, transactional=False)
+            try:
+                await step(connection)
+                await connection.execute(record, parameters)
+            finally:
+                # на случай движка с пулом: настройки сессии не должны остаться на соединении
+                await connection.execute(text('RESET statement_timeout'))
+                await connection.execute(text('RESET lock_timeout'))
+
+
+# ожидание advisory lock опросом pg_try_advisory_lock между паузами: ожидающий pg_advisory_lock держит
+# снимок данных, и CREATE INDEX CONCURRENTLY у владельца блокировки ждал бы его до lock_timeout -
+# взаимная блокировка, которую PostgreSQL не видит, так как одно звено цикла находится в клиенте.
+# Проверка: два migrate() одновременно (например, два воркера с MIGRATE_ON_STARTUP=1) при ожидающей
+# миграции с CONCURRENTLY - второй дожидается первого и применять ему нечего
+async def acquire_migration_lock(connection: AsyncConnection):
+    while True:
+        locked = await connection.execute(text('SELECT pg_try_advisory_lock(:key)'), {'key': ADVISORY_LOCK_KEY})
+        if locked.scalar_one():
+            return
+        await asyncio.sleep(MIGRATION_LOCK_POLL_SECONDS)
+
+
+# применение миграций под advisory lock: параллельно стартующие воркеры выполняют их по очереди,
+# а после получения блокировки заново читают версию
+async def migrate(target: Optional[int] = None, downgrade: bool = False,
+                  target_engine: Optional[AsyncEngine] = None) -> List[int]:
+    if target_engine is None:
+        migration_engine = create_migration_engine()
+        try:
+            return await migrate(target, downgrade, migration_engine)
+        finally:
+            await migration_engine.dispose()
+
+    migrations = load_migrations()
+    applied = []
+    async with target_engine.connect() as lock_connection:
+        lock_connection = await lock_connection.execution_options(isolation_level='AUTOCOMMIT')
+        await lock_connection.execute(text('SET statement_timeout = 0'))
+        await acquire_migration_lock(lock_connection)
+        try:
+            await ensure_version_table(lock_connection)
+            version = await read_current_version(lock_connection)
+            if downgrade:
+                target = max(version - 1, 0) if target is None else target
+                steps = [migration for migration in reversed(migrations) if target < migration.version <= version]
+                direction = 'downgrade'
+            else:
+                target = latest_version() if target is None else target
+                steps = [migration for migration in migrations if version < migration.version <= target]
+                direction = 'upgrade'
+            for migration in steps:
+                await apply(target_engine, migration, direction)
+                applied.append(migration.version)
+        finally:
+            await lock_connection.execute(text('SELECT pg_advisory_unlock(:key)'), {'key': ADVISORY_LOCK_KEY})
+            await lock_connection.execute(text('RESET statement_timeout'))
+    return applied
+
+
+async def status() -> List[str]:
+    version = await current_version()
+    return [f"{'applied' if migration.version <= version else 'pending'} {migration.version:04d}_{migration.name}"
+            for migration in load_migrations()]
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+    parser = argparse.ArgumentParser(description='Apply or roll back versioned schema migrations')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    upgrade_parser = subparsers.add_parser('upgrade', help='apply pending migrations')
+    upgrade_parser.add_argument('--to', type=int, help='target version (latest by default)')
+    downgrade_parser = subparsers.add_parser('downgrade', help='roll back migrations')
+    downgrade_parser.add_argument('--to', type=int, help='target version (one step back by default)')
+    subparsers.add_parser('current', help='print the applied schema version')
+    subparsers.add_parser('status', help='list applied and pending migrations')
+    args = parser.parse_args()
+
+    if args.command == 'current':
+        print(asyncio.run(current_version()))
+    elif args.command == 'status':
+        print('\n'.join(asyncio.run(status())))
+    else:
+        versions = asyncio.run(migrate(args.to, downgrade=args.command == 'downgrade'))
+        print(f'{args.command}: {", ".join(f"{version:04d}" for version in versions) or "nothing to do"}')
@@ -0,0 +1,160 @@
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncConnection
+
+# базовая схема - таблицы и индексы исходной версии моделей, зафиксированные явным DDL: история версий
+# воспроизводится одинаково на любой базе и не зависит от текущих моделей. IF NOT EXISTS нужен для баз,
+# созданных до появления миграций через create_all: они принимаются как есть, а недостающее добавляют 0002+
+TRANSACTIONAL = True
+
+# в порядке зависимостей внешних ключей
+BASELINE_TABLES = (
+    ('notification_status', '''
+        notification_status_id serial PRIMARY KEY,
+        notification_status_name varchar
+    '''),
+    ('notification_type', '''
+        notification_type_id serial PRIMARY KEY,
+        notification_type_name varchar
+    '''),
+    ('role', '''
+        role_id serial PRIMARY KEY,
+        role_name varchar NOT NULL
+    '''),
+    ('specialization', '''
+        specialization_id serial PRIMARY KEY,
+        specialization_name varchar NOT NULL
+    '''),
+    ('status', '''
+        status_id serial PRIMARY KEY,
+        status_name varchar NOT NULL
+    '''),
+    ('system_notification', '''
+        notification_id serial PRIMARY KEY,
+        notification_status_id integer REFERENCES notification_status (notification_status_id),
+        notification_type_id integer REFERENCES notification_type (notification_type_id),
+        notification_title varchar,
+        notification_text varchar,
+        notification_date_time timestamp NOT NULL
+    '''),
+    ('user_profile', '''
+        user_id serial PRIMARY KEY,
+        role_id integer REFERENCES role (role_id),
+        username varchar NOT NULL,
+        email varchar NOT NULL,
+        phone_number varchar NOT NULL,
+        password_hashed varchar NOT NULL,
+        first_name varchar,
+        second_name varchar,
+        date_birth date NOT NULL,
+        date_registration timestamp NOT NULL,
+        is_deleted boolean NOT NULL,
+        user_description varchar,
+        tarot_experience float,
+        tarot_rating float,
+        review_count integer
+    '''),
+    ('contacts', '''
+        contact_id serial PRIMARY KEY,
+        user_id integer REFERENCES user_profile (user_id),
+        user_contact_id integer REFERENCES user_profile (user_id),
+        CONSTRAINT _user_contact_uc UNIQUE (user_id, user_contact_id)
+    '''),
+    ('feedback', '''
+        feedback_id serial PRIMARY KEY,
+        user_id integer REFERENCES user_profile (user_id),
+        feedback_text varchar,
+        feedback_datetime timestamp NOT NULL,
+        is_read boolean
+    '''),
+    ('message', '''
+        message_id serial PRIMARY KEY,
+        sender_id integer REFERENCES user_profile (user_id),
+        recipient_id integer REFERENCES user_profile (user_id),
+        message_text varchar,
+        message_date_send timestamp NOT NULL
+    '''),
+    ('service', '''
+        service_id serial PRIMARY KEY,
+        tarot_id integer REFERENCES user_profile (user_id),
+        service_name varchar NOT NULL,
+        service_description varchar,
+        specialization_id integer REFERENCES specialization (specialization_id) ON DELETE CASCADE,
+        service_price integer NOT NULL
+    '''),
+    ('tarot_specialization', '''
+        tarot_specialization_id serial PRIMARY KEY,
+        specialization_id integer REFERENCES specialization (specialization_id),
+        tarot_id integer REFERENCES user_profile (user_id)
+    '''),
+    ('user_favorite_tarots', '''
+        favorite_tarot_id serial PRIMARY KEY,
+        user_id integer REFERENCES user_profile (user_id),
+        tarot_id integer REFERENCES user_profile (user_id),
+        CONSTRAINT user_favorite_tarots_uc UNIQUE (user_id, tarot_id)
+    '''),
+    ('user_system_notification', '''
+        user_notification_id serial PRIMARY KEY,
+        user_id integer REFERENCES user_profile (user_id),
+        notification_id integer REFERENCES system_notification (notification_id),
+        CONSTRAINT _user_notification_uc UNIQUE (user_id, notification_id)
+    '''),
+    ('user_service_history', '''
+        history_id serial PRIMARY KEY,
+        user_id integer REFERENCES user_profile (user_id),
+        service_id integer REFERENCES service (service_id),
+        tarot_id integer NOT NULL,
+        status_id integer REFERENCES status (status_id) ON DELETE CASCADE,
+        review_title varchar,
+        review_text varchar,
+        review_value integer,
+        review_date_time timestamp
+    '''),
+)
+
+# (имя, определение, уникальный)
+BASELINE_INDEXES = (
+    ('ix_notification_status_notification_status_id', 'notification_status (notification_status_id)', False),
+    ('ix_notification_status_notification_status_name', 'notification_status (notification_status_name)', False),
+    ('ix_notification_type_notification_type_id', 'notification_type (notification_type_id)', False),
+    ('ix_notification_type_notification_type_name', 'notification_type (notification_type_name)', False),
+    ('ix_role_role_id', 'role (role_id)', False),
+    ('ix_role_role_name', 'role (role_name)', True),
+    ('ix_specialization_specialization_id', 'specialization (specialization_id)', False),
+    ('ix_specialization_specialization_name', 'specialization (specialization_name)', True),
+    ('ix_status_status_id', 'status (status_id)', False),
+    ('ix_status_status_name', 'status (status_name)', True),
+    ('ix_system_notification_notification_id', 'system_notification (notification_id)', False),
+    ('ix_system_notification_notification_text', 'system_notification (notification_text)', False),
+    ('ix_system_notification_notification_title', 'system_notification (notification_title)', False),
+    ('ix_user_profile_email', 'user_profile (email)', True),
+    ('ix_user_profile_phone_number', 'user_profile (phone_number)', True),
+    ('ix_user_profile_user_id', 'user_profile (user_id)', False),
+    ('ix_user_profile_username', 'user_profile (username)', True),
+    ('ix_contacts_contact_id', 'contacts (contact_id)', False),
+    ('ix_feedback_feedback_id', 'feedback (feedback_id)', False),
+    ('ix_feedback_feedback_text', 'feedback (feedback_text)', False),
+    ('ix_message_message_id', 'message (message_id)', False),
+    ('ix_message_message_text', 'message (message_text)', False),
+    ('ix_service_service_id', 'service (service_id)', False),
+    ('ix_service_service_name', 'service (service_name)', True),
+    ('ix_tarot_specialization_tarot_specialization_id', 'tarot_specialization (tarot_specialization_id)', False),
+    ('ix_user_favorite_tarots_favorite_tarot_id', 'user_favorite_tarots (favorite_tarot_id)', False),
+    ('ix_user_system_notification_user_notification_id',
+     'user_system_notification (user_notification_id)', False),
+    ('ix_user_service_history_history_id', 'user_service_history (history_id)', False),
+    ('ix_user_service_history_tarot_id', 'user_service_history (tarot_id)', False),
+)
+
+
+async def upgrade(connection: AsyncConnection):
+    for name, columns in BASELINE_TABLES:
+        await connection.execute(text(f'CREATE TABLE IF NOT EXISTS {name} ({columns})'))
+    for name, definition, unique in BASELINE_INDEXES:
+        unique_clause = 'UNIQUE ' if unique else ''
+        await connection.execute(text(f'CREATE {unique_clause}INDEX IF NOT EXISTS {name} ON {definition}'))
+
+
+async def downgrade(connection: AsyncConnection):
+    # таблицы следующих версий удаляются их собственными downgrade
+    for name, _ in reversed(BASELINE_TABLES):
+        await connection.execute(text(f'DROP TABLE IF EXISTS {name}'))
@@ -0,0 +1,59 @@
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncConnection
+
+# изменения моделей после базовой схемы: сумма оценок таролога, аудитория уведомлений,
+# сводки переписок и отметки прочтения уведомлений
+TRANSACTIONAL = True
+
+
+async def upgrade(connection: AsyncConnection):
+    await connection.execute(text('''
+        CREATE TABLE IF NOT EXISTS conversation_summary (
+            user_id integer REFERENCES user_profile (user_id),
+            companion_id integer REFERENCES user_profile (user_id),
+            last_message_id integer REFERENCES message (message_id) ON DELETE SET NULL,
+            last_message_preview varchar NOT NULL,
+            last_message_date timestamp NOT NULL,
+            last_sender_id integer NOT NULL,
+            PRIMARY KEY (user_id, companion_id)
+        )
+    '''))
+    await connection.execute(text('''
+        CREATE TABLE IF NOT EXISTS user_notification_state (
+            user_id integer PRIMARY KEY REFERENCES user_profile (user_id),
+            read_watermark integer NOT NULL DEFAULT 0
+        )
+    '''))
+    await connection.execute(text(
+        'ALTER TABLE user_profile ADD COLUMN IF NOT EXISTS rating_sum integer NOT NULL DEFAULT 0'))
+    # сумма, количество отзывов и рейтинг пересчитываются вместе по истории отзывов тем же запросом, что
+    # user_service_history.reconcile --fix: прежний review_count мог разойтись из-за гонок; повторный запуск
+    # исправляет только разошедшиеся строки
+    await connection.execute(text('''
+        UPDATE user_profile p
+        SET rating_sum = d.actual_rating_sum,
+            review_count = d.actual_review_count,
+            tarot_rating = CAST(d.actual_rating_sum AS double precision) / NULLIF(d.actual_review_count, 0)
+        FROM (SELECT u.user_id,
+                     coalesce(h.rating_sum, 0) AS actual_rating_sum,
+                     coalesce(h.review_count, 0) AS actual_review_count
+              FROM user_profile u
+              LEFT OUTER JOIN (SELECT tarot_id, sum(review_value) AS rating_sum, count(*) AS review_count
+                               FROM user_service_history
+                               WHERE review_value != 0
+                               GROUP BY tarot_id) AS h ON h.tarot_id = u.user_id
+              WHERE u.rating_sum IS DISTINCT FROM coalesce(h.rating_sum, 0)
+                 OR coalesce(u.review_count, 0) != coalesce(h.review_count, 0)) AS d
+        WHERE p.user_id = d.user_id
+    '''))
+    await connection.execute(text(
+        "ALTER TABLE system_notification ADD COLUMN IF NOT EXISTS audience_type varchar NOT NULL DEFAULT 'targeted'"))
+    await connection.execute(text('ALTER TABLE system_notification ADD COLUMN IF NOT EXISTS audience_id integer'))
+
+
+async def downgrade(connection: AsyncConnection):
+    await connection.execute(text('ALTER TABLE system_notification DROP COLUMN IF EXISTS audience_id'))
+    await connection.execute(text('ALTER TABLE system_notification DROP COLUMN IF EXISTS audience_type'))
+    await connection.execute(text('ALTER TABLE user_profile DROP COLUMN IF EXISTS rating_sum'))
+    await connection.execute(text('DROP TABLE IF EXISTS user_notification_state'))
+    await connection.execute(text('DROP TABLE IF EXISTS conversation_summary'))
@@ -0,0 +1,29 @@
+from sqlalchemy.ext.asyncio import AsyncConnection
+
+from migrations.operations import create_index_concurrently, drop_index_concurrently
+
+# индексы под каталог, переписку, уведомления и услуги для баз, созданных до их появления в моделях
+TRANSACTIONAL = False
+
+INDEXES = (
+    ('ix_user_profile_role_rating',
+     'user_profile (role_id, coalesce(tarot_rating, 0), user_id) WHERE is_deleted = false'),
+    ('ix_user_profile_role_reviews',
+     'user_profile (role_id, coalesce(review_count, 0), user_id) WHERE is_deleted = false'),
+    ('ix_message_conversation', 'message (sender_id, recipient_id, message_date_send, message_id)'),
+    ('ix_conversation_summary_user_date', 'conversation_summary (user_id, last_message_date)'),
+    ('ix_system_notification_audience', 'system_notification (audience_type, audience_id, notification_id)'),
+    ('ix_service_tarot_price', 'service (tarot_id, service_price)'),
+    ('ix_tarot_specialization_spec_tarot', 'tarot_specialization (specialization_id, tarot_id)'),
+    ('ix_tarot_specialization_tarot_spec', 'tarot_specialization (tarot_id, specialization_id)'),
+)
+
+
+async def upgrade(connection: AsyncConnection):
+    for name, definition in INDEXES:
+        await create_index_concurrently(connection, name, definition)
+
+
+async def downgrade(connection: AsyncConnection):
+    for name, _ in reversed(INDEXES):
+        await drop_index_concurrently(connection, name)
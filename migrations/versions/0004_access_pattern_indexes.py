@@ -0,0 +1,62 @@
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncConnection
+
+from migrations.operations import create_index_concurrently, drop_index_concurrently
+
+# индексы под запросы роутеров: составные и частичные вместо одиночных,
+# удаление дублей индексов первичных ключей (index=True) и btree-индексов по свободному тексту
+TRANSACTIONAL = False
+
+NEW_INDEXES = (
+    ('ix_user_service_history_user_id', 'user_service_history (user_id)', False),
+    ('ix_user_service_history_tarot_review', 'user_service_history (tarot_id, review_value)', False),
+    ('ix_feedback_user_id', 'feedback (user_id, feedback_id)', False),
+    ('ix_feedback_unread_date', 'feedback (feedback_datetime) WHERE is_read = false', False),
+    ('uq_tarot_specialization_spec_tarot', 'tarot_specialization (specialization_id, tarot_id)', True),
+)
+
+# индексы, которые заменены новыми или не нужны ни одному запросу (для downgrade - их определения)
+OBSOLETE_INDEXES = (
+    ('ix_tarot_specialization_spec_tarot', 'tarot_specialization (specialization_id, tarot_id)'),
+    ('ix_user_service_history_tarot_id', 'user_service_history (tarot_id)'),
+    ('ix_feedback_feedback_text', 'feedback (feedback_text)'),
+    ('ix_system_notification_notification_title', 'system_notification (notification_title)'),
+    ('ix_system_notification_notification_text', 'system_notification (notification_text)'),
+    ('ix_user_profile_user_id', 'user_profile (user_id)'),
+    ('ix_role_role_id', 'role (role_id)'),
+    ('ix_status_status_id', 'status (status_id)'),
+    ('ix_specialization_specialization_id', 'specialization (specialization_id)'),
+    ('ix_tarot_specialization_tarot_specialization_id', 'tarot_specialization (tarot_specialization_id)'),
+    ('ix_service_service_id', 'service (service_id)'),
+    ('ix_message_message_id', 'message (message_id)'),
+    ('ix_contacts_contact_id', 'contacts (contact_id)'),
+    ('ix_user_favorite_tarots_favorite_tarot_id', 'user_favorite_tarots (favorite_tarot_id)'),
+    ('ix_user_service_history_history_id', 'user_service_history (history_id)'),
+    ('ix_feedback_feedback_id', 'feedback (feedback_id)'),
+    ('ix_notification_status_notification_status_id', 'notification_status (notification_status_id)'),
+    ('ix_notification_type_notification_type_id', 'notification_type (notification_type_id)'),
+    ('ix_system_notification_notification_id', 'system_notification (notification_id)'),
+    ('ix_user_system_notification_user_notification_id', 'user_system_notification (user_notification_id)'),
+)
+
+
+async def upgrade(connection: AsyncConnection):
+    # перед уникальным индексом удаляем повторные связи таролог - специализация, оставляя самую раннюю
+    await connection.execute(text('''
+        DELETE FROM tarot_specialization t
+        USING tarot_specialization d
+        WHERE t.specialization_id = d.specialization_id
+          AND t.tarot_id = d.tarot_id
+          AND t.tarot_specialization_id > d.tarot_specialization_id
+    '''))
+    for name, definition, unique in NEW_INDEXES:
+        await create_index_concurrently(connection, name, definition, unique=unique)
+    for name, _ in OBSOLETE_INDEXES:
+        await drop_index_concurrently(connection, name)
+
+
+async def downgrade(connection: AsyncConnection):
+    for name, definition in OBSOLETE_INDEXES:
+        await create_index_concurrently(connection, name, definition)
+    for name, _, _ in reversed(NEW_INDEXES):
+        await drop_index_concurrently(connection, name)
@@ -0,0 +1,19 @@
+from sqlalchemy.ext.asyncio import AsyncConnection
+
+from migrations.operations import create_index_concurrently, drop_index_concurrently
+
+# полнотекстовый GIN-индекс по сообщениям вместо btree по message_text, который не помогал поиску "содержит",
+# замедлял вставку и не принимал длинные сообщения
+TRANSACTIONAL = False
+
+
+async def upgrade(connection: AsyncConnection):
+    await create_index_concurrently(
+        connection, 'ix_message_text_search',
+        "message USING gin (to_tsvector('russian'::regconfig, coalesce(message_text, '')))")
+    await drop_index_concurrently(connection, 'ix_message_message_text')
+
+
+async def downgrade(connection: AsyncConnection):
+    await create_index_concurrently(connection, 'ix_message_message_text', 'message (message_text)')
+    await drop_index_concurrently(connection, 'ix_message_text_search')
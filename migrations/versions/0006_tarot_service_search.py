@@ -0,0 +1,31 @@
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncConnection
+
+from migrations.operations import create_index_concurrently, drop_index_concurrently
+
+# триграммные и полнотекстовые индексы для /search по тарологам и услугам
+TRANSACTIONAL = False
+
+INDEXES = (
+    ('ix_user_profile_name_trgm',
+     "user_profile USING gin ((coalesce(username, '') || ' ' || coalesce(first_name, '') || ' ' || "
+     "coalesce(second_name, '')) gin_trgm_ops) WHERE is_deleted = false"),
+    ('ix_user_profile_description_search',
+     "user_profile USING gin (to_tsvector('russian'::regconfig, coalesce(user_description, ''))) "
+     "WHERE is_deleted = false"),
+    ('ix_service_name_trgm', "service USING gin (coalesce(service_name, '') gin_trgm_ops)"),
+    ('ix_service_text_search',
+     "service USING gin (to_tsvector('russian'::regconfig, "
+     "coalesce(service_name, '') || ' ' || coalesce(service_description, '')))"),
+)
+
+
+async def upgrade(connection: AsyncConnection):
+    await connection.execute(text('CREATE EXTENSION IF NOT EXISTS pg_trgm'))
+    for name, definition in INDEXES:
+        await create_index_concurrently(connection, name, definition)
+
+
+async def downgrade(connection: AsyncConnection):
+    for name, _ in reversed(INDEXES):
+        await drop_index_concurrently(connection, name)
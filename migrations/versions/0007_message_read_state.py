@@ -0,0 +1,30 @@
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncConnection
+
+# отметки прочтения и счетчики непрочитанных в сводках переписок, общий счетчик пользователя
+TRANSACTIONAL = True
+
+
+async def upgrade(connection: AsyncConnection):
+    await connection.execute(text(
+        'ALTER TABLE conversation_summary ADD COLUMN IF NOT EXISTS last_read_message_id integer NOT NULL DEFAULT 0'))
+    await connection.execute(text(
+        'ALTER TABLE conversation_summary ADD COLUMN IF NOT EXISTS unread_count integer NOT NULL DEFAULT 0'))
+    # состояния прочтения раньше не было: существующая переписка считается прочитанной
+    await connection.execute(text('''
+        UPDATE conversation_summary
+        SET last_read_message_id = last_message_id
+        WHERE last_read_message_id = 0 AND last_message_id IS NOT NULL
+    '''))
+    await connection.execute(text('''
+        CREATE TABLE IF NOT EXISTS user_message_state (
+            user_id integer PRIMARY KEY REFERENCES user_profile (user_id),
+            unread_count integer NOT NULL DEFAULT 0
+        )
+    '''))
+
+
+async def downgrade(connection: AsyncConnection):
+    await connection.execute(text('DROP TABLE IF EXISTS user_message_state'))
+    await connection.execute(text('ALTER TABLE conversation_summary DROP COLUMN IF EXISTS unread_count'))
+    await connection.execute(text('ALTER TABLE conversation_summary DROP COLUMN IF EXISTS last_read_message_id'))
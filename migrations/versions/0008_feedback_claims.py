@@ -0,0 +1,25 @@
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncConnection
+
+from migrations.operations import create_index_concurrently, drop_index_concurrently
+
+# аренда элементов очереди обратной связи и индекс очереди с однозначным порядком
+TRANSACTIONAL = False
+
+
+async def upgrade(connection: AsyncConnection):
+    # колонки без значения по умолчанию добавляются без перезаписи таблицы
+    await connection.execute(text(
+        'ALTER TABLE feedback ADD COLUMN IF NOT EXISTS claimed_by integer REFERENCES user_profile (user_id)'))
+    await connection.execute(text('ALTER TABLE feedback ADD COLUMN IF NOT EXISTS claim_expires_at timestamp'))
+    await create_index_concurrently(connection, 'ix_feedback_unread_queue',
+                                    'feedback (feedback_datetime, feedback_id) WHERE is_read = false')
+    await drop_index_concurrently(connection, 'ix_feedback_unread_date')
+
+
+async def downgrade(connection: AsyncConnection):
+    await create_index_concurrently(connection, 'ix_feedback_unread_date',
+                                    'feedback (feedback_datetime) WHERE is_read = false')
+    await drop_index_concurrently(connection, 'ix_feedback_unread_queue')
+    await connection.execute(text('ALTER TABLE feedback DROP COLUMN IF EXISTS claim_expires_at'))
+    await connection.execute(text('ALTER TABLE feedback DROP COLUMN IF EXISTS claimed_by'))
@@ -0,0 +1,35 @@
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncConnection
+
+# прочтение адресных уведомлений в их строках и сохраненный счетчик непрочитанных пользователя
+TRANSACTIONAL = True
+
+
+async def upgrade(connection: AsyncConnection):
+    await connection.execute(text(
+        'ALTER TABLE user_system_notification ADD COLUMN IF NOT EXISTS is_read boolean NOT NULL DEFAULT false'))
+    await connection.execute(text(
+        'ALTER TABLE user_notification_state ADD COLUMN IF NOT EXISTS unread_count integer NOT NULL DEFAULT 0'))
+    # прежняя отметка прочтения по id переносится на адресные строки
+    await connection.execute(text('''
+        UPDATE user_system_notification n
+        SET is_read = true
+        FROM user_notification_state s
+        WHERE s.user_id = n.user_id AND n.notification_id <= s.read_watermark AND NOT n.is_read
+    '''))
+    # пользователи без состояния получают его как при регистрации: прежние рассылки прочитаны
+    await connection.execute(text('''
+        INSERT INTO user_notification_state (user_id, read_watermark)
+        SELECT user_id, (SELECT coalesce(max(notification_id), 0) FROM system_notification)
+        FROM user_profile
+        ON CONFLICT (user_id) DO NOTHING
+    '''))
+    await connection.execute(text('''
+        UPDATE user_notification_state s
+        SET unread_count = (SELECT count(*) FROM user_system_notification n WHERE n.user_id = s.user_id AND NOT n.is_read)
+    '''))
+
+
+async def downgrade(connection: AsyncConnection):
+    await connection.execute(text('ALTER TABLE user_notification_state DROP COLUMN IF EXISTS unread_count'))
+    await connection.execute(text('ALTER TABLE user_system_notification DROP COLUMN IF EXISTS is_read'))
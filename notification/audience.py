@@ -0,0 +1,139 @@
+from dataclasses import dataclass, field
+from typing import List, Optional
+
+from fastapi import HTTPException
+from sqlalchemy import select, union, and_, or_, func, literal
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from database import async_session_maker
+from notification.models import SystemNotification, UserSystemNotification, UserNotificationState
+from specialization.models import TarotSpecialization
+from user.models import UserProfile
+
+
+# данные пользователя, по которым определяется, какие рассылки ему адресованы
+@dataclass
+class UserAudience:
+    user_id: int
+    role_id: Optional[int]
+    specialization_ids: List[int] = field(default_factory=list)
+
+
+async def read_user_audience(user_id: int, session: AsyncSession) -> UserAudience:
+    role_query = await session.execute(select(UserProfile.role_id).filter(UserProfile.user_id == user_id))
+    role_row = role_query.first()
+    if role_row is None:
+        raise HTTPException(status_code=404, detail="User not found")
+    specialization_query = await session.execute(select(TarotSpecialization.specialization_id).filter(
+        TarotSpecialization.tarot_id == user_id))
+    return UserAudience(user_id=user_id, role_id=role_row.role_id,
+                        specialization_ids=list(specialization_query.scalars().all()))
+
+
+# условие на рассылки (all / role / specialization), которые видит пользователь
+def broadcast_filter(audience: UserAudience):
+    conditions = [SystemNotification.audience_type == 'all']
+    if audience.role_id is not None:
+        conditions.append(and_(SystemNotification.audience_type == 'role',
+                               SystemNotification.audience_id == audience.role_id))
+    if audience.specialization_ids:
+        conditions.append(and_(SystemNotification.audience_type == 'specialization',
+                               SystemNotification.audience_id.in_(audience.specialization_ids)))
+    return or_(*conditions)
+
+
+# проверка, адресована ли рассылка пользователю (без запроса в базу)
+def broadcast_matches(notification: SystemNotification, audience: UserAudience) -> bool:
+    if notification.audience_type == 'all':
+        return True
+    if notification.audience_type == 'role':
+        return notification.audience_id == audience.role_id
+    if notification.audience_type == 'specialization':
+        return notification.audience_id in audience.specialization_ids
+    return False
+
+
+# id уведомлений пользователя: адресные строки и подходящие рассылки, каждая ветка идет по своему индексу
+def visible_notification_ids(audience: UserAudience, before_id: Optional[int] = None,
+                             after_id: Optional[int] = None, limit: Optional[int] = None):
+    targeted = select(UserSystemNotification.notification_id.label('notification_id')).filter(
+        UserSystemNotification.user_id == audience.user_id)
+    broadcasts = select(SystemNotification.notification_id.label('notification_id')).filter(
+        broadcast_filter(audience))
+    if before_id is not None:
+        targeted = targeted.filter(UserSystemNotification.notification_id < before_id)
+        broadcasts = broadcasts.filter(SystemNotification.notification_id < before_id)
+    if after_id is not None:
+        targeted = targeted.filter(UserSystemNotification.notification_id > after_id)
+        broadcasts = broadcasts.filter(SystemNotification.notification_id > after_id)
+    if limit is not None:
+        targeted = targeted.order_by(UserSystemNotification.notification_id.desc()).limit(limit)
+        broadcasts = broadcasts.order_by(SystemNotification.notification_id.desc()).limit(limit)
+    return union(select(targeted.subquery()), select(broadcasts.subquery())).subquery()
+
+
+# уведомление для связей с пользователями: рассылка видна по правилу аудитории, и связь учла бы ее
+# в непрочитанных второй раз
+async def read_targeted_notification(notification_id: int, session: AsyncSession) -> SystemNotification:
+    notification_query = await session.execute(select(SystemNotification).filter(
+        SystemNotification.notification_id == notification_id))
+    notification = notification_query.scalars().first()
+    if notification is None:
+        raise HTTPException(status_code=404, detail="Notification not found")
+    if notification.audience_type != 'targeted':
+        raise HTTPException(status_code=400, detail="Broadcast notifications cannot be bonded to users")
+    return notification
+
+
+def latest_notification_id():
+    return select(func.coalesce(func.max(SystemNotification.notification_id), 0)).scalar_subquery()
+
+
+# состояние уведомлений при регистрации (или первом чтении): отметка прочтения ставится на последнее уведомление,
+# поэтому прежние рассылки новому пользователю непрочитанными не считаются; без commit
+async def init_notification_state(user_id: int, session: AsyncSession):
+    unread_targeted = select(func.count()).select_from(UserSystemNotification).filter(
+        UserSystemNotification.user_id == user_id, UserSystemNotification.is_read.is_(False)).scalar_subquery()
+    await session.execute(
+        insert(UserNotificationState)
+        .values(user_id=user_id, read_watermark=latest_notification_id(), unread_count=unread_targeted)
+        .on_conflict_do_nothing(index_elements=[UserNotificationState.user_id])
+    )
+
+
+# отметка прочтения и счетчик непрочитанных адресных уведомлений; состояние пользователя, созданного
+# в обход регистрации, создается в основной базе при первом чтении
+async def read_notification_state(user_id: int, session: AsyncSession):
+    state_query = select(UserNotificationState.read_watermark, UserNotificationState.unread_count).filter(
+        UserNotificationState.user_id == user_id)
+    state = (await session.execute(state_query)).first()
+    if state is None:
+        async with async_session_maker() as primary_session:
+            await init_notification_state(user_id, primary_session)
+            await primary_session.commit()
+            state = (await primary_session.execute(state_query)).one()
+    return state
+
+
+# вставка связей адресного уведомления вместе с увеличением счетчиков непрочитанного получателей одним запросом;
+# bond_insert - INSERT ... ON CONFLICT DO NOTHING в user_system_notification, запрос возвращает число новых связей
+def bond_with_unread_counters(bond_insert):
+    bonded = bond_insert.returning(UserSystemNotification.user_id).cte('bonded')
+    counters_insert = insert(UserNotificationState).from_select(
+        ['user_id', 'read_watermark', 'unread_count'],
+        select(bonded.c.user_id, latest_notification_id(), literal(1))
+    )
+    counters = counters_insert.on_conflict_do_update(
+        index_elements=[UserNotificationState.user_id],
+        set_={'unread_count': UserNotificationState.unread_count + 1}
+    ).returning(UserNotificationState.user_id).cte('counters')
+    return select(func.count()).select_from(bonded).add_cte(counters)
+
+
+# непрочитанные: сохраненный счетчик адресных уведомлений и рассылки новее отметки прочтения;
+# рассылки не создают строк на пользователя и считаются по индексу аудитории только после отметки
+async def count_unread(audience: UserAudience, state, session: AsyncSession) -> int:
+    broadcasts_query = await session.execute(select(func.count()).select_from(SystemNotification).filter(
+        broadcast_filter(audience), SystemNotification.notification_id > state.read_watermark))
+    return state.unread_count + broadcasts_query.scalar_one()
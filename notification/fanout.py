@@ -0,0 +1,111 @@
+import logging
+import os
+import uuid
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Optional
+
+from sqlalchemy import select, func, literal, true
+from sqlalchemy.dialects.postgresql import insert
+
+from database import async_session_maker
+from notification.audience import bond_with_unread_counters
+from notification.models import SystemNotification, UserSystemNotification
+from notification.stream import notification_stream
+from user.models import UserProfile
+
+logger = logging.getLogger(__name__)
+
+FANOUT_CHUNK_SIZE = int(os.getenv('NOTIFICATION_FANOUT_CHUNK_SIZE', '5000'))  # пользователей на одну вставку
+FANOUT_JOBS_KEPT = 100  # сколько последних задач хранится для опроса прогресса
+
+
+# состояние фоновой рассылки уведомления пользователям роли
+@dataclass
+class FanoutJob:
+    notification_id: int
+    role_id: int
+    job_id: str = field(default_factory=lambda: uuid.uuid4().hex)
+    status: str = 'pending'  # pending | running | done | failed
+    total_users: int = 0
+    processed_users: int = 0
+    inserted: int = 0
+    error: Optional[str] = None
+    created_at: datetime = field(default_factory=datetime.utcnow)
+    finished_at: Optional[datetime] = None
+
+
+# задачи рассылки текущего процесса (в порядке создания)
+fanout_jobs: 'OrderedDict[str, FanoutJob]' = OrderedDict()
+
+
+def register_fanout_job(notification_id: int, role_id: int) -> FanoutJob:
+    job = FanoutJob(notification_id=notification_id, role_id=role_id)
+    fanout_jobs[job.job_id] = job
+    while len(fanout_jobs) > FANOUT_JOBS_KEPT:
+        fanout_jobs.popitem(last=False)
+    return job
+
+
+# role_id == 0 означает всех пользователей
+def fanout_audience(role_id: int):
+    return true() if role_id == 0 else UserProfile.role_id == role_id
+
+
+# рассылка выполняется в базе порциями INSERT ... SELECT ... ON CONFLICT DO NOTHING по диапазонам user_id
+async def run_fanout_job(job: FanoutJob, chunk_size: int = FANOUT_CHUNK_SIZE):
+    job.status = 'running'
+    audience = fanout_audience(job.role_id)
+    try:
+        async with async_session_maker() as session:
+            total_query = await session.execute(select(func.count()).select_from(UserProfile).filter(audience))
+            job.total_users = total_query.scalar_one()
+            notification_query = await session.execute(select(SystemNotification).filter(
+                SystemNotification.notification_id == job.notification_id))
+            notification = notification_query.scalars().one()
+            if notification.audience_type != 'targeted':
+                raise ValueError('Broadcast notifications cannot be fanned out to users')
+
+        last_user_id = 0
+        while True:
+            async with async_session_maker() as session:
+                chunk = (
+                    select(UserProfile.user_id)
+                    .filter(audience, UserProfile.user_id > last_user_id)
+                    .order_by(UserProfile.user_id)
+                    .limit(chunk_size)
+                    .subquery()
+                )
+                chunk_bounds_query = await session.execute(
+                    select(func.max(chunk.c.user_id), func.count()).select_from(chunk))
+                upper_user_id, chunk_users = chunk_bounds_query.one()
+                if not chunk_users:
+                    break
+
+                chunk_insert = insert(UserSystemNotification).from_select(
+                    ['user_id', 'notification_id'],
+                    select(UserProfile.user_id, literal(job.notification_id)).filter(
+                        audience,
+                        UserProfile.user_id > last_user_id,
+                        UserProfile.user_id <= upper_user_id
+                    )
+                ).on_conflict_do_nothing(constraint='_user_notification_uc')
+                chunk_result = await session.execute(bond_with_unread_counters(chunk_insert))
+                chunk_inserted = chunk_result.scalar_one()
+                await session.commit()
+
+            job.inserted += chunk_inserted
+            job.processed_users += chunk_users
+            # открытые потоки получателей порции получают уведомление сразу после ее commit
+            notification_stream.publish(notification, lambda subscriber: (
+                last_user_id < subscriber.user_id <= upper_user_id
+                and (job.role_id == 0 or subscriber.role_id == job.role_id)))
+            last_user_id = upper_user_id
+        job.status = 'done'
+    except Exception as e:
+        logger.exception('Notification fan-out job %s failed', job.job_id)
+        job.status = 'failed'
+        job.error = str(e)
+    finally:
+        job.finished_at = datetime.utcnow()
@@ -1,34 +1,52 @@
-from sqlalchemy import Column, Integer, String, ForeignKey, DateTime, func, UniqueConstraint
+from sqlalchemy import Column, Integer, String, ForeignKey, DateTime, Boolean, func, UniqueConstraint, Index
 from database import Base
 
 
 class NotificationStatus(Base):
     __tablename__ = 'notification_status'
-    notification_status_id = Column(Integer, primary_key=True, index=True)
+    notification_status_id = Column(Integer, primary_key=True)
     notification_status_name = Column(String, index=True)
 
 
 class NotificationType(Base):
     __tablename__ = "notification_type"
-    notification_type_id = Column(Integer, primary_key=True, index=True)
+    notification_type_id = Column(Integer, primary_key=True)
     notification_type_name = Column(String, index=True)
 
 
 class SystemNotification(Base):
     __tablename__ = 'system_notification'
-    notification_id = Column(Integer, primary_key=True, index=True)
+    notification_id = Column(Integer, primary_key=True)
     notification_status_id = Column(Integer, ForeignKey('notification_status.notification_status_id'))
     notification_type_id = Column(Integer, ForeignKey('notification_type.notification_type_id'))
-    notification_title = Column(String, index=True)
-    notification_text = Column(String, index=True)
+    notification_title = Column(String)
+    notification_text = Column(String)
     notification_date_time = Column(DateTime, nullable=False, default=func.now())
+    # правило аудитории: targeted - по строкам user_system_notification, all / role / specialization - рассылка,
+    # которая определяется при чтении и не создает строк на каждого пользователя
+    audience_type = Column(String, nullable=False, default='targeted', server_default='targeted')
+    audience_id = Column(Integer, nullable=True)  # role_id или specialization_id для рассылки
+    __table_args__ = (
+        Index('ix_system_notification_audience', 'audience_type', 'audience_id', 'notification_id'),
+    )
 
 
 class UserSystemNotification(Base):
     __tablename__ = 'user_system_notification'
-    user_notification_id = Column(Integer, primary_key=True, index=True)
+    user_notification_id = Column(Integer, primary_key=True)
     user_id = Column(Integer, ForeignKey('user_profile.user_id'))
     notification_id = Column(Integer, ForeignKey('system_notification.notification_id'))
+    # прочтение адресного уведомления хранится в его строке: связь может появиться позже более новых уведомлений
+    is_read = Column(Boolean, nullable=False, default=False, server_default='false')
     __table_args__ = (
         UniqueConstraint('user_id', 'notification_id', name='_user_notification_uc'),
-    )
\ No newline at end of file
+    )
+
+
+# состояние уведомлений пользователя: рассылки с notification_id <= read_watermark прочитаны,
+# unread_count - сохраненный счетчик непрочитанных адресных уведомлений
+class UserNotificationState(Base):
+    __tablename__ = 'user_notification_state'
+    user_id = Column(Integer, ForeignKey('user_profile.user_id'), primary_key=True)
+    read_watermark = Column(Integer, nullable=False, default=0, server_default='0')
+    unread_count = Column(Integer, nullable=False, default=0, server_default='0')
@@ -1,13 +1,23 @@
-from typing import List, Dict
+from typing import List, Dict, Optional
 
-from fastapi import APIRouter, Depends, HTTPException
-from sqlalchemy import select
+from fastapi import APIRouter, Depends, HTTPException, BackgroundTasks, Query, Header
+from fastapi.responses import StreamingResponse
+from sqlalchemy import select, func, update, and_
+from sqlalchemy.dialects.postgresql import insert
 
 from user.models import UserProfile
-from notification.models import NotificationStatus, NotificationType, SystemNotification, UserSystemNotification
+from notification.models import (NotificationStatus, NotificationType, SystemNotification, UserSystemNotification,
+                                 UserNotificationState)
 from notification.schemas import (NotificationStatusCreate, NotificationTypeCreate, NotificationTypeOut, NotificationStatusOut,
-NotificationByUserOut, SystemNotificationOut, SystemNotificationCreate)
-from database import get_session
+NotificationByUserOut, SystemNotificationOut, SystemNotificationCreate, FanoutJobOut, NotificationPage,
+NotificationUnreadOut)
+from notification.fanout import fanout_jobs, register_fanout_job, run_fanout_job, fanout_audience
+from notification.audience import (read_user_audience, visible_notification_ids, count_unread, init_notification_state,
+                                   read_notification_state, bond_with_unread_counters, read_targeted_notification)
+from notification.stream import notification_stream
+from pagination import encode_cursor, decode_cursor
+from database import get_session, get_read_session, async_session_maker
+from reference import reference_cache
 from sqlalchemy.ext.asyncio import AsyncSession
 
 
@@ -25,6 +35,7 @@ async def create_notification_status(stat: NotificationStatusCreate, session: As
     session.add(db_notification_status)
     await session.commit()
     await session.refresh(db_notification_status)
+    reference_cache.invalidate()
     return db_notification_status
 
 
@@ -37,15 +48,15 @@ async def create_notification_status_endpoint(stat: NotificationStatusCreate, se
     return db_status
 
 
-# название статуса уведомления по его айди
-@router.get("/find/{notification_status_id}")
-async def read_notification_status(notification_status_id: int, session: AsyncSession = Depends(get_session)):
-    read_notification_status_query = await session.execute(select(NotificationStatus).filter(
-        NotificationStatus.notification_status_id == notification_status_id))
-    db_read_notification_status = read_notification_status_query.scalars().first()
-    if not db_read_notification_status:
+# название статуса уведомления по его айди (из кеша справочников)
+@router.get("/find/{notification_status_id}", response_model=NotificationStatusOut)
+async def read_notification_status(notification_status_id: int):
+    await reference_cache.ensure_loaded()
+    notification_status_name = reference_cache.notification_statuses.name(notification_status_id)
+    if notification_status_name is None:
         raise HTTPException(status_code=404, detail='Notification Status is not found')
-    return db_read_notification_status
+    return NotificationStatusOut(notification_status_id=notification_status_id,
+                                 notification_status_name=notification_status_name)
 
 
 # функция для удаления статуса уведомления
@@ -57,6 +68,7 @@ async def delete_notification_status(notification_status_id: int, session: Async
         raise HTTPException(status_code=404, detail="Notification status not found")
     await session.delete(db_delete_notification_status)
     await session.commit()
+    reference_cache.invalidate()
     return {"message": "Notification status deleted successfully"}
 
 
@@ -79,6 +91,7 @@ async def create_notification_type(n_type: NotificationTypeCreate, session: Asyn
     session.add(db_type)
     await session.commit()
     await session.refresh(db_type)
+    reference_cache.invalidate()
     return db_type
 
 
@@ -91,15 +104,15 @@ async def create_notification_type_endpoint(n_type: NotificationTypeCreate, sess
     return db_create_type
 
 
-# название типа уведомления по его айди
-@router.get("/find_type/{notification_type_id}")
-async def read_notification_status(notification_type_id: int, session: AsyncSession = Depends(get_session)):
-    find_notification_type_query = await session.execute(select(NotificationType).filter(
-        NotificationType.notification_type_id == notification_type_id))
-    db_find_notification_type = find_notification_type_query.scalars().first()
-    if not db_find_notification_type:
+# название типа уведомления по его айди (из кеша справочников)
+@router.get("/find_type/{notification_type_id}", response_model=NotificationTypeOut)
+async def read_notification_type(notification_type_id: int):
+    await reference_cache.ensure_loaded()
+    notification_type_name = reference_cache.notification_types.name(notification_type_id)
+    if notification_type_name is None:
         raise HTTPException(status_code=404, detail='Notification type is not found')
-    return db_find_notification_type
+    return NotificationTypeOut(notification_type_id=notification_type_id,
+                               notification_type_name=notification_type_name)
 
 
 # функция для удаления типа уведомления
@@ -111,6 +124,7 @@ async def delete_notification_type(notification_type_id: int, session: AsyncSess
         raise HTTPException(status_code=404, detail="Notification type not found")
     await session.delete(db_delete_notification_type)
     await session.commit()
+    reference_cache.invalidate()
     return {"message": "Notification type deleted successfully"}
 
 
@@ -126,6 +140,7 @@ async def delete_notification_type_endpoint(notification_type_id: int, session:
 
 
 # Функция для создания уведомления
+# Рассылка (audience_type all / role / specialization) стоит одну вставку: адресаты определяются при чтении
 async def create_notification(notification: SystemNotificationCreate, session: AsyncSession = Depends(get_session)):
     # Преобразование datetime в безвременную зону
     notification_datetime = notification.notification_date_time.replace(tzinfo=None)
@@ -135,11 +150,16 @@ async def create_notification(notification: SystemNotificationCreate, session: A
         notification_type_id=notification.notification_type_id,
         notification_title=notification.notification_title,
         notification_text=notification.notification_text,
-        notification_date_time=notification_datetime
+        notification_date_time=notification_datetime,
+        audience_type=notification.audience_type,
+        audience_id=notification.audience_id
     )
     session.add(db_notification)
     await session.commit()
     await session.refresh(db_notification)
+    # адресные уведомления попадают в потоки при создании связей с пользователями
+    if db_notification.audience_type != 'targeted':
+        notification_stream.publish_broadcast(db_notification)
     return db_notification
 
 
@@ -155,7 +175,7 @@ async def create_notification_endpoint(notification: SystemNotificationCreate,
 
 # название уведомления по его айди
 @router.get("/find_notification/{notification_id}")
-async def read_notification(notification_id: int, session: AsyncSession = Depends(get_session)):
+async def read_notification(notification_id: int, session: AsyncSession = Depends(get_read_session)):
     find_notification_query = await session.execute(select(SystemNotification).filter(
         SystemNotification.notification_id == notification_id))
     db_find_notification = find_notification_query.scalars().first()
@@ -187,68 +207,140 @@ async def delete_notification_endpoint(notification_id: int, session: AsyncSessi
 ###############################
 
 
-# Function to create a notification bond for a list of users
+# Function to create a notification bond for a list of users (duplicates are skipped)
 async def create_user_notifications_bond(user_ids: List[int], notification_id: int, session: AsyncSession = Depends(get_session)):
-    db_user_notifications = [
-        UserSystemNotification(user_id=user_id, notification_id=notification_id)
-        for user_id in user_ids
-    ]
-    session.add_all(db_user_notifications)
+    # пустой VALUES не является корректным запросом
+    if not user_ids:
+        return 0
+    notification = await read_targeted_notification(notification_id, session)
+    bond_insert = (
+        insert(UserSystemNotification)
+        .values([{'user_id': user_id, 'notification_id': notification_id} for user_id in user_ids])
+        .on_conflict_do_nothing(constraint='_user_notification_uc')
+    )
+    result = await session.execute(bond_with_unread_counters(bond_insert))
+    inserted = result.scalar_one()
     await session.commit()
-    return db_user_notifications
-
+    if notification_stream.has_subscribers(user_ids):
+        notification_stream.publish_to_users(notification, user_ids)
+    return inserted
 
-# Endpoint to create notification for all users or users with a specific role
-@router.post("/create_notification_by_role/{role_id}", response_model=List[SystemNotificationOut])
-async def create_user_notification(role_id: int, notification_id: int, session: AsyncSession = Depends(get_session)):
-    if role_id == 0:
-        # Get all users
-        users_query = select(UserProfile)
-    else:
-        # Get users with the specific role
-        users_query = select(UserProfile).filter(UserProfile.role_id == role_id)
 
-    result = await session.execute(users_query)
-    users = result.scalars().all()
+# Endpoint to create notification for all users (role_id == 0) or users with a specific role
+# Рассылка выполняется фоновой задачей в базе, прогресс доступен по job_id
+@router.post("/create_notification_by_role/{role_id}", response_model=FanoutJobOut, status_code=202)
+async def create_user_notification(role_id: int, notification_id: int, background_tasks: BackgroundTasks,
+                                   session: AsyncSession = Depends(get_session)):
+    await read_targeted_notification(notification_id, session)
 
-    if not users:
+    users_query = await session.execute(select(UserProfile.user_id).filter(fanout_audience(role_id)).limit(1))
+    if users_query.first() is None:
         raise HTTPException(status_code=404, detail="No users found")
 
-    user_ids = [user.user_id for user in users]
-    db_user_notifications = await create_user_notifications_bond(user_ids, notification_id, session)
-
-    if not db_user_notifications:
-        raise HTTPException(status_code=400, detail="Failed to create notifications")
-
-    return db_user_notifications
+    job = register_fanout_job(notification_id, role_id)
+    background_tasks.add_task(run_fanout_job, job)
+    return FanoutJobOut(**vars(job))
+
+
+# Прогресс фоновой рассылки уведомления
+@router.get("/fanout_job/{job_id}", response_model=FanoutJobOut)
+async def read_fanout_job(job_id: str):
+    job = fanout_jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Fan-out job not found")
+    return FanoutJobOut(**vars(job))
+
+
+# Маршрут для получения уведомлений определенного пользователя (от новых к старым, постранично)
+@router.get("/user/{user_id}", response_model=NotificationPage)
+async def get_user_notifications(user_id: int, limit: int = Query(20, ge=1, le=100), cursor: Optional[str] = None,
+                                 session: AsyncSession = Depends(get_read_session)):
+    audience = await read_user_audience(user_id, session)
+    before_id = decode_cursor(cursor, [int])[0] if cursor else None
+    page_ids = visible_notification_ids(audience, before_id=before_id, limit=limit + 1)
+
+    # адресные уведомления прочитаны по своей строке, рассылки - по отметке прочтения
+    user_notifications_query = (
+        select(SystemNotification, UserSystemNotification.is_read)
+        .join(page_ids, page_ids.c.notification_id == SystemNotification.notification_id)
+        .outerjoin(UserSystemNotification, and_(
+            UserSystemNotification.notification_id == SystemNotification.notification_id,
+            UserSystemNotification.user_id == user_id))
+        .order_by(SystemNotification.notification_id.desc())
+        .limit(limit + 1)
+    )
+    result = await session.execute(user_notifications_query)
+    user_notifications = result.all()
+    has_more = len(user_notifications) > limit
+    user_notifications = user_notifications[:limit]
+
+    state = await read_notification_state(user_id, session)
+    notifications = [
+        NotificationByUserOut(
+            notification_id=notif.notification_id,
+            notification_title=notif.notification_title,
+            notification_text=notif.notification_text,
+            notification_date_time=notif.notification_date_time,
+            is_read=bond_is_read if bond_is_read is not None else notif.notification_id <= state.read_watermark
+        ) for notif, bond_is_read in user_notifications
+    ]
+    next_cursor = encode_cursor(user_notifications[-1][0].notification_id) if has_more else None
+    return NotificationPage(
+        notifications=notifications,
+        next_cursor=next_cursor,
+        unread_count=await count_unread(audience, state, session)
+    )
 
 
-# Маршрут для получения всех уведомлений определенного пользователя
-@router.get("/user/{user_id}", response_model=Dict[str, NotificationByUserOut])
-async def get_user_notifications(user_id: int, session: AsyncSession = Depends(get_session)):
-    # Запрос для получения уведомлений пользователя
-    user_notifications_query = select(
-        SystemNotification.notification_title,
-        SystemNotification.notification_text
-    ).join(
-        UserSystemNotification,
-        UserSystemNotification.notification_id == SystemNotification.notification_id
-    ).filter(
-        UserSystemNotification.user_id == user_id
+# поток новых уведомлений пользователя (Server-Sent Events) вместо опроса /notification/user/{user_id};
+# при переподключении EventSource присылает Last-Event-ID и получает только пропущенное
+@router.get("/stream/{user_id}")
+async def stream_user_notifications(user_id: int, last_event_id: Optional[int] = Header(None)):
+    # сессия только на проверку пользователя: поток не держит соединение с базой
+    async with async_session_maker() as session:
+        audience = await read_user_audience(user_id, session)
+    return StreamingResponse(
+        notification_stream.events(audience, last_event_id),
+        media_type='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
     )
 
-    result = await session.execute(user_notifications_query)
-    user_notifications = result.fetchall()
 
-    if not user_notifications:
-        raise HTTPException(status_code=404, detail="No notifications found for this user")
+# количество непрочитанных уведомлений пользователя
+@router.get("/user/{user_id}/unread", response_model=NotificationUnreadOut)
+async def get_user_unread_notifications(user_id: int, session: AsyncSession = Depends(get_read_session)):
+    audience = await read_user_audience(user_id, session)
+    state = await read_notification_state(user_id, session)
+    return NotificationUnreadOut(user_id=user_id, read_watermark=state.read_watermark,
+                                 unread_count=await count_unread(audience, state, session))
 
-    # Формирование словаря уведомлений
-    notifications_dict = {
-        str(index + 1): NotificationByUserOut(
-            notification_title=notif.notification_title,
-            notification_text=notif.notification_text
-        ) for index, notif in enumerate(user_notifications)
-    }
 
-    return notifications_dict
+# отметить прочитанными все уведомления пользователя до notification_id включительно
+@router.post("/user/{user_id}/mark_read", response_model=NotificationUnreadOut)
+async def mark_user_notifications_read(user_id: int, notification_id: int,
+                                       session: AsyncSession = Depends(get_session)):
+    audience = await read_user_audience(user_id, session)
+    await init_notification_state(user_id, session)
+    # адресные строки отмечаются прочитанными и вычитаются из счетчика в том же запросе
+    marked = (
+        update(UserSystemNotification)
+        .where(UserSystemNotification.user_id == user_id,
+               UserSystemNotification.notification_id <= notification_id,
+               UserSystemNotification.is_read.is_(False))
+        .values(is_read=True)
+        .returning(UserSystemNotification.user_notification_id)
+        .cte('marked')
+    )
+    marked_count = select(func.count()).select_from(marked).scalar_subquery()
+    # отметка прочтения рассылок только растет
+    state_update = (
+        update(UserNotificationState)
+        .where(UserNotificationState.user_id == user_id)
+        .values(read_watermark=func.greatest(UserNotificationState.read_watermark, notification_id),
+                unread_count=func.greatest(UserNotificationState.unread_count - marked_count, 0))
+        .returning(UserNotificationState.read_watermark, UserNotificationState.unread_count)
+    )
+    state = (await session.execute(state_update)).one()
+    await session.commit()
+    return NotificationUnreadOut(user_id=user_id, read_watermark=state.read_watermark,
+                                 unread_count=await count_unread(audience, state, session))
@@ -1,6 +1,7 @@
 from datetime import datetime
+from typing import Optional, List, Literal
 
-from pydantic import BaseModel
+from pydantic import BaseModel, model_validator
 
 
 class SystemNotificationCreate(BaseModel):
@@ -9,6 +10,16 @@ class SystemNotificationCreate(BaseModel):
     notification_title: str
     notification_text: str
     notification_date_time: datetime
+    audience_type: Literal['targeted', 'all', 'role', 'specialization'] = 'targeted'
+    audience_id: Optional[int] = None
+
+    @model_validator(mode='after')
+    def check_audience(self):
+        if self.audience_type in ('role', 'specialization') and self.audience_id is None:
+            raise ValueError('audience_id is required for role and specialization broadcasts')
+        if self.audience_type in ('targeted', 'all') and self.audience_id is not None:
+            raise ValueError('audience_id is only allowed for role and specialization broadcasts')
+        return self
 
 
 class SystemNotificationOut(BaseModel):
@@ -18,6 +29,8 @@ class SystemNotificationOut(BaseModel):
     notification_title: str
     notification_text: str
     notification_date_time: datetime
+    audience_type: str
+    audience_id: Optional[int]
 
 
 class NotificationStatusCreate(BaseModel):
@@ -49,5 +62,33 @@ class UserSystemNotificationOut(BaseModel):
 
 
 class NotificationByUserOut(BaseModel):
+    notification_id: int
     notification_title: str
-    notification_text: str
\ No newline at end of file
+    notification_text: str
+    notification_date_time: datetime
+    is_read: bool
+
+
+class NotificationPage(BaseModel):
+    notifications: List[NotificationByUserOut]
+    next_cursor: Optional[str]
+    unread_count: int
+
+
+class NotificationUnreadOut(BaseModel):
+    user_id: int
+    read_watermark: int
+    unread_count: int
+
+
+class FanoutJobOut(BaseModel):
+    job_id: str
+    notification_id: int
+    role_id: int
+    status: str
+    total_users: int
+    processed_users: int
+    inserted: int
+    error: Optional[str]
+    created_at: datetime
+    finished_at: Optional[datetime]
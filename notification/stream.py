@@ -0,0 +1,165 @@
+import asyncio
+import os
+from collections import deque
+from typing import AsyncIterator, Callable, Dict, Iterable, List, Optional, Set
+
+from sqlalchemy import select
+
+from database import async_session_maker
+from notification.audience import UserAudience, read_user_audience, visible_notification_ids, broadcast_matches
+from notification.models import SystemNotification
+from notification.schemas import NotificationByUserOut
+
+# настройки потока уведомлений (Server-Sent Events), задаются через переменные окружения
+NOTIFICATION_STREAM_QUEUE_SIZE = int(os.getenv('NOTIFICATION_STREAM_QUEUE_SIZE', '100'))
+NOTIFICATION_STREAM_KEEPALIVE_SECONDS = float(os.getenv('NOTIFICATION_STREAM_KEEPALIVE_SECONDS', '15'))
+# сверка с базой: уведомления, созданные другими воркерами, и смена аудитории пользователя (0 - отключить)
+NOTIFICATION_STREAM_CATCHUP_SECONDS = float(os.getenv('NOTIFICATION_STREAM_CATCHUP_SECONDS', '60'))
+REPLAY_PAGE_SIZE = 100
+RETRY_MILLISECONDS = 3000  # пауза перед переподключением EventSource
+RECENT_IDS_KEPT = 1000  # отправленные id для отсева повторов между догрузкой из базы и живыми событиями
+_CLOSE = object()
+
+
+# подписчик потока: аудитория пользователя и ограниченная очередь живых событий;
+# при переполнении события не теряются - подписчик догружает пропущенное из базы
+class NotificationSubscriber:
+    def __init__(self, audience: UserAudience, queue_size: int):
+        self.audience = audience
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+        self.lagging = False
+
+    def offer(self, item):
+        try:
+            self.queue.put_nowait(item)
+        except asyncio.QueueFull:
+            self.lagging = True
+
+
+def format_event(notification: NotificationByUserOut) -> str:
+    return f'id: {notification.notification_id}\nevent: notification\ndata: {notification.model_dump_json()}\n\n'
+
+
+# в поток попадают только новые для клиента уведомления, поэтому они отдаются непрочитанными
+def to_event_payload(notification: SystemNotification) -> NotificationByUserOut:
+    return NotificationByUserOut(
+        notification_id=notification.notification_id,
+        notification_title=notification.notification_title,
+        notification_text=notification.notification_text,
+        notification_date_time=notification.notification_date_time,
+        is_read=False
+    )
+
+
+# уведомления пользователя новее after_id по возрастанию id (для Last-Event-ID и сверки)
+async def load_notifications_after(audience: UserAudience, after_id: int, limit: int) -> List[SystemNotification]:
+    after_ids = visible_notification_ids(audience, after_id=after_id)
+    async with async_session_maker() as session:
+        notifications_query = await session.execute(
+            select(SystemNotification)
+            .join(after_ids, after_ids.c.notification_id == SystemNotification.notification_id)
+            .order_by(SystemNotification.notification_id)
+            .limit(limit)
+        )
+        return list(notifications_query.scalars().all())
+
+
+# последнее видимое пользователю уведомление: начало потока для клиента без Last-Event-ID
+async def latest_notification_id(audience: UserAudience) -> int:
+    latest_ids = visible_notification_ids(audience, limit=1)
+    async with async_session_maker() as session:
+        latest_query = await session.execute(select(latest_ids.c.notification_id)
+                                             .order_by(latest_ids.c.notification_id.desc()).limit(1))
+        return latest_query.scalar() or 0
+
+
+# раздача новых уведомлений открытым SSE-потокам этого процесса; соединение с базой поток не держит
+class NotificationStreamHub:
+    def __init__(self, queue_size: int = NOTIFICATION_STREAM_QUEUE_SIZE,
+                 keepalive: float = NOTIFICATION_STREAM_KEEPALIVE_SECONDS,
+                 catchup: float = NOTIFICATION_STREAM_CATCHUP_SECONDS):
+        self.queue_size = queue_size
+        self.keepalive = keepalive
+        self.catchup = catchup
+        self.subscribers: Dict[int, Set[NotificationSubscriber]] = {}
+        self.closing = False
+
+    def has_subscribers(self, user_ids: Iterable[int]) -> bool:
+        return any(user_id in self.subscribers for user_id in user_ids)
+
+    def publish(self, notification: SystemNotification, matches: Callable[[UserAudience], bool]):
+        payload = to_event_payload(notification)
+        for user_subscribers in list(self.subscribers.values()):
+            for subscriber in list(user_subscribers):
+                if matches(subscriber.audience):
+                    subscriber.offer(payload)
+
+    # рассылка all / role / specialization: адресаты определяются по аудитории подписчика без запросов в базу
+    def publish_broadcast(self, notification: SystemNotification):
+        self.publish(notification, lambda audience: broadcast_matches(notification, audience))
+
+    def publish_to_users(self, notification: SystemNotification, user_ids: Iterable[int]):
+        payload = to_event_payload(notification)
+        for user_id in set(user_ids):
+            for subscriber in list(self.subscribers.get(user_id, ())):
+                subscriber.offer(payload)
+
+    async def events(self, audience: UserAudience, last_event_id: Optional[int]) -> AsyncIterator[str]:
+        subscriber = NotificationSubscriber(audience, self.queue_size)
+        # подписка до догрузки из базы: уведомления, созданные во время нее, окажутся в очереди
+        self.subscribers.setdefault(audience.user_id, set()).add(subscriber)
+        try:
+            recent_ids = deque(maxlen=RECENT_IDS_KEPT)
+            last_id = last_event_id if last_event_id is not None else await latest_notification_id(audience)
+            replay_pending = last_event_id is not None  # переподключение: сначала все пропущенное
+            loop = asyncio.get_running_loop()
+            next_catchup = loop.time() + self.catchup
+            yield f'retry: {RETRY_MILLISECONDS}\n\n'
+            while not self.closing:
+                if replay_pending or subscriber.lagging or (self.catchup and loop.time() >= next_catchup):
+                    if not replay_pending:
+                        # аудитория могла измениться (роль, специализации)
+                        async with async_session_maker() as session:
+                            subscriber.audience = await read_user_audience(audience.user_id, session)
+                    replay_pending = False
+                    subscriber.lagging = False
+                    while True:
+                        missed = await load_notifications_after(subscriber.audience, last_id, REPLAY_PAGE_SIZE)
+                        for notification in missed:
+                            recent_ids.append(notification.notification_id)
+                            last_id = max(last_id, notification.notification_id)
+                            yield format_event(to_event_payload(notification))
+                        if len(missed) < REPLAY_PAGE_SIZE:
+                            break
+                    next_catchup = loop.time() + self.catchup
+                try:
+                    item = await asyncio.wait_for(subscriber.queue.get(), timeout=self.keepalive)
+                except asyncio.TimeoutError:
+                    yield ': keepalive\n\n'
+                    continue
+                if item is _CLOSE:
+                    break
+                if item.notification_id in recent_ids:
+                    continue
+                recent_ids.append(item.notification_id)
+                last_id = max(last_id, item.notification_id)
+                yield format_event(item)
+        finally:
+            user_subscribers = self.subscribers.get(audience.user_id)
+            if user_subscribers is not None:
+                user_subscribers.discard(subscriber)
+                if not user_subscribers:
+                    del self.subscribers[audience.user_id]
+
+    # остановка сервера: открытые потоки завершаются, клиенты переподключатся с Last-Event-ID
+    def close(self):
+        self.closing = True
+        for user_subscribers in list(self.subscribers.values()):
+            for subscriber in list(user_subscribers):
+                subscriber.lagging = False
+                while not subscriber.queue.empty():
+                    subscriber.queue.get_nowait()
+                subscriber.queue.put_nowait(_CLOSE)
+
+
+notification_stream = NotificationStreamHub()
@@ -0,0 +1,132 @@
+import base64
+import binascii
+import json
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Any, Callable, Generic, List, Literal, Optional, Sequence, TypeVar
+
+from fastapi import HTTPException
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel
+from sqlalchemy import select, func, text, tuple_
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.exc import CompileError
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from database import async_session_maker
+
+T = TypeVar('T')
+
+# none - без общего количества, exact - COUNT(*), estimate - оценка планировщика (EXPLAIN)
+CountMode = Literal['none', 'exact', 'estimate']
+
+STREAM_BATCH_SIZE = 1000  # строк за одно чтение серверного курсора при выгрузке
+
+
+# курсор - это значения ключа сортировки последней записи страницы, упакованные в base64
+def encode_cursor(*values: Any) -> str:
+    payload = [{'dt': value.isoformat()} if isinstance(value, datetime) else value for value in values]
+    return base64.urlsafe_b64encode(json.dumps(payload).encode('utf-8')).decode('ascii')
+
+
+# значение курсора должно подходить к типу колонки ключа, иначе запрос упадет в драйвере базы с 500
+def cursor_value_matches(value: Any, value_type: type) -> bool:
+    if isinstance(value, bool):
+        return False
+    if value_type is float:
+        return isinstance(value, (int, float))
+    return isinstance(value, value_type)
+
+
+# types - python-типы колонок ключа (int, float, datetime) в порядке ключа
+def decode_cursor(cursor: str, types: Sequence[type]) -> List[Any]:
+    try:
+        payload = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+        values = [datetime.fromisoformat(value['dt']) if isinstance(value, dict) else value for value in payload]
+    except (binascii.Error, ValueError, TypeError, KeyError, UnicodeError):
+        raise HTTPException(status_code=400, detail='Invalid cursor')
+    if len(values) != len(types) or not all(map(cursor_value_matches, values, types)):
+        raise HTTPException(status_code=400, detail='Invalid cursor')
+    return values
+
+
+# страница списка, которую возвращают list-эндпоинты
+class Page(BaseModel, Generic[T]):
+    items: List[T]
+    next_cursor: Optional[str] = None
+    total: Optional[int] = None
+    total_is_estimate: bool = False
+
+
+@dataclass
+class PageResult:
+    rows: list
+    next_cursor: Optional[str]
+    total: Optional[int]
+    total_is_estimate: bool
+
+    def to_page(self, convert: Callable[[Any], Any] = lambda row: dict(row._mapping)) -> Page:
+        return Page(items=[convert(row) for row in self.rows], next_cursor=self.next_cursor,
+                    total=self.total, total_is_estimate=self.total_is_estimate)
+
+
+# оценка количества строк запроса по плану PostgreSQL, без выполнения самого запроса
+async def estimate_count(session: AsyncSession, query) -> Optional[int]:
+    try:
+        compiled = query.compile(dialect=postgresql.dialect(), compile_kwargs={'literal_binds': True})
+    except CompileError:
+        return None
+    plan_query = await session.execute(text(f'EXPLAIN (FORMAT JSON) {compiled}'))
+    plan = plan_query.scalar_one()
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return int(plan[0]['Plan']['Plan Rows'])
+
+
+async def count_rows(session: AsyncSession, query, count: CountMode):
+    if count == 'none':
+        return None, False
+    query = query.order_by(None)
+    if count == 'estimate':
+        estimate = await estimate_count(session, query)
+        if estimate is not None:
+            return estimate, True
+    count_query = await session.execute(select(func.count()).select_from(query.subquery()))
+    return count_query.scalar_one(), False
+
+
+# keyset-пагинация: query - проекция без сортировки, keys - уникальный ключ сортировки,
+# все колонки ключа должны входить в проекцию и иметь тип, по которому проверяются значения курсора
+async def paginate(session: AsyncSession, query, keys: Sequence, limit: int, cursor: Optional[str] = None,
+                   count: CountMode = 'none', descending: bool = False) -> PageResult:
+    total, total_is_estimate = await count_rows(session, query, count)
+
+    if cursor is not None:
+        values = decode_cursor(cursor, [key.type.python_type for key in keys])
+        key = tuple_(*keys) if len(keys) > 1 else keys[0]
+        bound = tuple_(*values) if len(keys) > 1 else values[0]
+        query = query.filter(key < bound if descending else key > bound)
+    ordering = [key.desc() for key in keys] if descending else list(keys)
+    result = await session.execute(query.order_by(*ordering).limit(limit + 1))
+    rows = result.all()
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(*(rows[-1]._mapping[key.key] for key in keys))
+    return PageResult(rows=rows, next_cursor=next_cursor, total=total, total_is_estimate=total_is_estimate)
+
+
+# выгрузка в NDJSON через серверный курсор: память не зависит от размера таблицы
+# сессия открывается внутри генератора, так как ответ отдается после выхода из эндпоинта
+def ndjson_response(query, convert: Callable[[Any], Any] = lambda row: dict(row._mapping),
+                    filename: Optional[str] = None) -> StreamingResponse:
+    async def lines():
+        async with async_session_maker() as session:
+            result = await session.stream(query.execution_options(yield_per=STREAM_BATCH_SIZE))
+            async for row in result:
+                yield json.dumps(jsonable_encoder(convert(row)), ensure_ascii=False) + '\n'
+
+    headers = {'Content-Disposition': f'attachment; filename="{filename}"'} if filename else None
+    return StreamingResponse(lines(), media_type='application/x-ndjson', headers=headers)
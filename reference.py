@@ -0,0 +1,95 @@
+import asyncio
+import os
+import time
+from typing import Dict, Optional
+
+from fastapi import HTTPException
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from database import async_session_maker
+from notification.models import NotificationStatus, NotificationType
+from role.models import Role
+from specialization.models import Specialization
+from status.models import Status
+
+# названия ролей в таблице role (вместо захардкоженных role_id)
+TAROT_ROLE_NAME = os.getenv('TAROT_ROLE_NAME', 'tarot')
+CLIENT_ROLE_NAME = os.getenv('CLIENT_ROLE_NAME', 'client')
+# страховочное время жизни кеша: изменения из других воркеров подхватываются не позже чем через него
+REFERENCE_CACHE_TTL = float(os.getenv('REFERENCE_CACHE_TTL', '300'))
+
+
+# один справочник: id -> название и название -> id
+class ReferenceTable:
+    def __init__(self, model, id_column, name_column):
+        self.model = model
+        self.id_column = id_column
+        self.name_column = name_column
+        self.names: Dict[int, str] = {}
+        self.ids: Dict[str, int] = {}
+
+    async def load(self, session: AsyncSession):
+        rows = await session.execute(select(self.id_column, self.name_column))
+        self.names = {row_id: name for row_id, name in rows.all()}
+        self.ids = {name: row_id for row_id, name in self.names.items()}
+
+    def name(self, row_id: int) -> Optional[str]:
+        return self.names.get(row_id)
+
+    def id(self, name: str) -> Optional[int]:
+        return self.ids.get(name)
+
+
+# кеш маленьких редко меняющихся справочников; загружается при старте и сбрасывается функциями записи
+class ReferenceCache:
+    def __init__(self, ttl: float = REFERENCE_CACHE_TTL):
+        self.ttl = ttl
+        self.roles = ReferenceTable(Role, Role.role_id, Role.role_name)
+        self.statuses = ReferenceTable(Status, Status.status_id, Status.status_name)
+        self.notification_statuses = ReferenceTable(NotificationStatus, NotificationStatus.notification_status_id,
+                                                    NotificationStatus.notification_status_name)
+        self.notification_types = ReferenceTable(NotificationType, NotificationType.notification_type_id,
+                                                 NotificationType.notification_type_name)
+        self.specializations = ReferenceTable(Specialization, Specialization.specialization_id,
+                                              Specialization.specialization_name)
+        self._expires_at = 0.0
+        self._lock = asyncio.Lock()
+
+    @property
+    def tables(self):
+        return (self.roles, self.statuses, self.notification_statuses, self.notification_types,
+                self.specializations)
+
+    async def load(self):
+        async with async_session_maker() as session:
+            for table in self.tables:
+                await table.load(session)
+        self._expires_at = time.monotonic() + self.ttl
+
+    async def ensure_loaded(self):
+        if time.monotonic() < self._expires_at:
+            return
+        async with self._lock:
+            if time.monotonic() >= self._expires_at:
+                await self.load()
+
+    # вызывается после изменения справочника; перезагрузка произойдет при следующем обращении
+    def invalidate(self):
+        self._expires_at = 0.0
+
+    async def role_id(self, role_name: str) -> int:
+        await self.ensure_loaded()
+        role_id = self.roles.id(role_name)
+        if role_id is None:
+            raise HTTPException(status_code=500, detail=f"Role '{role_name}' is not configured")
+        return role_id
+
+    async def tarot_role_id(self) -> int:
+        return await self.role_id(TAROT_ROLE_NAME)
+
+    async def client_role_id(self) -> int:
+        return await self.role_id(CLIENT_ROLE_NAME)
+
+
+reference_cache = ReferenceCache()
@@ -1,9 +1,13 @@
-from fastapi import APIRouter, Depends, HTTPException
+from typing import Optional
+
+from fastapi import APIRouter, Depends, HTTPException, Query
 from sqlalchemy import select
 from user.models import UserProfile
 from role.models import Role
-from role.schemas import RoleCreate, RoleOut
-from database import get_session
+from role.schemas import RoleCreate, RoleOut, RoleUserOut
+from database import get_session, get_read_session
+from reference import reference_cache
+from pagination import Page, CountMode, paginate
 from sqlalchemy.ext.asyncio import AsyncSession
 
 
@@ -22,6 +26,7 @@ async def create_role(role: RoleCreate, session: AsyncSession = Depends(get_sess
     session.add(db_role)
     await session.commit()
     await session.refresh(db_role)
+    reference_cache.invalidate()
     return db_role
 
 
@@ -34,25 +39,25 @@ async def create_role_endpoint(role: RoleCreate, session: AsyncSession = Depends
     return db_role
 
 
-# название роли по её айди
-@router.get("/{role_id}")
-async def read_user(role_id: int, session: AsyncSession = Depends(get_session)):
-    role_query = await session.execute(select(Role).filter(Role.role_id == role_id))
-    db_role = role_query.scalars().first()
-    if not db_role:
+# название роли по её айди (из кеша справочников)
+@router.get("/{role_id}", response_model=RoleOut)
+async def read_user(role_id: int):
+    await reference_cache.ensure_loaded()
+    role_name = reference_cache.roles.name(role_id)
+    if role_name is None:
         raise HTTPException(status_code=404, detail='Role is not found')
-    return db_role
+    return RoleOut(role_id=role_id, role_name=role_name)
 
 
-# выводит всех юзеров по определённой роли
-@router.get('/users/{role_id}')
-async def read_users_by_role(role_id: int, session: AsyncSession = Depends(get_session)):
-    read_role_query = await session.execute(select(UserProfile).join(Role).filter(UserProfile.role_id == role_id))
-    db_read_role = read_role_query.scalars().all()
-    if not db_read_role:
+# выводит всех юзеров по определённой роли (постранично)
+@router.get('/users/{role_id}', response_model=Page[RoleUserOut])
+async def read_users_by_role(role_id: int, limit: int = Query(50, ge=1, le=500), cursor: Optional[str] = None,
+                             count: CountMode = 'none', session: AsyncSession = Depends(get_read_session)):
+    read_role_query = select(UserProfile.user_id, UserProfile.username).filter(UserProfile.role_id == role_id)
+    page = await paginate(session, read_role_query, [UserProfile.user_id], limit, cursor, count)
+    if not page.rows and cursor is None:
         raise HTTPException(status_code=404, detail='Role is not found')
-    users = [{'users_name': users.username} for users in db_read_role]
-    return {'role_id': role_id, 'username': users}
+    return page.to_page()
 
 
 # функция для удаления роли
@@ -63,6 +68,7 @@ async def delete_role(role_id: int, session: AsyncSession = Depends(get_session)
         raise HTTPException(status_code=404, detail="Role not found")
     await session.delete(db_role_delete)
     await session.commit()
+    reference_cache.invalidate()
     return {"message": "Role deleted successfully"}
 
 
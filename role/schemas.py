@@ -7,4 +7,9 @@ class RoleCreate(BaseModel):
 
 class RoleOut(BaseModel):
     role_id: int
-    role_name: str
\ No newline at end of file
+    role_name: str
+
+
+class RoleUserOut(BaseModel):
+    user_id: int
+    username: str
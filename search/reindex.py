@@ -0,0 +1,44 @@
+import argparse
+import asyncio
+import time
+
+from sqlalchemy import text
+
+from database import engine
+
+# перестроение поисковых индексов после массовой загрузки (bulk_import, loadtest.seed) или их разрастания;
+# REINDEX CONCURRENTLY не блокирует запись, но выполняется вне транзакции
+SEARCH_INDEXES = {
+    'user_profile': ('ix_user_profile_name_trgm', 'ix_user_profile_description_search'),
+    'service': ('ix_service_name_trgm', 'ix_service_text_search'),
+    'message': ('ix_message_text_search',),
+}
+
+
+async def reindex(tables, concurrently: bool = True):
+    async with engine.connect() as connection:
+        connection = await connection.execution_options(isolation_level='AUTOCOMMIT')
+        # вне транзакции SET LOCAL не действует: настройка сбрасывается, чтобы соединение вернулось в пул как было
+        await connection.execute(text('SET statement_timeout = 0'))
+        try:
+            for table in tables:
+                for index in SEARCH_INDEXES[table]:
+                    started = time.perf_counter()
+                    mode = ' CONCURRENTLY' if concurrently else ''
+                    await connection.execute(text(f'REINDEX INDEX{mode} {index}'))
+                    print(f'{index}: {time.perf_counter() - started:.1f}s')
+                # свежая статистика нужна планировщику для выбора между триграммным и полнотекстовым индексом
+                await connection.execute(text(f'ANALYZE {table}'))
+        finally:
+            await connection.execute(text('RESET statement_timeout'))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Rebuild search indexes and refresh planner statistics')
+    parser.add_argument('tables', nargs='*', help=f"tables to reindex: {', '.join(SEARCH_INDEXES)} (all by default)")
+    parser.add_argument('--blocking', action='store_true', help='plain REINDEX (faster, blocks writes)')
+    args = parser.parse_args()
+    unknown = set(args.tables) - set(SEARCH_INDEXES)
+    if unknown:
+        parser.error(f"unknown tables: {', '.join(sorted(unknown))}")
+    asyncio.run(reindex(args.tables or sorted(SEARCH_INDEXES), concurrently=not args.blocking))
@@ -0,0 +1,132 @@
+import html
+from typing import Literal, Optional
+
+from fastapi import APIRouter, Depends, Query
+from sqlalchemy import select, func, or_, literal, union_all, literal_column
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from database import get_read_session
+from fulltext import TEXT_SEARCH_CONFIG, search_document, text_search_vector, text_search_query
+from reference import reference_cache
+from search.schemas import SearchHit, SearchResults
+from service.models import Service
+from user.models import UserProfile
+
+router = APIRouter(
+    prefix='/search',
+    tags=['Search']
+)
+
+# ts_headline не экранирует текст вокруг совпадений, а имена и описания вводят пользователи: совпадения
+# отмечаются символами из области частного использования, текст экранируется, и только затем отметки
+# заменяются на <b>...</b>
+HIGHLIGHT_START = '\ue000'
+HIGHLIGHT_STOP = '\ue001'
+HEADLINE_OPTIONS = f'StartSel={HIGHLIGHT_START}, StopSel={HIGHLIGHT_STOP}, MaxFragments=2, MaxWords=20, MinWords=5'
+
+
+def render_highlight(headline: Optional[str]) -> Optional[str]:
+    if headline is None:
+        return None
+    return html.escape(headline).replace(HIGHLIGHT_START, '<b>').replace(HIGHLIGHT_STOP, '</b>')
+
+
+def escape_like(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+
+# совпадение по имени: похожесть слов (опечатки, префиксы) или подстрока; оба условия идут по триграммному индексу
+def name_match(document, q: str):
+    return or_(document.op('%>')(q), document.ilike(f'%{escape_like(q)}%'))
+
+
+def name_score(document, q: str):
+    return func.word_similarity(q, document)
+
+
+# тарологи (неудаленные) по имени, фамилии, никнейму и описанию
+def tarot_hits(q: str, tarot_role_id: int, limit: int):
+    name_document = search_document(UserProfile.username, UserProfile.first_name, UserProfile.second_name)
+    description_vector = text_search_vector(UserProfile.user_description)
+    ts_query = text_search_query(q)
+    return (
+        select(
+            literal('tarot').label('kind'),
+            UserProfile.user_id.label('id'),
+            UserProfile.user_id.label('tarot_id'),
+            func.concat_ws(' ', UserProfile.first_name, UserProfile.second_name,
+                           literal('@').op('||')(UserProfile.username)).label('title'),
+            UserProfile.user_description.label('body'),
+            func.greatest(name_score(name_document, q), func.ts_rank_cd(description_vector, ts_query)).label('score')
+        )
+        .filter(
+            UserProfile.role_id == tarot_role_id,
+            UserProfile.is_deleted == False,
+            or_(name_match(name_document, q), description_vector.op('@@')(ts_query))
+        )
+        .order_by(literal_column('score').desc())
+        .limit(limit)
+        .subquery()
+    )
+
+
+# услуги неудаленных тарологов по названию и описанию
+def service_hits(q: str, limit: int):
+    name_document = search_document(Service.service_name)
+    text_vector = text_search_vector(Service.service_name, Service.service_description)
+    ts_query = text_search_query(q)
+    return (
+        select(
+            literal('service').label('kind'),
+            Service.service_id.label('id'),
+            Service.tarot_id.label('tarot_id'),
+            Service.service_name.label('title'),
+            Service.service_description.label('body'),
+            func.greatest(name_score(name_document, q), func.ts_rank_cd(text_vector, ts_query)).label('score')
+        )
+        .join(UserProfile, UserProfile.user_id == Service.tarot_id)
+        .filter(
+            UserProfile.is_deleted == False,
+            or_(name_match(name_document, q), text_vector.op('@@')(ts_query))
+        )
+        .order_by(literal_column('score').desc())
+        .limit(limit)
+        .subquery()
+    )
+
+
+# единый поиск тарологов и услуг с учетом опечаток; подсветка считается только для строк итоговой страницы
+# (от 3 символов: более короткая строка не дает триграмм и не может использовать индекс)
+@router.get('', response_model=SearchResults)
+async def search(q: str = Query(..., min_length=3, max_length=100),
+                 kind: Literal['all', 'tarot', 'service'] = 'all',
+                 limit: int = Query(20, ge=1, le=50),
+                 session: AsyncSession = Depends(get_read_session)):
+    q = q.strip()
+    parts = []
+    if kind in ('all', 'tarot'):
+        parts.append(tarot_hits(q, await reference_cache.tarot_role_id(), limit))
+    if kind in ('all', 'service'):
+        parts.append(service_hits(q, limit))
+    # каждая часть ограничена limit по своему индексу, общий порядок - по score
+    hits = union_all(*(select(part) for part in parts)).subquery()
+
+    ts_query = text_search_query(q)
+    page = select(hits).order_by(hits.c.score.desc(), hits.c.kind, hits.c.id).limit(limit).subquery()
+    result = await session.execute(
+        select(
+            page.c.kind,
+            page.c.id,
+            page.c.tarot_id,
+            page.c.title,
+            page.c.score,
+            func.ts_headline(TEXT_SEARCH_CONFIG, page.c.title, ts_query, HEADLINE_OPTIONS).label('title_highlight'),
+            func.ts_headline(TEXT_SEARCH_CONFIG, page.c.body, ts_query, HEADLINE_OPTIONS).label('snippet')
+        )
+        .order_by(page.c.score.desc(), page.c.kind, page.c.id)
+    )
+    items = [SearchHit(kind=row.kind, id=row.id, tarot_id=row.tarot_id, title=row.title,
+                       title_highlight=render_highlight(row.title_highlight), snippet=render_highlight(row.snippet),
+                       score=row.score)
+             for row in result.all()]
+    return SearchResults(query=q, items=items)
@@ -0,0 +1,18 @@
+from typing import List, Literal, Optional
+
+from pydantic import BaseModel
+
+
+class SearchHit(BaseModel):
+    kind: Literal['tarot', 'service']
+    id: int  # user_id таролога или service_id услуги
+    tarot_id: int
+    title: str
+    title_highlight: str
+    snippet: Optional[str]  # фрагмент описания с подсветкой совпадений (<b>...</b>), остальной текст экранирован как HTML
+    score: float
+
+
+class SearchResults(BaseModel):
+    query: str
+    items: List[SearchHit]
@@ -1,13 +1,21 @@
-from sqlalchemy import Column, Integer, ForeignKey, String
+from sqlalchemy import Column, Integer, ForeignKey, String, Index
 
 from database import Base
+from fulltext import search_document, text_search_vector
 
 
 class Service(Base):
     __tablename__ = 'service'
-    service_id = Column(Integer, primary_key=True, index=True)
+    service_id = Column(Integer, primary_key=True)
     tarot_id = Column(Integer, ForeignKey('user_profile.user_id'))
     service_name = Column(String, index=True, nullable=False, unique=True)
     service_description = Column(String, nullable=True)
     specialization_id = Column(Integer, ForeignKey('specialization.specialization_id', ondelete='CASCADE'))
     service_price = Column(Integer, nullable=False)
+    __table_args__ = (
+        Index('ix_service_tarot_price', 'tarot_id', 'service_price'),
+        # поиск услуг (/search): по названию с опечатками и по названию с описанием (полнотекстовый)
+        Index('ix_service_name_trgm', search_document(service_name).label('name_document'),
+              postgresql_using='gin', postgresql_ops={'name_document': 'gin_trgm_ops'}),
+        Index('ix_service_text_search', text_search_vector(service_name, service_description), postgresql_using='gin'),
+    )
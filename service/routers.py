@@ -1,11 +1,14 @@
-from typing import List, Dict
+from typing import Optional
 
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Query
 from sqlalchemy import select
 from service.schemas import ServiceCreate, ServiceOut
 from service.models import Service
 from user.models import UserProfile
-from database import get_session
+from database import get_session, get_read_session
+from reference import reference_cache
+from cache import response_cache
+from pagination import Page, CountMode, paginate
 from sqlalchemy.ext.asyncio import AsyncSession
 
 router = APIRouter(
@@ -21,7 +24,7 @@ async def create_service(service: ServiceCreate, session: AsyncSession = Depends
     db_create_service = create_service_query.scalars().first()
     if db_create_service is None:
         raise HTTPException(status_code=404, detail="User not found")
-    if db_create_service.role_id != 1:  # Предполагается, что role_id для таролога равен 1
+    if db_create_service.role_id != await reference_cache.tarot_role_id():
         raise HTTPException(status_code=403, detail="User does not have the required role")
     db_service = Service(
         service_name=service.service_name,
@@ -32,6 +35,7 @@ async def create_service(service: ServiceCreate, session: AsyncSession = Depends
     session.add(db_service)
     await session.commit()
     await session.refresh(db_service)
+    await response_cache.invalidate_tags(f'tarot_services:{db_service.tarot_id}')
     return db_service
 
 
@@ -54,6 +58,7 @@ async def update_service_name(service_id: int, service_name: str, session: Async
     db_service_name.service_name = service_name
     await session.commit()
     await session.refresh(db_service_name)
+    await response_cache.invalidate_tags(f'tarot_services:{db_service_name.tarot_id}')
     return {"message": "Service name updated successfully"}
 
 
@@ -67,6 +72,7 @@ async def update_service_price(service_id: int, service_price: int, session: Asy
     db_service_price.service_price = service_price
     await session.commit()
     await session.refresh(db_service_price)
+    await response_cache.invalidate_tags(f'tarot_services:{db_service_price.tarot_id}')
     return {"message": "Service price updated successfully"}
 
 
@@ -81,12 +87,13 @@ async def update_service_description(service_id: int, service_description: str,
     db_service_description.service_description = service_description
     await session.commit()
     await session.refresh(db_service_description)
+    await response_cache.invalidate_tags(f'tarot_services:{db_service_description.tarot_id}')
     return {"message": "Service description updated successfully"}
 
 
 # услуга по айди
 @router.get("/find/{service_id}")
-async def read_service(service_id: int, session: AsyncSession = Depends(get_session)):
+async def read_service(service_id: int, session: AsyncSession = Depends(get_read_session)):
     find_service_query = await session.execute(select(Service).filter(Service.service_id == service_id))
     db_find_service = find_service_query.scalars().first()
     if not db_find_service:
@@ -94,24 +101,20 @@ async def read_service(service_id: int, session: AsyncSession = Depends(get_sess
     return db_find_service
 
 
-# вывод всех услуг у одного таролога
-@router.get('/{tarot_id}', response_model=Dict[str, ServiceOut])
-async def read_user_service(tarot_id: int, session: AsyncSession = Depends(get_session)):
+# вывод всех услуг у одного таролога (постранично)
+@router.get('/{tarot_id}', response_model=Page[ServiceOut])
+@response_cache.cached(ttl=60, stale_ttl=60, tags=lambda tarot_id, **_: [f'tarot_services:{tarot_id}'])
+async def read_user_service(tarot_id: int, limit: int = Query(50, ge=1, le=500), cursor: Optional[str] = None,
+                            count: CountMode = 'none', session: AsyncSession = Depends(get_read_session)):
     read_service_query = (
-        await session.execute(
-            select(Service)
-            .filter(Service.tarot_id == tarot_id)
-        )
+        select(Service.service_id, Service.service_name, Service.service_price)
+        .filter(Service.tarot_id == tarot_id)
     )
-    db_service = read_service_query.scalars().all()
-    if not db_service:
+    page = await paginate(session, read_service_query, [Service.service_id], limit, cursor, count)
+    if not page.rows and cursor is None:
         raise HTTPException(status_code=404, detail="No services found for this tarot")
 
-    services = {}
-    for index, service in enumerate(db_service, start=1):
-        services[str(index)] = service
-
-    return services
+    return page.to_page()
 
 
 # функция удаления услуги
@@ -123,6 +126,7 @@ async def delete_service(service_id: int, session: AsyncSession = Depends(get_se
         raise HTTPException(status_code=404, detail="Service not found")
     await session.delete(db_delete_service)
     await session.commit()
+    await response_cache.invalidate_tags(f'tarot_services:{db_delete_service.tarot_id}')
     return {"message": "Service deleted successfully"}
 
 
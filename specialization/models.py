@@ -1,4 +1,4 @@
-from sqlalchemy import  Column, Integer, String, ForeignKey
+from sqlalchemy import  Column, Integer, String, ForeignKey, Index
 from sqlalchemy.orm import relationship
 from database import Base
 
@@ -6,13 +6,18 @@ from database import Base
 class Specialization(Base):
     __tablename__ = 'specialization'
 
-    specialization_id = Column(Integer, primary_key=True, index=True)
+    specialization_id = Column(Integer, primary_key=True)
     specialization_name = Column(String, index=True, nullable=False, unique=True)
 
 
 class TarotSpecialization(Base):
     __tablename__ = 'tarot_specialization'
 
-    tarot_specialization_id = Column(Integer, primary_key=True, index=True)
+    tarot_specialization_id = Column(Integer, primary_key=True)
     specialization_id = Column(Integer, ForeignKey('specialization.specialization_id'))
     tarot_id = Column(Integer, ForeignKey('user_profile.user_id'))
+    __table_args__ = (
+        # одна связь на пару таролог - специализация
+        Index('uq_tarot_specialization_spec_tarot', 'specialization_id', 'tarot_id', unique=True),
+        Index('ix_tarot_specialization_tarot_spec', 'tarot_id', 'specialization_id'),
+    )
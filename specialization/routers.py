@@ -3,7 +3,9 @@ from sqlalchemy import select
 from specialization.schemas import SpecCreate, SpecOut, TarotSpecializationOut, TarotSpecializationCreate
 from specialization.models import Specialization, TarotSpecialization
 from user.models import UserProfile
-from database import get_session
+from database import get_session, get_read_session
+from reference import reference_cache
+from cache import response_cache
 from sqlalchemy.ext.asyncio import AsyncSession
 
 
@@ -21,6 +23,7 @@ async def create_specialization(spec: SpecCreate, session: AsyncSession = Depend
     session.add(db_spec)
     await session.commit()
     await session.refresh(db_spec)
+    reference_cache.invalidate()
     return db_spec
 
 
@@ -33,15 +36,14 @@ async def create_specialization_endpoint(spec: SpecCreate, session: AsyncSession
     return db_spec
 
 
-# название специализации по её айди
-@router.get("/find/{specialization_id}")
-async def read_specialization(specialization_id: int, session: AsyncSession = Depends(get_session)):
-    specialization_query = await session.execute(select(Specialization).filter(
-        Specialization.specialization_id == specialization_id))
-    db_create_specialization = specialization_query.scalars().first()
-    if not db_create_specialization:
+# название специализации по её айди (из кеша справочников)
+@router.get("/find/{specialization_id}", response_model=SpecOut)
+async def read_specialization(specialization_id: int):
+    await reference_cache.ensure_loaded()
+    specialization_name = reference_cache.specializations.name(specialization_id)
+    if specialization_name is None:
         raise HTTPException(status_code=404, detail='Specialization is not found')
-    return db_create_specialization
+    return SpecOut(specialization_id=specialization_id, specialization_name=specialization_name)
 
 
 # функция для удаления специализации
@@ -53,6 +55,8 @@ async def delete_specialization(specialization_id: int, session: AsyncSession =
         raise HTTPException(status_code=404, detail="Specialization not found")
     await session.delete(db_delete_specialization)
     await session.commit()
+    await response_cache.invalidate_tags('tarot_specializations')
+    reference_cache.invalidate()
     return {"message": "Specialization deleted successfully"}
 
 
@@ -71,8 +75,14 @@ async def create_specialization_bond(spec_bond: TarotSpecializationCreate, sessi
     db_specialization_bond = specialization_bond_query.scalar()
     if db_specialization_bond is None:
         raise HTTPException(status_code=404, detail="User not found")
-    if db_specialization_bond.role_id != 1:  # Предполагается, что role_id для таролога равен 1
+    if db_specialization_bond.role_id != await reference_cache.tarot_role_id():
         raise HTTPException(status_code=403, detail="User does not have the required role")
+    # пара таролог - специализация уникальна (uq_tarot_specialization_spec_tarot)
+    existing_bond_query = await session.execute(select(TarotSpecialization.tarot_specialization_id).filter(
+        TarotSpecialization.specialization_id == spec_bond.specialization_id,
+        TarotSpecialization.tarot_id == spec_bond.tarot_id))
+    if existing_bond_query.first() is not None:
+        raise HTTPException(status_code=400, detail="Tarot already has this specialization")
     db_spec_bond = TarotSpecialization(
         specialization_id=spec_bond.specialization_id,
         tarot_id=spec_bond.tarot_id
@@ -80,6 +90,7 @@ async def create_specialization_bond(spec_bond: TarotSpecializationCreate, sessi
     session.add(db_spec_bond)
     await session.commit()
     await session.refresh(db_spec_bond)
+    await response_cache.invalidate_tags(f'tarot_specializations:{spec_bond.tarot_id}')
     return db_spec_bond
 
 
@@ -94,7 +105,9 @@ async def create_specialization_endpoint(spec_bond: TarotSpecializationCreate, s
 
 # выводит все специализации определённого таролога
 @router.get("/tarot_specializations/{tarot_id}")
-async def read_specialization_by_tarot(tarot_id: int, session: AsyncSession = Depends(get_session)):
+@response_cache.cached(ttl=300, stale_ttl=300,
+                       tags=lambda tarot_id, **_: [f'tarot_specializations:{tarot_id}', 'tarot_specializations'])
+async def read_specialization_by_tarot(tarot_id: int, session: AsyncSession = Depends(get_read_session)):
     read_specialization_bond_query = (
         await session.execute(
             select(Specialization.specialization_name)
@@ -119,7 +132,7 @@ async def read_specialization_by_tarot(tarot_id: int, session: AsyncSession = De
 
 # выводит всех тарологов по определённой специализации
 @router.get("/specialization_tarots/{specialization_id}")
-async def read_tarot_by_specialization(specialization_id: int, session: AsyncSession = Depends(get_session)):
+async def read_tarot_by_specialization(specialization_id: int, session: AsyncSession = Depends(get_read_session)):
     specialization_bond_query = await session.execute(select(UserProfile).join(TarotSpecialization).join(Specialization)
         .filter(TarotSpecialization.specialization_id == specialization_id))
     db_specialization_bond = specialization_bond_query.scalars().all()
@@ -139,6 +152,7 @@ async def delete_tarots_specialization(tarot_id: int, specialization_id: int, se
         raise HTTPException(status_code=404, detail="Tarot/Specialization not found")
     await session.delete(db_delete_tarot_specialization)
     await session.commit()
+    await response_cache.invalidate_tags(f'tarot_specializations:{tarot_id}')
     return {"message": "Tarot's specialization deleted successfully"}
 
 
@@ -6,6 +6,6 @@ from database import Base
 class Status(Base):
    __tablename__ = 'status'
 
-   status_id = Column(Integer, primary_key=True, index=True)
+   status_id = Column(Integer, primary_key=True)
    status_name = Column(String, index=True, nullable=False, unique=True)
 
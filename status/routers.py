@@ -4,6 +4,7 @@ from sqlalchemy import select
 from status.models import Status
 from status.schemas import StatusCreate, StatusOut
 from database import get_session
+from reference import reference_cache
 
 router = APIRouter(
     prefix='/status',
@@ -18,6 +19,7 @@ async def create_status(stat: StatusCreate, session: AsyncSession = Depends(get_
    session.add(db_stat)
    await session.commit()
    await session.refresh(db_stat)
+   reference_cache.invalidate()
    return db_stat
 
 
@@ -30,14 +32,14 @@ async def create_status_endpoint(stat: StatusCreate, session: AsyncSession = Dep
    return db_status
 
 
-# название статуса по его айди
-@router.get("/{status_id}")
-async def read_status(status_id: int, session: AsyncSession = Depends(get_session)):
-   status_query = await session.execute(select(Status).filter(Status.status_id == status_id))
-   db_status = status_query.scalars().first()
-   if not db_status:
+# название статуса по его айди (из кеша справочников)
+@router.get("/{status_id}", response_model=StatusOut)
+async def read_status(status_id: int):
+   await reference_cache.ensure_loaded()
+   status_name = reference_cache.statuses.name(status_id)
+   if status_name is None:
        raise HTTPException(status_code=404, detail='Status is not found')
-   return db_status
+   return StatusOut(status_id=status_id, status_name=status_name)
 
 
 # функция для удаления статуса
@@ -48,6 +50,7 @@ async def delete_status(status_id: int, session: AsyncSession = Depends(get_sess
        raise HTTPException(status_code=404, detail="Status not found")
    await session.delete(db_status)
    await session.commit()
+   reference_cache.invalidate()
    return {"message": "Status deleted successfully"}
 
 
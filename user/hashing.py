@@ -0,0 +1,117 @@
+import asyncio
+import os
+import time
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import List, Optional
+
+import bcrypt
+from fastapi import HTTPException
+
+from stats import Histogram
+
+# настройки хеширования паролей (задаются через переменные окружения)
+BCRYPT_ROUNDS = int(os.getenv('BCRYPT_ROUNDS', '12'))  # work factor bcrypt
+HASH_POOL_KIND = os.getenv('HASH_POOL_KIND', 'thread')  # thread или process
+HASH_POOL_WORKERS = int(os.getenv('HASH_POOL_WORKERS', str(os.cpu_count() or 1)))
+HASH_QUEUE_DEPTH = int(os.getenv('HASH_QUEUE_DEPTH', '64'))  # максимум задач в работе и в очереди
+
+
+# функции, выполняемые в пуле (на уровне модуля, чтобы их можно было передать в процесс)
+def _hash(password: bytes, rounds: int) -> bytes:
+    return bcrypt.hashpw(password, bcrypt.gensalt(rounds))
+
+
+# пакетное хеширование для массового импорта (одна задача пула на пачку паролей)
+def hash_many(passwords: List[str], rounds: int) -> List[str]:
+    return [_hash(password.encode('utf-8'), rounds).decode('utf-8') for password in passwords]
+
+
+def _check(password: bytes, hashed_password: bytes) -> bool:
+    return bcrypt.checkpw(password, hashed_password)
+
+
+def _run_timed(fn, *args):
+    # time.time(), а не monotonic, так как замер может идти в другом процессе
+    started = time.time()
+    result = fn(*args)
+    return result, started, time.time()
+
+
+# метрики хеширования: ожидание в очереди и время самого bcrypt
+class HashingMetrics:
+    def __init__(self):
+        self.queue_wait = Histogram()
+        self.hash_time = {'hash': Histogram(), 'verify': Histogram()}
+        self.rejected = 0
+        self.rehashed = 0
+        self.in_flight = 0
+
+    def snapshot(self):
+        return {
+            'in_flight': self.in_flight,
+            'rejected': self.rejected,
+            'rehashed': self.rehashed,
+            'queue_wait_seconds': self.queue_wait.snapshot(),
+            'hash_seconds': {name: histogram.snapshot() for name, histogram in self.hash_time.items()}
+        }
+
+
+# хеширование паролей в ограниченном пуле потоков/процессов, чтобы не блокировать event loop
+class PasswordHasher:
+    def __init__(self, rounds: int = BCRYPT_ROUNDS, pool_kind: str = HASH_POOL_KIND,
+                 workers: int = HASH_POOL_WORKERS, queue_depth: int = HASH_QUEUE_DEPTH):
+        if pool_kind not in ('thread', 'process'):
+            raise ValueError(f'Unknown hash pool kind: {pool_kind}')
+        self.rounds = rounds
+        self.pool_kind = pool_kind
+        self.workers = workers
+        self.queue_depth = queue_depth
+        self.metrics = HashingMetrics()
+        self._executor: Optional[Executor] = None
+
+    def _get_executor(self) -> Executor:
+        if self._executor is None:
+            if self.pool_kind == 'process':
+                self._executor = ProcessPoolExecutor(max_workers=self.workers)
+            else:
+                self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='bcrypt')
+        return self._executor
+
+    async def _submit(self, operation: str, fn, *args):
+        # при переполнении очереди сразу отказываем, а не копим задачи в памяти
+        if self.metrics.in_flight >= self.queue_depth:
+            self.metrics.rejected += 1
+            raise HTTPException(status_code=503, detail='Password hashing is overloaded, try again later',
+                                headers={'Retry-After': '1'})
+        self.metrics.in_flight += 1
+        submitted = time.time()
+        try:
+            loop = asyncio.get_running_loop()
+            result, started, finished = await loop.run_in_executor(self._get_executor(), _run_timed, fn, *args)
+        finally:
+            self.metrics.in_flight -= 1
+        self.metrics.queue_wait.observe(max(started - submitted, 0.0))
+        self.metrics.hash_time[operation].observe(finished - started)
+        return result
+
+    async def hash(self, password: str) -> str:
+        hashed_password = await self._submit('hash', _hash, password.encode('utf-8'), self.rounds)
+        return hashed_password.decode('utf-8')
+
+    async def verify(self, password: str, hashed_password: str) -> bool:
+        return await self._submit('verify', _check, password.encode('utf-8'), hashed_password.encode('utf-8'))
+
+    # хеш создан с другим work factor и должен быть пересчитан при входе
+    def needs_rehash(self, hashed_password: str) -> bool:
+        try:
+            return int(hashed_password.split('$')[2]) != self.rounds
+        except (IndexError, ValueError):
+            return True
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
+
+
+password_hasher = PasswordHasher()
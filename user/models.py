@@ -1,12 +1,13 @@
-from sqlalchemy import Boolean, Column, Integer, String, ForeignKey, Date, DateTime, Float, func, UniqueConstraint
+from sqlalchemy import Boolean, Column, Integer, String, ForeignKey, Date, DateTime, Float, func, UniqueConstraint, Index
 from sqlalchemy.orm import relationship
 from database import Base
+from fulltext import search_document, text_search_vector
 
 
 class UserProfile(Base):
     __tablename__ = 'user_profile'
 
-    user_id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, primary_key=True)
     role_id = Column(Integer, ForeignKey('role.role_id'))
     username = Column(String, index=True, nullable=False, unique=True)
     email = Column(String, index=True, unique=True, nullable=False)
@@ -23,3 +24,18 @@ class UserProfile(Base):
     tarot_experience = Column(Float, nullable=True)
     tarot_rating = Column(Float, nullable=True, default=0)
     review_count = Column(Integer, nullable=True, default=0)
+    rating_sum = Column(Integer, nullable=False, default=0, server_default='0')  # сумма оценок для расчета рейтинга
+
+    __table_args__ = (
+        # индексы каталога тарологов: сортировка по рейтингу и количеству отзывов среди неудаленных
+        Index('ix_user_profile_role_rating', role_id, func.coalesce(tarot_rating, 0), user_id,
+              postgresql_where=(is_deleted == False)),
+        Index('ix_user_profile_role_reviews', role_id, func.coalesce(review_count, 0), user_id,
+              postgresql_where=(is_deleted == False)),
+        # поиск тарологов (/search): по имени с опечатками и префиксами (триграммы) и по описанию (полнотекстовый)
+        Index('ix_user_profile_name_trgm', search_document(username, first_name, second_name).label('name_document'),
+              postgresql_using='gin', postgresql_ops={'name_document': 'gin_trgm_ops'},
+              postgresql_where=(is_deleted == False)),
+        Index('ix_user_profile_description_search', text_search_vector(user_description), postgresql_using='gin',
+              postgresql_where=(is_deleted == False)),
+    )
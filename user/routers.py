@@ -1,35 +1,41 @@
+import asyncio
+import os
 from datetime import datetime
 import time
-import bcrypt
-from fastapi import APIRouter, Depends, HTTPException
+from typing import Optional
+
+from fastapi import APIRouter, Depends, HTTPException, Query, Response
 from sqlalchemy import select
-from sqlalchemy import or_
 from sqlalchemy.ext.asyncio import AsyncSession
 from user.models import UserProfile
-from user.schemas import UserCreate, UserOut
-from database import get_session
+from user.schemas import UserCreate, UserOut, UserInfoOut, TarotInfoOut
+from user.hashing import password_hasher
+from database import get_session, get_read_session, async_session_maker
+from reference import reference_cache
+from cache import response_cache
+from pagination import Page, CountMode, paginate, ndjson_response
 from favorite.routers import read_user_favorite_tarots
 from message.routers import get_last_message
-
-# from fastapi_cache.decorator import cache
+from notification.audience import init_notification_state
 
 router = APIRouter(
     prefix='/user',
     tags=['User']
 )
 
+TAROT_CATALOG_TTL = float(os.getenv('TAROT_CATALOG_TTL', '30'))  # время жизни кеша каталога для get_info, сек
+TAROT_CATALOG_LIMIT = 50  # размер страницы каталога на главном экране
+TAROT_CATALOG_TAG = 'tarot_catalog'  # тег кеша каталога, сбрасывается при изменении профилей
 
+
+# хеширование пароля выполняется в пуле password_hasher, а не в event loop
 async def hash_password(password: str) -> str:
-    # Генерируем соль
-    salt = bcrypt.gensalt()
-    # Хешируем пароль с использованием соли
-    hashed_password = bcrypt.hashpw(password.encode('utf-8'), salt)
-    return hashed_password.decode('utf-8')
+    return await password_hasher.hash(password)
 
 
 # функция сверки пароля с его хеш версией
 async def verify_password(password: str, hashed_password: str) -> bool:
-    return bcrypt.checkpw(password.encode('utf-8'), hashed_password.encode('utf-8'))
+    return await password_hasher.verify(password, hashed_password)
 
 
 # Функция для создания пользователя
@@ -44,8 +50,11 @@ async def create_user(user: UserCreate, session: AsyncSession = Depends(get_sess
         date_birth=user.date_birth
     )
     session.add(db_user)
+    await session.flush()
+    await init_notification_state(db_user.user_id, session)
     await session.commit()
     await session.refresh(db_user)
+    await response_cache.invalidate_tags(TAROT_CATALOG_TAG)
     return db_user
 
 
@@ -69,6 +78,7 @@ async def update_user_is_deleted(user_id: int, is_deleted: bool, session: AsyncS
     db_user.is_deleted = is_deleted
     await session.commit()
     await session.refresh(db_user)
+    await response_cache.invalidate_tags(TAROT_CATALOG_TAG)
     return {"message": "User is_deleted updated successfully"}
 
 
@@ -85,6 +95,7 @@ async def update_user_first_name(user_id: int, first_name: str, session: AsyncSe
     await session.commit()
     await session.refresh(db_user)
 
+    await response_cache.invalidate_tags(TAROT_CATALOG_TAG)
     return {"message": "User first_name updated successfully"}
 
 
@@ -100,6 +111,7 @@ async def update_user_second_name(user_id: int, second_name: str, session: Async
     db_user.second_name = second_name
     await session.commit()
     await session.refresh(db_user)
+    await response_cache.invalidate_tags(TAROT_CATALOG_TAG)
     return {"message": "User second_name updated successfully"}
 
 
@@ -130,6 +142,7 @@ async def update_user_description(user_id: int, user_description: str, session:
     db_user.user_description = user_description
     await session.commit()
     await session.refresh(db_user)
+    await response_cache.invalidate_tags(TAROT_CATALOG_TAG)
     return {"message": "User description updated successfully"}
 
 
@@ -141,7 +154,7 @@ async def update_tarot_experience(user_id: int, tarot_experience: float, session
 
     if db_user is None:
         raise HTTPException(status_code=404, detail="User not found")
-    if db_user.role_id != 1:  # Предполагается, что role_id для таролога равен 1
+    if db_user.role_id != await reference_cache.tarot_role_id():
         raise HTTPException(status_code=403, detail="User does not have the required role")
 
     db_user.tarot_experience = tarot_experience
@@ -152,7 +165,7 @@ async def update_tarot_experience(user_id: int, tarot_experience: float, session
 
 # юзер по айди
 @router.get("/find/{user_id}")
-async def read_user(user_id: int, session: AsyncSession = Depends(get_session)):
+async def read_user(user_id: int, session: AsyncSession = Depends(get_read_session)):
     db_user = await session.execute(select(UserProfile).filter(UserProfile.user_id == user_id))
     db_user = db_user.scalar()
 
@@ -162,39 +175,45 @@ async def read_user(user_id: int, session: AsyncSession = Depends(get_session)):
     return db_user
 
 
-# вывод всех пользователей
-@router.get('/find_users')
-async def read_users(session: AsyncSession = Depends(get_session)):
-    read_users_query = await session.execute(
-        select(UserProfile).filter(
-            or_(UserProfile.role_id == 1, UserProfile.role_id == 2)
-        )
+# проекция профиля без пароля для списков и выгрузки
+USER_INFO_COLUMNS = (
+    UserProfile.user_id,
+    UserProfile.role_id,
+    UserProfile.username,
+    UserProfile.email,
+    UserProfile.phone_number,
+    UserProfile.date_birth,
+    UserProfile.first_name,
+    UserProfile.second_name,
+    UserProfile.user_description,
+    UserProfile.date_registration,
+    UserProfile.tarot_experience,
+    UserProfile.tarot_rating,
+    UserProfile.review_count,
+    UserProfile.is_deleted
+)
+
+
+# вывод всех пользователей (постранично)
+@router.get('/find_users', response_model=Page[UserInfoOut])
+async def read_users(limit: int = Query(50, ge=1, le=500), cursor: Optional[str] = None, count: CountMode = 'none',
+                     session: AsyncSession = Depends(get_read_session)):
+    read_users_query = select(*USER_INFO_COLUMNS).filter(
+        UserProfile.role_id.in_([await reference_cache.tarot_role_id(), await reference_cache.client_role_id()])
     )
-    db_users = read_users_query.scalars().all()
+    page = await paginate(session, read_users_query, [UserProfile.user_id], limit, cursor, count)
 
-    if not db_users:
+    if not page.rows and cursor is None:
         raise HTTPException(status_code=404, detail='Users is not found')
 
-    users = {}
-    for index, user in enumerate(db_users, start=1):
-        user_info = {
-            'user_id': user.user_id,
-            'role_id': user.role_id,
-            'username': user.username,
-            'email': user.email,
-            'phone_number': user.phone_number,
-            'date_birth': user.date_birth,
-            'first_name': user.first_name,
-            'second_name': user.second_name,
-            'user_description': user.user_description,
-            'date_registration': user.date_registration,
-            'tarot_experience': user.tarot_experience,
-            'tarot_rating': user.tarot_rating,
-            'review_count': user.review_count,
-            'is_deleted': user.is_deleted
-        }
-        users[str(index)] = user_info
-    return users
+    return page.to_page()
+
+
+# выгрузка всех пользователей в NDJSON (для администраторов)
+@router.get('/export_users')
+async def export_users():
+    export_query = select(*USER_INFO_COLUMNS).order_by(UserProfile.user_id)
+    return ndjson_response(export_query, filename='users.ndjson')
 
 
 # функция для удаления юзера
@@ -207,6 +226,7 @@ async def delete_user(user_id: int, session: AsyncSession = Depends(get_session)
 
     await session.delete(db_user)
     await session.commit()
+    await response_cache.invalidate_tags(TAROT_CATALOG_TAG)
 
     return {"message": "User deleted successfully"}
 
@@ -228,73 +248,91 @@ async def authenticate_user(email: str, password: str, session: AsyncSession = D
     if not await verify_password(password, db_user.password_hashed):
         raise HTTPException(status_code=401, detail='Неправильные email или пароль')
 
+    # если work factor изменился, прозрачно перехешируем пароль при входе
+    if password_hasher.needs_rehash(db_user.password_hashed):
+        db_user.password_hashed = await hash_password(password)
+        await session.commit()
+        await session.refresh(db_user)
+        password_hasher.metrics.rehashed += 1
+
     return db_user
 
 
-# информация про всех существующих тарологов
-@router.get('/find_tarot')
-async def read_tarot(session: AsyncSession = Depends(get_session)):
-    read_tarot_query = await session.execute(select(UserProfile).filter(UserProfile.role_id == 1))
-    db_users = read_tarot_query.scalars().all()
-    if not db_users:
+# метрики пула хеширования паролей
+@router.get('/hashing_metrics')
+async def read_hashing_metrics():
+    return password_hasher.metrics.snapshot()
+
+
+# информация про всех существующих тарологов (постранично, через кеш ответов)
+@router.get('/find_tarot', response_model=Page[TarotInfoOut])
+@response_cache.cached(ttl=TAROT_CATALOG_TTL, stale_ttl=TAROT_CATALOG_TTL, tags=lambda **_: [TAROT_CATALOG_TAG])
+async def read_tarot(limit: int = Query(50, ge=1, le=500), cursor: Optional[str] = None, count: CountMode = 'none',
+                     session: AsyncSession = Depends(get_read_session)):
+    read_tarot_query = select(
+        UserProfile.user_id,
+        UserProfile.first_name,
+        UserProfile.second_name,
+        UserProfile.user_description,
+        UserProfile.tarot_rating,
+        UserProfile.review_count
+    ).filter(UserProfile.role_id == await reference_cache.tarot_role_id())
+    page = await paginate(session, read_tarot_query, [UserProfile.user_id], limit, cursor, count)
+    if not page.rows and cursor is None:
         raise HTTPException(status_code=404, detail='Tarot is not found')
 
-    tarots = {}
-    for index, user in enumerate(db_users, start=1):
-        tarot_info = {
-            'tarot_id': user.user_id,
-            'first_name': user.first_name,
-            'second_name': user.second_name,
-            'user_description': user.user_description,
-            'tarot_rating': user.tarot_rating,
-            'review_count': user.review_count  # по умолчанию количество отзывов 0
-        }
-        tarots[str(index)] = tarot_info
-    return tarots
-
+    return page.to_page(lambda user: TarotInfoOut(
+        tarot_id=user.user_id,
+        first_name=user.first_name,
+        second_name=user.second_name,
+        user_description=user.user_description,
+        tarot_rating=user.tarot_rating,
+        review_count=user.review_count  # по умолчанию количество отзывов 0
+    ))
 
-@router.get('/get_info/{email}/{password_hashed}')
-async def get_info(email: str, password_hashed: str, session: AsyncSession = Depends(get_session)):
-    # Проверяем аутентификацию пользователя
-    user = await authenticate_user(email, password_hashed, session=session)
-
-    favorite_info = None
-    tarot_info = None
-    message_info = None
-    profile_info = None
 
+# выполнение секции get_info в отдельной сессии пула с замером времени; 404 означает пустую секцию
+async def run_info_section(name: str, section, timings: dict):
+    started = time.perf_counter()
     try:
-        favorite_info = await read_user_favorite_tarots(user.user_id, session=session)
+        async with async_session_maker() as section_session:
+            return await section(section_session)
     except HTTPException as e:
         if e.status_code != 404:
             raise e
+        return None
+    finally:
+        timings[name] = round((time.perf_counter() - started) * 1000, 2)
 
-    try:
-        tarot_info = await read_tarot(session=session)
-    except HTTPException as e:
-        if e.status_code != 404:
-            raise e
 
-    try:
-        message_info = await get_last_message(user.user_id, session=session)
-    except HTTPException as e:
-        if e.status_code != 404:
-            raise e
+@router.get('/get_info/{email}/{password_hashed}')
+async def get_info(email: str, password_hashed: str, response: Response,
+                   session: AsyncSession = Depends(get_session)):
+    timings = {}
+    started = time.perf_counter()
+    # Проверяем аутентификацию пользователя; загруженный профиль повторно не читается
+    user = await authenticate_user(email, password_hashed, session=session)
+    timings['auth'] = round((time.perf_counter() - started) * 1000, 2)
+
+    # независимые секции выполняются параллельно, каждая в своей сессии
+    favorite_info, tarot_info, message_info = await asyncio.gather(
+        run_info_section('favorite', lambda section_session: read_user_favorite_tarots(
+            user.user_id, limit=50, cursor=None, count='none', session=section_session), timings),
+        # первая страница каталога приходит из общего кеша ответов (read_tarot)
+        run_info_section('tarot', lambda section_session: read_tarot(
+            limit=TAROT_CATALOG_LIMIT, cursor=None, count='none', session=section_session), timings),
+        run_info_section('message', lambda section_session: get_last_message(
+            user.user_id, session=section_session), timings)
+    )
 
-    try:
-        profile_info = await read_user(user.user_id, session=session)
-    except HTTPException as e:
-        if e.status_code != 404:
-            raise e
+    # время секций в заголовке Server-Timing для просмотра в браузере и в логах прокси
+    response.headers['Server-Timing'] = ', '.join(f'{name};dur={duration}' for name, duration in timings.items())
 
-    response = {
-        "profile_info": profile_info,
+    return {
+        "profile_info": UserInfoOut.model_validate(user, from_attributes=True),
         "favorite_info": favorite_info,
-        "message_info": message_info
+        "message_info": message_info,
+        # первая страница каталога тарологов
+        "tarot_info": tarot_info,
+        "timings_ms": timings
     }
-
-    # Добавляем информацию о тарологах отдельно
-    if tarot_info:
-        response.update(tarot_info)
-
-    return response
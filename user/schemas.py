@@ -1,5 +1,6 @@
 from pydantic import Field
-from datetime import datetime
+from datetime import datetime, date
+from typing import Optional
 
 from pydantic import BaseModel
 
@@ -22,3 +23,30 @@ class UserOut(BaseModel):
     phone_number: str
     date_birth: datetime
 
+
+# Pydantic модель для списка пользователей
+class UserInfoOut(BaseModel):
+    user_id: int
+    role_id: Optional[int]
+    username: str
+    email: str
+    phone_number: str
+    date_birth: date
+    first_name: Optional[str]
+    second_name: Optional[str]
+    user_description: Optional[str]
+    date_registration: datetime
+    tarot_experience: Optional[float]
+    tarot_rating: Optional[float]
+    review_count: Optional[int]
+    is_deleted: bool
+
+
+# Pydantic модель для каталога тарологов
+class TarotInfoOut(BaseModel):
+    tarot_id: int
+    first_name: Optional[str]
+    second_name: Optional[str]
+    user_description: Optional[str]
+    tarot_rating: Optional[float]
+    review_count: Optional[int]
@@ -1,16 +1,22 @@
-from sqlalchemy import Column, Integer, String, ForeignKey, DateTime, func
+from sqlalchemy import Column, Integer, String, ForeignKey, DateTime, func, Index
 
 from database import Base
 
 
 class UserServiceHistory(Base):
     __tablename__ = 'user_service_history'
-    history_id = Column(Integer, primary_key=True, index=True)
+    history_id = Column(Integer, primary_key=True)
     user_id = Column(Integer, ForeignKey('user_profile.user_id'))
     service_id = Column(Integer, ForeignKey('service.service_id'))
-    tarot_id = Column(Integer, unique=False, nullable=False, index=True)
+    tarot_id = Column(Integer, unique=False, nullable=False)
     status_id = Column(Integer, ForeignKey('status.status_id', ondelete='CASCADE'))
     review_title = Column(String, nullable=True)
     review_text = Column(String, nullable=True)
     review_value = Column(Integer, nullable=True, default=0)
     review_date_time = Column(DateTime, nullable=True, default=func.now())
+
+    __table_args__ = (
+        # история пользователя и отзывы таролога (пересчет рейтинга читает только индекс)
+        Index('ix_user_service_history_user_id', 'user_id'),
+        Index('ix_user_service_history_tarot_review', 'tarot_id', 'review_value'),
+    )
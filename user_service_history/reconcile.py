@@ -0,0 +1,76 @@
+import argparse
+import asyncio
+from typing import List, Dict
+
+from sqlalchemy import select, update, func, or_, cast, Float, text
+
+from database import async_session_maker
+from user.models import UserProfile
+from user_service_history.models import UserServiceHistory
+
+
+# сверка накопленных rating_sum/review_count с историей отзывов одним set-based запросом
+# запуск: python -m user_service_history.reconcile [--fix]
+async def reconcile_tarot_ratings(fix: bool = False) -> List[Dict]:
+    actual = (
+        select(
+            UserServiceHistory.tarot_id,
+            func.sum(UserServiceHistory.review_value).label('rating_sum'),
+            func.count().label('review_count')
+        )
+        .filter(UserServiceHistory.review_value != 0)
+        .group_by(UserServiceHistory.tarot_id)
+        .subquery()
+    )
+    actual_sum = func.coalesce(actual.c.rating_sum, 0)
+    actual_count = func.coalesce(actual.c.review_count, 0)
+
+    drift_query = (
+        select(
+            UserProfile.user_id,
+            UserProfile.rating_sum,
+            UserProfile.review_count,
+            actual_sum.label('actual_rating_sum'),
+            actual_count.label('actual_review_count')
+        )
+        .outerjoin(actual, actual.c.tarot_id == UserProfile.user_id)
+        .filter(or_(
+            UserProfile.rating_sum.is_distinct_from(actual_sum),
+            func.coalesce(UserProfile.review_count, 0) != actual_count
+        ))
+        .order_by(UserProfile.user_id)
+    )
+
+    async with async_session_maker() as session:
+        # агрегат по всей истории не укладывается в statement_timeout пула; SET LOCAL действует до конца транзакции
+        await session.execute(text('SET LOCAL statement_timeout = 0'))
+        drift_result = await session.execute(drift_query)
+        drift = [dict(row._mapping) for row in drift_result]
+
+        if fix and drift:
+            drift_subquery = drift_query.subquery()
+            await session.execute(
+                update(UserProfile)
+                .where(UserProfile.user_id == drift_subquery.c.user_id)
+                .values(
+                    rating_sum=drift_subquery.c.actual_rating_sum,
+                    review_count=drift_subquery.c.actual_review_count,
+                    tarot_rating=cast(drift_subquery.c.actual_rating_sum, Float)
+                    / func.nullif(drift_subquery.c.actual_review_count, 0)
+                )
+                .execution_options(synchronize_session=False)
+            )
+            await session.commit()
+    return drift
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Reconcile tarot ratings with the review history')
+    parser.add_argument('--fix', action='store_true', help='overwrite drifted ratings with recomputed values')
+    args = parser.parse_args()
+
+    drifted = asyncio.run(reconcile_tarot_ratings(fix=args.fix))
+    for row in drifted:
+        print(f"tarot {row['user_id']}: stored sum={row['rating_sum']} count={row['review_count']}, "
+              f"actual sum={row['actual_rating_sum']} count={row['actual_review_count']}")
+    print(f"drifted tarots: {len(drifted)}{' (fixed)' if args.fix and drifted else ''}")
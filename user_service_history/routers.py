@@ -1,13 +1,15 @@
 from datetime import datetime
 from typing import List, Dict
 from fastapi import APIRouter, Depends, HTTPException
-from sqlalchemy import select, update, func
+from sqlalchemy import select, update, func, cast, Float
 from sqlalchemy.orm import aliased
 from user.models import UserProfile
-from status.models import Status
 from service.models import Service
 from user_service_history.models import UserServiceHistory
-from database import get_session
+from database import get_session, get_read_session
+from reference import reference_cache
+from cache import response_cache
+from user.routers import TAROT_CATALOG_TAG
 from sqlalchemy.ext.asyncio import AsyncSession
 from user_service_history.schemas import UserServiceHistoryCreate, UserServiceHistoryOut, UserServiceHistoryUpdateReview
 
@@ -47,8 +49,9 @@ async def create_user_endpoint(history: UserServiceHistoryCreate, session: Async
 
 # Функция для обновления отзыва
 async def update_review(history_update: UserServiceHistoryUpdateReview, session: AsyncSession = Depends(get_session)):
+    # блокируем строку истории, чтобы параллельные отзывы видели актуальную старую оценку
     history_review_update_query = await session.execute(select(UserServiceHistory).filter(
-        UserServiceHistory.history_id == history_update.history_id))
+        UserServiceHistory.history_id == history_update.history_id).with_for_update())
     history_review_update = history_review_update_query.scalars().first()
 
     if not history_review_update:
@@ -65,38 +68,33 @@ async def update_review(history_update: UserServiceHistoryUpdateReview, session:
 
     await session.commit()
     await session.refresh(history_review_update)
+    # рейтинг таролога виден в кешированном каталоге
+    await response_cache.invalidate_tags(TAROT_CATALOG_TAG)
     return history_review_update
 
 
 # Функция для обновления рейтинга таролога при добавлении новой оценки
+# Рейтинг хранится как rating_sum и review_count и меняется одним атомарным UPDATE, без commit
 async def update_tarot_rating(tarot_id: int, old_review_value: int, new_review_value: int, session: AsyncSession):
-    tarot_rating_update_query = await session.execute(select(UserProfile).filter(UserProfile.user_id == tarot_id))
-    db_tarot_rating_update = tarot_rating_update_query.scalars().first()
-    if not db_tarot_rating_update:
+    old_review_value = old_review_value or 0
+    # новый отзыв увеличивает количество, повторная оценка только заменяет старое значение в сумме
+    review_count_increment = 1 if old_review_value == 0 and new_review_value != 0 else 0
+    new_rating_sum = func.coalesce(UserProfile.rating_sum, 0) - old_review_value + new_review_value
+    new_review_count = func.coalesce(UserProfile.review_count, 0) + review_count_increment
+    tarot_rating_update_query = await session.execute(
+        update(UserProfile)
+        .where(UserProfile.user_id == tarot_id)
+        .values(
+            rating_sum=new_rating_sum,
+            review_count=new_review_count,
+            tarot_rating=cast(new_rating_sum, Float) / func.nullif(new_review_count, 0)
+        )
+        .returning(UserProfile.user_id)
+        .execution_options(synchronize_session=False)
+    )
+    if tarot_rating_update_query.first() is None:
         raise HTTPException(status_code=404, detail="Tarot profile not found")
 
-    # Получаем текущие значения средней оценки и количество отзывов с review_value != 0
-    current_reviews_query = await session.execute(select(UserServiceHistory).filter(
-        UserServiceHistory.tarot_id == tarot_id,
-        UserServiceHistory.review_value != 0
-    ))
-    current_reviews = current_reviews_query.scalars().all()
-    current_reviews_count = len(current_reviews)
-    print(current_reviews_count)
-    if current_reviews_count == 0:
-        db_tarot_rating_update.tarot_rating = new_review_value if new_review_value != 0 else None
-    else:
-        # Пересчитываем сумму всех отзывов с review_value != 0
-        current_reviews_sum = sum(review.review_value for review in current_reviews)
-        # Обновляем сумму с учетом нового и старого значения review_value
-        new_reviews_sum = current_reviews_sum - old_review_value + new_review_value
-        # Пересчитываем среднюю оценку
-        new_rating = new_reviews_sum / (current_reviews_count + 1)
-        # Обновляем среднюю оценку таролога в таблице UserProfile
-        db_tarot_rating_update.tarot_rating = new_rating
-        db_tarot_rating_update.review_count += 1
-    await session.commit()
-
 
 # Маршрут для обновления отзыва
 @router.post("/update_review/{history_id}")
@@ -114,20 +112,17 @@ async def update_service_status(history_id: int, status_id: int, session: AsyncS
     db_update_service_status = update_service_status_query.scalars().first()
     if db_update_service_status is None:
         raise HTTPException(status_code=404, detail="History record not found")
-    service_status_query = await session.execute(select(Status).filter(
-        Status.status_id == status_id))
-    db_service_status = service_status_query.scalars().first()
-    if db_service_status is None:
+    await reference_cache.ensure_loaded()
+    if reference_cache.statuses.name(status_id) is None:
         raise HTTPException(status_code=404, detail="Status not found")
     db_update_service_status.status_id = status_id
     await session.commit()
-    await session.refresh(db_service_status)
     return {"message": "Status updated successfully"}
 
 
 # вывод user_service_history
 @router.get("/{history_id}")
-async def read_user_service_history(history_id: int, session: AsyncSession = Depends(get_session)):
+async def read_user_service_history(history_id: int, session: AsyncSession = Depends(get_read_session)):
     history_query = await session.execute(select(UserServiceHistory).filter(
         UserServiceHistory.history_id == history_id))
     history = history_query.scalars().first()
@@ -138,7 +133,7 @@ async def read_user_service_history(history_id: int, session: AsyncSession = Dep
 
 # все купленные услуги пользователя
 @router.get('/{user_id}', response_model=Dict[str, UserServiceHistoryOut])
-async def read_user_service_history(user_id: int, session: AsyncSession = Depends(get_session)):
+async def read_user_service_history(user_id: int, session: AsyncSession = Depends(get_read_session)):
     read_service_history_query = (
         await session.execute(
             select(UserServiceHistory.history_id,